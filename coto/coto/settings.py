@@ -3,6 +3,7 @@ import os
 from pathlib import Path
 import sys
 
+from django.core.exceptions import ImproperlyConfigured
 from django.utils.translation import gettext_lazy as _
 from dotenv import load_dotenv
 
@@ -69,6 +70,57 @@ CHUNKED_UPLOAD_EXPIRATION_DELTA = timedelta(days=1)
 CHUNKED_UPLOAD_PATH = "chunked_uploads/%Y/%m/%d"
 CHUNKED_UPLOAD_TO = CHUNKED_UPLOAD_PATH + "/%Y/%m/%d.part"
 CHUNKED_UPLOAD_MAX_BYTES = None
+# Незавершённые загрузки без новых чанков дольше этого срока удаляются
+# вместе с файлами (задача upload.tasks.cleanup_stale_chunked_uploads).
+# Должен быть не меньше CHUNKED_UPLOAD_EXPIRATION_DELTA
+CHUNKED_UPLOAD_GC_AFTER = timedelta(
+    seconds=int(os.getenv("CHUNKED_UPLOAD_GC_AFTER", "172800")),
+)
+# Алгоритм контрольных сумм чанков по умолчанию: md5, sha256, blake2b
+# или xxh64 (если установлен пакет xxhash)
+CHUNKED_UPLOAD_CHECKSUM_ALGORITHM = os.getenv(
+    "DJANGO_CHUNKED_UPLOAD_CHECKSUM_ALGORITHM",
+    "md5",
+)
+
+# Лимиты загрузки пользователей (0 — без ограничения); индивидуальные
+# значения задаются в админке (UploadQuota), персонал не ограничивается
+UPLOAD_MAX_FILE_SIZE_MB = int(os.getenv("UPLOAD_MAX_FILE_SIZE_MB", "5000"))
+UPLOAD_QUOTA_BYTES = int(os.getenv("UPLOAD_QUOTA_GB", "100")) * 1024**3
+UPLOAD_QUOTA_CONCURRENT = int(os.getenv("UPLOAD_QUOTA_CONCURRENT", "3"))
+UPLOAD_QUOTA_PER_DAY = int(os.getenv("UPLOAD_QUOTA_PER_DAY", "50"))
+UPLOAD_QUOTA_TRANSCODE_MINUTES = int(
+    os.getenv("UPLOAD_QUOTA_TRANSCODE_MINUTES", "1440"),
+)
+
+# Прямая загрузка: Django выдаёт подписанный тикет, чанки принимает nginx
+# (WebDAV PUT + secure_link), см. for_docker/nginx-confs. nginx берёт тот же
+# DJANGO_DIRECT_UPLOAD_SECRET из окружения (for_docker/nginx-templates).
+DIRECT_UPLOAD_ENABLED = utils.get_bool_env(
+    os.getenv("DJANGO_DIRECT_UPLOAD_ENABLED", "false"),
+)
+DIRECT_UPLOAD_URL = os.getenv("DJANGO_DIRECT_UPLOAD_URL", "/direct-upload/")
+DIRECT_UPLOAD_SECRET = os.getenv("DJANGO_DIRECT_UPLOAD_SECRET", "")
+if DIRECT_UPLOAD_ENABLED and not DIRECT_UPLOAD_SECRET:
+    # с пустым секретом подпись тикета может подделать кто угодно
+    raise ImproperlyConfigured(
+        "DJANGO_DIRECT_UPLOAD_ENABLED требует DJANGO_DIRECT_UPLOAD_SECRET",
+    )
+
+# Группа, общая для Django и nginx: каталоги загрузки создаются с правами
+# 0o2770 и этой группой, nginx пишет в них, остальным доступа нет
+DIRECT_UPLOAD_GID = (
+    int(os.environ["DJANGO_DIRECT_UPLOAD_GID"])
+    if os.getenv("DJANGO_DIRECT_UPLOAD_GID")
+    else None
+)
+DIRECT_UPLOAD_TICKET_TTL = timedelta(
+    seconds=int(os.getenv("DJANGO_DIRECT_UPLOAD_TICKET_TTL", "21600")),
+)
+# Размер части прямой загрузки, равен client_max_body_size в nginx-confs:
+# тикет подписывает каждую часть отдельно, так что по нему на диск попадает
+# не больше размера файла плюс одна часть
+DIRECT_UPLOAD_PART_SIZE = 16 * 1024 * 1024
 
 INSTALLED_APPS = [
     # Third-party apps
@@ -178,10 +230,6 @@ if "test" in sys.argv:
         },
     }
     PROBLEMATIC_APPS = [
-        "chunked_upload",
-        "upload.apps.UploadConfig",
-        "rooms.apps.RoomsConfig",  # Depends on upload
-        "videos.apps.VideosConfig",  # Depends on upload
         "debug_toolbar",  # Causes URL issues in tests
     ]
     INSTALLED_APPS = [
@@ -260,6 +308,7 @@ STATICFILES_DIRS = [
 MEDIA_ROOT = BASE_DIR / "media"
 
 MEDIA_URL = "/media/"
+DIRECT_UPLOAD_ROOT = MEDIA_ROOT / "direct_uploads"
 
 LANGUAGES = [
     ("en", "English"),
@@ -352,6 +401,86 @@ else:
 CELERY_BROKER_URL = REDIS_URI
 CELERY_ACCEPT_CONTENT = ["application/json"]
 CELERY_TASK_SERIALIZER = "json"
+CELERY_BEAT_SCHEDULE = {
+    "hls-watchdog": {
+        "task": "upload.tasks.watch_stale_hls_jobs",
+        "schedule": timedelta(
+            seconds=int(os.getenv("HLS_WATCHDOG_INTERVAL", "120")),
+        ),
+    },
+    "hls-reprocess-batches": {
+        "task": "upload.tasks.schedule_reprocess_batches",
+        "schedule": timedelta(minutes=1),
+    },
+    "upload-quota-reconcile": {
+        "task": "upload.tasks.reconcile_upload_quotas",
+        "schedule": timedelta(minutes=15),
+    },
+    "chat-flush": {
+        "task": "rooms.tasks.flush_chat_messages",
+        "schedule": timedelta(minutes=1),
+    },
+    "chunked-upload-gc": {
+        "task": "upload.tasks.cleanup_stale_chunked_uploads",
+        "schedule": timedelta(
+            seconds=int(os.getenv("CHUNKED_UPLOAD_GC_INTERVAL", "3600")),
+        ),
+    },
+}
+# Длинные задачи: воркер не должен резервировать сообщения заранее,
+# иначе приоритеты очереди перестают работать
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# HLS watchdog: задача без heartbeat дольше HLS_STALE_AFTER считается
+# зависшей и перезапускается не более HLS_MAX_ATTEMPTS раз
+HLS_STALE_AFTER = timedelta(
+    seconds=int(os.getenv("HLS_STALE_AFTER", "600")),
+)
+HLS_MAX_ATTEMPTS = int(os.getenv("HLS_MAX_ATTEMPTS", "3"))
+# Задача в очереди дольше HLS_QUEUED_STALE_AFTER считается потерянной
+# (сообщение пропало из брокера) и тоже перезапускается
+HLS_QUEUED_STALE_AFTER = timedelta(
+    seconds=int(os.getenv("HLS_QUEUED_STALE_AFTER", "21600")),
+)
+
+# Пакетная переобработка: видео в минуту и приоритет задач (в Redis 0 —
+# наивысший, свежие загрузки идут с приоритетом по умолчанию)
+HLS_REPROCESS_RATE = int(os.getenv("HLS_REPROCESS_RATE", "10"))
+HLS_REPROCESS_PRIORITY = int(os.getenv("HLS_REPROCESS_PRIORITY", "9"))
+
+# Привязка перемотки в комнате к началу HLS-сегмента (по индексу сегментов)
+WATCHPARTY_SEEK_SNAP = utils.get_bool_env(
+    os.getenv("WATCHPARTY_SEEK_SNAP", "false"),
+)
+
+# Присутствие в комнате: соединение без ping дольше этого времени (сек.)
+# считается оборванным; клиенты шлют ping каждые 20 секунд
+WATCHPARTY_PRESENCE_TTL = int(os.getenv("WATCHPARTY_PRESENCE_TTL", "60"))
+
+# Ключевые кадры (позиция ведущего плеера) рассылаются комнате не чаще
+# раза в WATCHPARTY_KEYFRAME_INTERVAL секунд; совпадающие с ожидаемой
+# позицией в пределах TOLERANCE отбрасываются, но не дольше MAX_GAP подряд
+WATCHPARTY_KEYFRAME_INTERVAL = float(
+    os.getenv("WATCHPARTY_KEYFRAME_INTERVAL", "1.0"),
+)
+WATCHPARTY_KEYFRAME_TOLERANCE = float(
+    os.getenv("WATCHPARTY_KEYFRAME_TOLERANCE", "0.5"),
+)
+WATCHPARTY_KEYFRAME_MAX_GAP = float(
+    os.getenv("WATCHPARTY_KEYFRAME_MAX_GAP", "6.0"),
+)
+
+# Сообщения чата пишутся в базу пачками: через FLUSH_INTERVAL секунд после
+# первого сообщения пачки или сразу по набору FLUSH_BATCH сообщений
+WATCHPARTY_CHAT_FLUSH_INTERVAL = float(
+    os.getenv("WATCHPARTY_CHAT_FLUSH_INTERVAL", "0.5"),
+)
+WATCHPARTY_CHAT_FLUSH_BATCH = int(
+    os.getenv("WATCHPARTY_CHAT_FLUSH_BATCH", "200"),
+)
+# Сколько последних сообщений комнаты хранится в Redis и отдаётся при
+# подключении; более старые подгружаются постранично
+WATCHPARTY_CHAT_HISTORY = int(os.getenv("WATCHPARTY_CHAT_HISTORY", "50"))
 
 # cache
 CACHES = {
@@ -0,0 +1,37 @@
+from django_redis import get_redis_connection
+
+from rooms.chat import decode_recent, recent_key
+from rooms.roster import decode_roster, roster_keys
+from rooms.state import decode_state, state_key
+
+__all__ = ("read_bootstrap",)
+
+# Everything a connecting client needs is already kept in Redis and
+# updated in place as the room changes: the history tail (rooms.chat),
+# the roster (rooms.roster) and the playback state (rooms.state). The
+# keys share the room's hash tag, so one pipeline reads them all in a
+# single round trip.
+
+
+def read_bootstrap(room_id, chat=True):
+    """
+    Cached parts of the room snapshot: {"state", "history", "roster"},
+    a part is None when its cache is cold. The player socket only needs
+    the state (chat=False).
+    """
+    pipe = get_redis_connection("default").pipeline(transaction=False)
+    pipe.hgetall(state_key(room_id))
+    if chat:
+        members_key, version_key = roster_keys(room_id)
+        pipe.lrange(recent_key(room_id), 0, -1)
+        pipe.smembers(members_key)
+        pipe.get(version_key)
+
+    raw = pipe.execute()
+    parts = {"state": decode_state(raw[0])}
+    if chat:
+        parts["history"] = decode_recent(raw[1])
+        members, version = decode_roster(raw[2], raw[3])
+        parts["roster"] = (members, version) if members is not None else None
+
+    return parts
@@ -0,0 +1,320 @@
+from datetime import datetime
+import json
+import logging
+import uuid
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import LockNotOwnedError
+
+__all__ = (
+    "decode_recent",
+    "enqueue_message",
+    "flush_pending_messages",
+    "older_messages",
+    "parse_cursor",
+    "pending_key",
+    "pending_messages",
+    "rebuild_recent_messages",
+    "recent_key",
+    "recent_messages",
+)
+
+logger = logging.getLogger(__name__)
+
+# Chat messages are handed off to the room's pending Redis list before
+# they are broadcast (the handoff is the acknowledgement) and written to
+# the database in batches by the flush_chat_messages task. Rooms with
+# pending messages are kept in a set, so the flusher finds them without
+# scanning and a history rebuild reads only its own room's queue.
+PENDING_ROOMS_KEY = "watchparty:chat:pending_rooms"
+# the single queue of all rooms used before the per-room ones
+LEGACY_PENDING_KEY = "watchparty:chat:pending"
+FLUSH_LOCK_KEY = "watchparty:chat:flush_lock"
+FLUSH_LOCK_TIMEOUT = 60
+
+# The last WATCHPARTY_CHAT_HISTORY rendered messages of a room are kept in
+# a capped list for the history sent on connect. Sends only append to a
+# list that exists (RPUSHX); a cold list is rebuilt from the database and
+# starts with an empty marker, so a room without messages is cached too.
+RECENT_TTL = 24 * 60 * 60
+RECENT_MARKER = b""
+
+
+def pending_key(room_id):
+    return f"watchparty:{{{room_id}}}:chat:pending"
+
+
+def recent_key(room_id):
+    return f"watchparty:{{{room_id}}}:chat:recent"
+
+
+def _cursor(created_at, pk=None):
+    """Keyset position of a message: "<created_at ISO>|<pk>"."""
+    if isinstance(created_at, datetime):
+        created_at = created_at.isoformat()
+
+    return f"{created_at}|{pk or ''}"
+
+
+def parse_cursor(cursor):
+    """(created_at, pk or None); ValueError on a malformed cursor."""
+    created_at, _sep, pk = cursor.partition("|")
+    return datetime.fromisoformat(created_at), int(pk) if pk else None
+
+
+def _render_saved(message):
+    return {
+        "username": message.user.username if message.user else "Система",
+        "message": message.content,
+        "system": message.is_system,
+        "timestamp": message.created_at.isoformat(),
+        "cursor": _cursor(message.created_at, message.pk),
+    }
+
+
+def _render_payload(payload):
+    # not written yet: no primary key, the timestamp alone orders it
+    return {
+        "username": payload["username"] or "Система",
+        "message": payload["content"],
+        "system": payload["is_system"],
+        "timestamp": payload["created_at"],
+        "cursor": _cursor(payload["created_at"]),
+    }
+
+
+def enqueue_message(room_id, user, content, is_system=False):
+    """
+    Queue a chat message for persistence and return its payload.
+
+    The first message of a room's batch schedules a flush after
+    WATCHPARTY_CHAT_FLUSH_INTERVAL; every WATCHPARTY_CHAT_FLUSH_BATCH
+    queued messages of the room flush right away.
+    """
+    from rooms.tasks import flush_chat_messages
+
+    payload = {
+        "id": uuid.uuid4().hex,
+        "room_id": int(room_id),
+        "user_id": user.pk if user is not None else None,
+        "username": user.username if user is not None else None,
+        "content": content,
+        "is_system": bool(is_system),
+        "created_at": timezone.now().isoformat(),
+    }
+    key = recent_key(room_id)
+    pipe = get_redis_connection("default").pipeline()
+    pipe.rpush(pending_key(room_id), json.dumps(payload))
+    pipe.sadd(PENDING_ROOMS_KEY, int(room_id))
+    pipe.rpushx(key, json.dumps(_render_payload(payload)))
+    pipe.ltrim(key, -settings.WATCHPARTY_CHAT_HISTORY, -1)
+    pipe.expire(key, RECENT_TTL)
+    length = pipe.execute()[0]
+    if length == 1:
+        flush_chat_messages.apply_async(
+            countdown=settings.WATCHPARTY_CHAT_FLUSH_INTERVAL,
+        )
+    elif length % settings.WATCHPARTY_CHAT_FLUSH_BATCH == 0:
+        flush_chat_messages.delay()
+
+    return payload
+
+
+def pending_messages(room_id):
+    """Messages of the room that are queued but not written yet."""
+    raw = get_redis_connection("default").lrange(pending_key(room_id), 0, -1)
+    return [json.loads(item) for item in raw]
+
+
+def decode_recent(raw):
+    """History from the raw list, None if the cache is cold."""
+    if not raw:
+        return None
+
+    return [json.loads(item) for item in raw if item != RECENT_MARKER]
+
+
+def recent_messages(room_id):
+    """Cached recent history of the room, None if the cache is cold."""
+    return decode_recent(
+        get_redis_connection("default").lrange(recent_key(room_id), 0, -1),
+    )
+
+
+def rebuild_recent_messages(room_id):
+    """Recent history from the database (plus queued messages), cached."""
+    from rooms.models import ChatMessage
+
+    limit = settings.WATCHPARTY_CHAT_HISTORY
+    saved = list(
+        ChatMessage.objects.filter(room_id=room_id)
+        .select_related("user")
+        .order_by("-created_at", "-pk")[:limit],
+    )
+    saved_ids = {
+        message.message_id.hex for message in saved if message.message_id
+    }
+    history = [_render_saved(message) for message in reversed(saved)]
+    history.extend(
+        _render_payload(payload)
+        for payload in pending_messages(room_id)
+        if payload["id"] not in saved_ids
+    )
+    history = history[-limit:]
+
+    key = recent_key(room_id)
+    pipe = get_redis_connection("default").pipeline()
+    pipe.delete(key)
+    pipe.rpush(
+        key,
+        RECENT_MARKER,
+        *(json.dumps(message) for message in history),
+    )
+    pipe.expire(key, RECENT_TTL)
+    pipe.execute()
+    return history
+
+
+def older_messages(room_id, before=None, limit=50):
+    """
+    A page of saved messages older than the cursor, oldest first.
+    Keyset pagination on (room, created_at, id): the page costs the same
+    however deep the history goes.
+    """
+    from rooms.models import ChatMessage
+
+    messages = ChatMessage.objects.filter(room_id=room_id)
+    if before is not None:
+        created_at, pk = before
+        older = Q(created_at__lt=created_at)
+        if pk is not None:
+            older |= Q(created_at=created_at, pk__lt=pk)
+
+        messages = messages.filter(older)
+
+    page = list(
+        messages.select_related("user").order_by("-created_at", "-pk")[:limit],
+    )
+    return [_render_saved(message) for message in reversed(page)]
+
+
+def _save_batch(messages):
+    from django.contrib.auth import get_user_model
+
+    from rooms.models import ChatMessage, WatchParty
+
+    # rooms or users deleted since the message was sent
+    room_ids = set(
+        WatchParty.objects.filter(
+            pk__in={message["room_id"] for message in messages},
+        ).values_list("pk", flat=True),
+    )
+    user_ids = set(
+        get_user_model()
+        .objects.filter(
+            pk__in={message["user_id"] for message in messages},
+        )
+        .values_list("pk", flat=True),
+    )
+    ChatMessage.objects.bulk_create(
+        [
+            ChatMessage(
+                message_id=message["id"],
+                room_id=message["room_id"],
+                user_id=(
+                    message["user_id"]
+                    if message["user_id"] in user_ids
+                    else None
+                ),
+                content=message["content"],
+                is_system=message["is_system"],
+                created_at=message["created_at"],
+            )
+            for message in messages
+            if message["room_id"] in room_ids
+        ],
+        # a batch written before a crash is written again: skip it
+        ignore_conflicts=True,
+    )
+
+
+def _drain(redis, lock, key):
+    """
+    Write one queue to the database batch by batch; every batch renews
+    the lock. Returns (messages written, whether the lock is still held):
+    a flush that outlived FLUSH_LOCK_TIMEOUT stops, the flusher that took
+    over writes the rest.
+    """
+    batch_size = settings.WATCHPARTY_CHAT_FLUSH_BATCH
+    written = 0
+    while True:
+        raw = redis.lrange(key, 0, batch_size - 1)
+        if not raw:
+            return written, True
+
+        _save_batch([json.loads(item) for item in raw])
+        redis.ltrim(key, len(raw), -1)
+        written += len(raw)
+        try:
+            lock.reacquire()
+        except LockNotOwnedError:
+            logger.warning("Chat flush outlived its lock")
+            return written, False
+
+
+def flush_pending_messages():
+    """
+    Write queued messages to the database in batches of
+    WATCHPARTY_CHAT_FLUSH_BATCH. A batch leaves the queue only after it
+    is written, so a crash in between loses nothing (the rewrite is
+    idempotent by message id). Returns the number of messages written.
+    """
+    from rooms.tasks import flush_chat_messages
+
+    redis = get_redis_connection("default")
+    lock = redis.lock(FLUSH_LOCK_KEY, timeout=FLUSH_LOCK_TIMEOUT)
+    if not lock.acquire(blocking=False):
+        # another flusher drains the queues to the end
+        return 0
+
+    written, owned = 0, True
+    try:
+        for room_id in redis.smembers(PENDING_ROOMS_KEY):
+            key = pending_key(room_id.decode())
+            count, owned = _drain(redis, lock, key)
+            written += count
+            if not owned:
+                return written
+
+            # a message queued after the drain adds its room back itself;
+            # one queued before the SREM is seen by the LLEN
+            redis.srem(PENDING_ROOMS_KEY, room_id)
+            if redis.llen(key):
+                redis.sadd(PENDING_ROOMS_KEY, room_id)
+
+        count, owned = _drain(redis, lock, LEGACY_PENDING_KEY)
+        written += count
+        if not owned:
+            return written
+    finally:
+        try:
+            if owned:
+                lock.release()
+        except LockNotOwnedError:
+            # expired while a batch was being written (the batch failed)
+            pass
+
+    # messages queued between the last read and the release had their
+    # flush turned away by the lock: schedule another one
+    if redis.scard(PENDING_ROOMS_KEY):
+        flush_chat_messages.apply_async(
+            countdown=settings.WATCHPARTY_CHAT_FLUSH_INTERVAL,
+        )
+
+    if written:
+        logger.debug("Flushed %s chat messages", written)
+
+    return written
@@ -1,42 +1,61 @@
+import asyncio
 import datetime
 import json
 import time as _time
+from urllib.parse import parse_qs
 
+from asgiref.sync import sync_to_async
 from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
-from django.core.cache import cache
+from django.conf import settings
+
+from rooms.bootstrap import read_bootstrap
+from rooms.chat import enqueue_message, rebuild_recent_messages
+from rooms.leader import (
+    leader_heartbeat,
+    leader_join,
+    leader_leave,
+    leader_member,
+)
+from rooms.media import cached_media, load_media, media_segment
+from rooms.presence import (
+    online_counts,
+    presence_connect,
+    presence_disconnect,
+    presence_heartbeat,
+)
+from rooms.protocol import (
+    decode_frame,
+    encode_frame,
+    frame_event,
+    SUBPROTOCOL,
+)
+from rooms.roster import load_roster, roster_event, roster_members
+from rooms.state import (
+    apply_state,
+    get_state,
+    project_state,
+    STATE_APPLIED,
+    STATE_STALE,
+)
 
 __all__ = ("WatchPartySyncConsumer",)
 
-# ─── Cache key helpers ───────────────────────────────────────────────────────
+# client-reported round trips above this are treated as bogus
+MAX_RTT_MS = 5000
 
 
-def _state_key(room_id):
-    return f"watchparty_state_{room_id}"
+def _now_ms():
+    return _time.time() * 1000
 
 
-def _online_key(room_id):
-    return f"watchparty_online_{room_id}"
-
-
-def _online_add(room_id, username):
-    """Add username to the online set stored in cache."""
-    key = _online_key(room_id)
-    online = cache.get(key) or set()
-    online.add(username)
-    cache.set(key, online, None)
-
-
-def _online_remove(room_id, username):
-    """Remove username from the online set stored in cache."""
-    key = _online_key(room_id)
-    online = cache.get(key) or set()
-    online.discard(username)
-    cache.set(key, online, None)
-
-
-def _online_set(room_id):
-    return cache.get(_online_key(room_id)) or set()
+async def _redis(func, *args, **kwargs):
+    """
+    Call a blocking Redis helper (django_redis commands, Lua scripts) in a
+    worker thread: a round trip on the event loop would stall every socket
+    served by the worker.
+    """
+    return await sync_to_async(func, thread_sensitive=False)(*args, **kwargs)
 
 
 # ─── Consumer ────────────────────────────────────────────────────────────────
@@ -58,65 +77,142 @@ class WatchPartySyncConsumer(AsyncWebsocketConsumer):
             await self.close(code=4003)
             return
 
-        await self.channel_layer.group_add(self.group_name, self.channel_name)
-        await self.accept()
-
-        # Mark user online
-        _online_add(self.party_id, self.user.username)
+        # The player socket (sync_player.js) connects with ?player=1 and
+        # may become the room's time source; the chat socket may not
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        self.is_player = query.get("player") == ["1"]
+        # only needed by the player socket, looked up with the snapshot
+        self.host_username = ""
+        # Client clock relative to the server (NTP-style, estimated by the
+        # client from ping/pong and reported back): offset = server - client
+        self.clock_offset = None
+        self.rtt = 0.0
+        # the room's video (rooms.media), kept until a media_change event
+        self.media = None
+
+        # Clients offering the MessagePack subprotocol get binary frames;
+        # everyone else stays on JSON text
+        self.binary = SUBPROTOCOL in self.scope.get("subprotocols", [])
 
-        # Send chat history
-        history = await self.get_last_messages(limit=50)
-        await self.send(
-            text_data=json.dumps({"type": "history", "messages": history}),
-        )
-
-        # Send participants list (with status) to everyone
-        participants = await self.get_participants_with_status()
-        await self.send(
-            text_data=json.dumps(
-                {
-                    "type": "participants",
-                    "participants": participants,
-                    "count": len(participants),
-                },
-            ),
-        )
-        # Broadcast updated status to rest of the room
-        await self.channel_layer.group_send(
-            self.group_name,
-            {"type": "participants_update", "participants": participants},
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept(subprotocol=SUBPROTOCOL if self.binary else None)
+
+        # Mark this connection online; other tabs of the same user keep
+        # their own entries, so the user stays online until the last one
+        changed, counts = await _redis(
+            presence_connect,
+            self.party_id,
+            self.user.username,
+            self.channel_name,
         )
 
-        # Send current player state to the newly connected client
-        state = await self.get_watchparty_state()
-        await self.send(
-            text_data=json.dumps({"type": "player_state", "state": state}),
-        )
+        # Everything the client needs arrives in one frame; the full
+        # participants list goes to this connection only, the room just
+        # hears about the status change
+        await self.send_message(await self.bootstrap(counts))
+        await self.announce_presence(changed, counts)
+
+        if self.is_player:
+            leader, changed = await _redis(
+                leader_join,
+                self.party_id,
+                self.host_username,
+                self.user.username,
+                self.channel_name,
+            )
+            if changed:
+                await self.announce_leader(leader)
+            else:
+                await self.leader_change({"leader": leader})
 
     async def disconnect(self, close_code):
+        changed, counts = set(), {}
         if hasattr(self, "user") and self.user.is_authenticated:
-            _online_remove(self.party_id, self.user.username)
+            changed, counts = await _redis(
+                presence_disconnect,
+                self.party_id,
+                self.user.username,
+                self.channel_name,
+            )
 
-        if hasattr(self, "group_name"):
-            participants = await self.get_participants_with_status()
-            await self.channel_layer.group_send(
-                self.group_name,
-                {"type": "participants_update", "participants": participants},
+        # Fail the time source over right away instead of waiting for the
+        # heartbeat to expire
+        if getattr(self, "is_player", False):
+            leader, leader_changed = await _redis(
+                leader_leave,
+                self.party_id,
+                self.host_username,
+                self.user.username,
+                self.channel_name,
             )
+            if leader_changed:
+                await self.announce_leader(leader)
+
+        if hasattr(self, "group_name"):
+            await self.announce_presence(changed, counts)
             await self.channel_layer.group_discard(
                 self.group_name,
                 self.channel_name,
             )
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
+        received = _now_ms()
         try:
-            data = json.loads(text_data)
-        except json.JSONDecodeError:
-            await self.sync_broadcast(text_data)
+            if bytes_data is not None:
+                data = decode_frame(bytes_data)
+            else:
+                data = json.loads(text_data)
+        except ValueError:
+            # non-JSON text is relayed as is, malformed binary dropped
+            if text_data is not None:
+                await self.channel_layer.group_send(
+                    self.group_name,
+                    {"type": "broadcast", "text": text_data},
+                )
+
             return
 
         msg_type = data.get("type")
 
+        # ── Heartbeat / clock sync ────────────────────────────────────────
+        # Answered to the sender only; keeps this connection's presence
+        # entry alive (a crashed server stops heartbeating and its
+        # connections expire instead of staying online forever).
+        # The pong carries server receive/send times, from which the client
+        # computes its clock offset and round trip like NTP:
+        #   rtt    = (t3 - t0) - (t2 - t1)
+        #   offset = ((t1 - t0) + (t2 - t3)) / 2
+        # and reports its best estimate in the following pings.
+        if msg_type == "ping":
+            self.update_clock(data)
+            changed, counts = await _redis(
+                presence_heartbeat,
+                self.party_id,
+                self.user.username,
+                self.channel_name,
+            )
+            await self.send_message(
+                {
+                    "type": "pong",
+                    "ts": data.get("ts"),
+                    "server_received": received,
+                    "server_sent": _now_ms(),
+                },
+            )
+            if self.is_player:
+                leader, leader_changed = await _redis(
+                    leader_heartbeat,
+                    self.party_id,
+                    self.host_username,
+                    self.user.username,
+                    self.channel_name,
+                )
+                if leader_changed:
+                    await self.announce_leader(leader)
+
+            await self.announce_presence(changed, counts)
+            return
+
         # ── Chat ──────────────────────────────────────────────────────────
         if msg_type == "chat":
             message = data.get("message", "").strip()
@@ -130,18 +226,23 @@ class WatchPartySyncConsumer(AsyncWebsocketConsumer):
                 if not timestamp:
                     timestamp = datetime.datetime.utcnow().isoformat() + "Z"
 
-                await self.save_message(
+                # Handed off to the write-behind queue (rooms.chat) before
+                # the broadcast; the database write happens in batches
+                is_system = data.get("system", False)
+                # the Celery publish blocks too
+                await _redis(
+                    enqueue_message,
+                    self.party_id,
+                    None if is_system else self.user,
                     message,
-                    username,
-                    data.get("system", False),
+                    is_system,
                 )
-                await self.channel_layer.group_send(
-                    self.group_name,
+                await self.sync_broadcast(
                     {
-                        "type": "chat_message",
-                        "message": message,
+                        "type": "message",
                         "username": username,
-                        "system": data.get("system", False),
+                        "message": message,
+                        "system": is_system,
                         "timestamp": timestamp,
                     },
                 )
@@ -149,27 +250,20 @@ class WatchPartySyncConsumer(AsyncWebsocketConsumer):
             return
 
         # ── Participants refresh ───────────────────────────────────────────
+        # A client that missed a delta (version gap) asks for a snapshot;
+        # only it gets one
         if msg_type == "participants_update":
-            participants = await self.get_participants_with_status()
-            await self.channel_layer.group_send(
-                self.group_name,
-                {
-                    "type": "participants_update",
-                    "participants": participants,
-                },
-            )
+            await self.send_participants()
             return
 
         # ── Request current player state (new client asking) ─────────────
         if msg_type == "request_state":
             state = await self.get_watchparty_state()
-            await self.send(
-                text_data=json.dumps(
-                    {
-                        "type": "player_state",
-                        "state": state,  # can be None
-                    },
-                ),
+            await self.send_message(
+                {
+                    "type": "player_state",
+                    "state": state,  # can be None
+                },
             )
             return
 
@@ -179,17 +273,21 @@ class WatchPartySyncConsumer(AsyncWebsocketConsumer):
             video_id = item.get("video_id")
             if video_id:
                 await self.save_watchparty_video(video_id)
-
-            await self.set_watchparty_state(
+                # don't wait for our own media_change event
+                self.media = None
+
+            ts = self.event_ts(received, data.get("ts"))
+            _status, version = await _redis(
+                apply_state,
+                self.party_id,
+                "select",
                 time=0.0,
-                ts=data.get("ts") or int(_time.time() * 1000),
-                is_playing=True,
+                ts=ts,
                 video_id=video_id,
                 hls_url=item.get("hls_url"),
             )
 
-            await self.channel_layer.group_send(
-                self.group_name,
+            await self.sync_broadcast(
                 {
                     "type": "playlist_change",
                     "item": item,
@@ -199,6 +297,8 @@ class WatchPartySyncConsumer(AsyncWebsocketConsumer):
                         else "Гость"
                     ),
                     "ts": data.get("ts"),
+                    "server_ts": ts,
+                    "version": version,
                 },
             )
             return
@@ -210,112 +310,99 @@ class WatchPartySyncConsumer(AsyncWebsocketConsumer):
             except (TypeError, ValueError):
                 time_val = 0.0
 
-            ts = data.get("ts") or int(_time.time() * 1000)
-
-            current_state = cache.get(_state_key(self.party_id))
-
-            # ── Stale-join protection ──────────────────────────────────────
-            # If an active room has significant progress and receives a
-            # command at t≈0 from a play/pause/seek, this is almost certainly
-            # a cold-start event from a joining client whose player hasn't
-            # synced yet. Discard the state update (but still broadcast for
-            # any UI that needs it). Only keyframes use the separate backtrack
-            # check below, so this guard applies to play/pause/seek only.
-            if msg_type in ("play", "pause", "seek") and current_state:
-                stored_time = current_state.get("time", 0.0)
-                if stored_time > 5.0 and time_val < 1.0:
-                    # Looks like a fresh-join at t=0 — broadcast but don't
-                    # overwrite the real cached time.
-                    await self.sync_broadcast(text_data)
-                    return
-
-            # For keyframe: only update is_playing if currently playing
-            # (don't override a pause with a keyframe)
-            if msg_type == "keyframe":
-                was_playing = (
-                    current_state.get("is_playing", True)
-                    if current_state
-                    else True
-                )
-                is_playing = was_playing
-                # Don't update state if time goes backward (stale packet)
-                if current_state:
-                    stored_time = current_state.get("time", 0.0)
-                    # Only update if time advanced or big jump
-                    if time_val < stored_time - 1.0:
-                        await self.sync_broadcast(text_data)
-                        return
-            else:
-                is_playing = msg_type in ("play",)
-
-            room = await self.get_room_once()
-            hls = None
-            vid = None
-            if room and getattr(room, "video", None):
+            requested_time = time_val
+            # server time of the command: client clocks drift by seconds,
+            # so the client's ts only counts corrected by its clock offset
+            ts = self.event_ts(received, data.get("ts"))
+
+            media = await self.get_media()
+
+            # ── Seek snapping / prefetch hint ──────────────────────────────
+            # With a segment index every client is told which segment the
+            # target falls into, so they all fetch the same one; optionally
+            # the target itself is snapped to that segment's start.
+            if msg_type == "seek":
+                segment = media_segment(media, time_val)
+                if segment:
+                    if settings.WATCHPARTY_SEEK_SNAP:
+                        time_val = segment["start"]
+
+                    data["time"] = time_val
+                    data["prefetch"] = segment
+
+            # Stale-join and backtrack checks run atomically with the write
+            # (see rooms.state). A keyframe carrying the version its sender
+            # last saw is a compare-and-set: if someone seeked or paused in
+            # between, the keyframe would undo that and is dropped.
+            expected_version = None
+            if msg_type == "keyframe" and data.get("version") is not None:
                 try:
-                    hls = room.video.hls_manifest.url
-                    vid = room.video.id
-                except Exception:
-                    hls = None
-
-            await self.set_watchparty_state(
+                    expected_version = int(data["version"])
+                except (TypeError, ValueError):
+                    pass
+
+            status, version = await _redis(
+                apply_state,
+                self.party_id,
+                msg_type,
                 time=time_val,
                 ts=ts,
-                is_playing=is_playing,
-                video_id=vid,
-                hls_url=hls,
+                video_id=media["video_id"],
+                hls_url=media["hls_url"],
+                expected_version=expected_version,
+                requested_time=requested_time,
+                source=(
+                    leader_member(self.user.username, self.channel_name)
+                    if self.is_player
+                    else ""
+                ),
             )
-
-            await self.sync_broadcast(text_data)
+            if status == STATE_APPLIED:
+                data["version"] = version
+                data["server_ts"] = ts
+            elif msg_type == "keyframe" or status != STATE_STALE:
+                # Only the leader's keyframes are fanned out, at most one
+                # per WATCHPARTY_KEYFRAME_INTERVAL and only when they add
+                # something: a room costs O(N) deliveries per keyframe
+                # instead of O(N²)
+                return
+
+            # stale play/pause/seek are still broadcast for any UI that
+            # needs them, they just don't overwrite the stored state
+            await self.sync_broadcast(data)
             return
 
         # ── Fallthrough ───────────────────────────────────────────────────
-        await self.sync_broadcast(text_data)
+        await self.sync_broadcast(data)
 
     # ──────────────────────────────────────────────────────────────────────
     # Group event handlers
     # ──────────────────────────────────────────────────────────────────────
 
-    async def chat_message(self, event):
-        ts = event.get("timestamp")
-        if not ts:
-            ts = datetime.datetime.utcnow().isoformat() + "Z"
+    async def frame(self, event):
+        # encoded once by the sender (rooms.protocol.frame_event)
+        if self.binary:
+            await self.send(bytes_data=event["bytes"])
+        else:
+            await self.send(text_data=event["text"])
 
-        await self.send(
-            text_data=json.dumps(
-                {
-                    "type": "message",
-                    "username": event["username"],
-                    "message": event["message"],
-                    "system": event.get("system", False),
-                    "timestamp": ts,
-                },
-            ),
-        )
+    async def leader_change(self, event):
+        if not self.is_player:
+            return
 
-    async def participants_update(self, event):
-        participants = event["participants"]
-        await self.send(
-            text_data=json.dumps(
-                {
-                    "type": "participants",
-                    "participants": participants,
-                    "count": len(participants),
-                },
-            ),
+        leader = event["leader"]
+        await self.send_message(
+            {
+                "type": "leader",
+                "username": leader.split(" ", 1)[0] if leader else None,
+                "is_leader": leader
+                == leader_member(self.user.username, self.channel_name),
+            },
         )
 
-    async def playlist_change(self, event):
-        await self.send(
-            text_data=json.dumps(
-                {
-                    "type": "playlist_change",
-                    "item": event.get("item", {}),
-                    "initiator": event.get("initiator"),
-                    "ts": event.get("ts"),
-                },
-            ),
-        )
+    async def media_change(self, event):
+        # None: the video is still being processed, read it again next time
+        self.media = event["media"]
 
     async def broadcast(self, event):
         await self.send(text_data=event["text"])
@@ -324,53 +411,95 @@ class WatchPartySyncConsumer(AsyncWebsocketConsumer):
     # DB / Cache helpers
     # ──────────────────────────────────────────────────────────────────────
 
-    @database_sync_to_async
-    def get_participants_with_status(self):
-        """Return list of {username, online} dicts."""
-        from rooms.models import WatchParty
-
-        try:
-            party = WatchParty.objects.get(id=self.party_id)
-            db_users = list(
-                party.participants.values_list("username", flat=True),
+    async def bootstrap(self, online):
+        """
+        The "bootstrap" frame: playback state and media, plus chat history
+        and participants for the chat socket. The cached parts come from
+        one Redis round trip (rooms.bootstrap); cold ones are loaded from
+        the database concurrently.
+        """
+        chat = not self.is_player
+        parts = await _redis(read_bootstrap, self.party_id, chat=chat)
+
+        loads = {}
+        if parts["state"] is None:
+            loads["state"] = self.get_initial_state()
+        if chat and parts["history"] is None:
+            loads["history"] = database_sync_to_async(
+                rebuild_recent_messages,
+            )(self.party_id)
+        if chat and parts["roster"] is None:
+            loads["roster"] = self.load_participants()
+        if self.is_player:
+            loads["host"] = self.get_host_username()
+
+        for name, value in zip(loads, await asyncio.gather(*loads.values())):
+            parts[name] = value
+
+        state = parts["state"]
+        if state and "version" in state:
+            # position projected to the moment of sending
+            state = project_state(state, int(_now_ms()))
+
+        if self.is_player:
+            self.host_username = parts["host"]
+
+        frame = {
+            "type": "bootstrap",
+            "state": state,
+            "media": (
+                {"video_id": state["video_id"], "hls_url": state["hls_url"]}
+                if state
+                else None
+            ),
+        }
+        if chat:
+            history = parts["history"]
+            frame["history"] = {
+                "messages": history,
+                # keyset cursor for the "load older" endpoint
+                "before": history[0]["cursor"] if history else None,
+            }
+            frame["participants"] = self.participants_frame(
+                *parts["roster"],
+                online,
             )
-        except WatchParty.DoesNotExist:
-            return []
-
-        online = _online_set(self.party_id)
-        return [{"username": u, "online": u in online} for u in db_users]
 
-    @database_sync_to_async
-    def get_last_messages(self, limit=50):
-        from rooms.models import ChatMessage
+        return frame
 
-        messages = ChatMessage.objects.filter(room_id=self.party_id).order_by(
-            "-created_at",
-        )[:limit]
-        return [
+    def participants_frame(self, members, version, online):
+        """Snapshot of {username, online, connections} dicts."""
+        participants = [
             {
-                "username": m.user.username if m.user else "Система",
-                "message": m.content,
-                "system": m.is_system,
-                "timestamp": m.created_at.isoformat(),
+                "username": u,
+                "online": u in online,
+                "connections": online.get(u, 0),
             }
-            for m in reversed(messages)
+            for u in members
         ]
+        return {
+            "type": "participants",
+            "participants": participants,
+            "count": len(participants),
+            "version": version,
+        }
+
+    async def load_participants(self):
+        """Roster from the database, cached for the next connections."""
+        return await _redis(
+            load_roster,
+            self.party_id,
+            await self.get_participant_usernames(),
+        )
 
     @database_sync_to_async
-    def save_message(self, content, username=None, is_system=False):
-        from rooms.models import ChatMessage, WatchParty
-
-        user = None
-        if username and not is_system and self.user.is_authenticated:
-            user = self.user
-
-        room = WatchParty.objects.get(id=self.party_id)
-        ChatMessage.objects.create(
-            room=room,
-            user=user,
-            content=content,
-            is_system=is_system,
+    def get_participant_usernames(self):
+        from django.contrib.auth import get_user_model
+
+        return list(
+            get_user_model()
+            .objects.filter(joined_parties=self.party_id)
+            .values_list("username", flat=True),
         )
 
     @database_sync_to_async
@@ -387,54 +516,50 @@ class WatchPartySyncConsumer(AsyncWebsocketConsumer):
         except Exception:
             return False
 
-    @database_sync_to_async
-    def get_room_once(self):
-        from rooms.models import WatchParty
-
-        try:
-            return WatchParty.objects.select_related("video").get(
-                id=self.party_id,
+    async def get_media(self):
+        """
+        The room's video for playback commands: kept on the connection,
+        then Redis; only a cold cache goes to the database.
+        """
+        if self.media is not None:
+            return self.media
+
+        media = await _redis(cached_media, self.party_id)
+        cached = media is not None
+        if not cached:
+            media, cached = await database_sync_to_async(load_media)(
+                self.party_id,
             )
-        except WatchParty.DoesNotExist:
-            return None
 
-    @database_sync_to_async
-    def set_watchparty_state(
-        self,
-        time,
-        ts,
-        is_playing,
-        video_id=None,
-        hls_url=None,
-    ):
-        key = _state_key(self.party_id)
-        state = {
-            "time": float(time or 0.0),
-            "ts": int(ts) if ts is not None else int(_time.time() * 1000),
-            "is_playing": bool(is_playing),
-            "video_id": int(video_id) if video_id is not None else None,
-            "hls_url": str(hls_url) if hls_url else None,
-        }
-        cache.set(key, state, None)  # persist until invalidated
-        return True
+        if cached:
+            self.media = media
+
+        return media
+
+    async def get_watchparty_state(self):
+        # the position is projected to the moment of sending, so a
+        # newcomer only has to add half its round trip
+        state = await _redis(get_state, self.party_id)
+        if state:
+            return project_state(state, int(_now_ms()))
+
+        return await self.get_initial_state()
 
     @database_sync_to_async
-    def get_watchparty_state(self):
+    def get_initial_state(self):
+        """Fallback state built from the room's video."""
         from rooms.models import WatchParty
 
-        key = _state_key(self.party_id)
-        st = cache.get(key)
-        if st:
-            return st
-        # Fallback: build from DB room.video
         try:
             room = WatchParty.objects.select_related("video").get(
                 id=self.party_id,
             )
             if room.video and getattr(room.video, "hls_manifest", None):
+                now = int(_now_ms())
                 return {
                     "time": 0.0,
-                    "ts": int(_time.time() * 1000),
+                    "ts": now,
+                    "server_ts": now,
                     "is_playing": False,
                     "video_id": room.video.id,
                     "hls_url": room.video.hls_manifest.url,
@@ -444,8 +569,92 @@ class WatchPartySyncConsumer(AsyncWebsocketConsumer):
 
         return None
 
-    async def sync_broadcast(self, text_data):
+    def update_clock(self, data):
+        """Store the clock estimate the client reports in its ping."""
+        try:
+            rtt = float(data["rtt"])
+            offset = float(data["offset"])
+        except (KeyError, TypeError, ValueError):
+            return
+
+        if 0 <= rtt <= MAX_RTT_MS:
+            self.rtt = rtt
+            self.clock_offset = offset
+
+    def event_ts(self, received, client_ts=None):
+        """
+        Server time (ms) at which the client sent its message: its own
+        timestamp shifted by the clock offset when the offset is known,
+        otherwise half a round trip before the message arrived.
+        """
+        if self.clock_offset is not None and isinstance(
+            client_ts,
+            (int, float),
+        ):
+            sent = client_ts + self.clock_offset
+            return int(min(max(sent, received - MAX_RTT_MS), received))
+
+        return int(received - self.rtt / 2)
+
+    @database_sync_to_async
+    def get_host_username(self):
+        from rooms.models import WatchParty
+
+        return (
+            WatchParty.objects.filter(id=self.party_id)
+            .values_list("host__username", flat=True)
+            .first()
+            or ""
+        )
+
+    async def send_participants(self):
+        members, version = await _redis(roster_members, self.party_id)
+        if members is None:
+            members, version = await self.load_participants()
+
+        await self.send_message(
+            self.participants_frame(
+                members,
+                version,
+                await _redis(online_counts, self.party_id),
+            ),
+        )
+
+    async def announce_presence(self, changed, counts):
+        """One versioned delta per user whose online status flipped."""
+        for username in sorted(changed):
+            event = "online" if counts.get(username) else "offline"
+            await self.sync_broadcast(
+                {
+                    "type": "participants_delta",
+                    "event": event,
+                    "username": username,
+                    "version": await _redis(
+                        roster_event,
+                        self.party_id,
+                        event,
+                        username,
+                    ),
+                    "online": event == "online",
+                    "connections": counts.get(username, 0),
+                },
+            )
+
+    async def announce_leader(self, leader):
+        await self.channel_layer.group_send(
+            self.group_name,
+            {"type": "leader_change", "leader": leader},
+        )
+
+    async def send_message(self, message):
+        """Send to this connection in the protocol it negotiated."""
+        if self.binary:
+            await self.send(bytes_data=encode_frame(message, binary=True))
+        else:
+            await self.send(text_data=encode_frame(message, binary=False))
+
+    async def sync_broadcast(self, message):
         await self.channel_layer.group_send(
             self.group_name,
-            {"type": "broadcast", "text": text_data},
+            frame_event(message),
         )
@@ -0,0 +1,116 @@
+import time
+
+from django.conf import settings
+
+from rooms.redis_scripts import LuaScript
+
+__all__ = (
+    "leader_heartbeat",
+    "leader_join",
+    "leader_key",
+    "leader_leave",
+    "leader_member",
+)
+
+# The room's time source: the only connection whose keyframes are fanned
+# out. The host's player is preferred; without it the leadership goes to
+# another connected player and returns to the host when they come back.
+#
+# KEYS[1] — zset: "<username> <channel_name>" of player connections ->
+#           heartbeat deadline
+# KEYS[2] — leader member
+# ARGV: now, ttl, host username, member to add ("" — none),
+#       member to remove ("" — none)
+#
+# Returns {leader member ("" — nobody), 1 if the leader changed else 0}.
+LEADER_SCRIPT = LuaScript(
+    """
+local now, ttl = tonumber(ARGV[1]), tonumber(ARGV[2])
+
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if ARGV[5] ~= '' then
+    redis.call('ZREM', KEYS[1], ARGV[5])
+end
+if ARGV[4] ~= '' then
+    redis.call('ZADD', KEYS[1], now + ttl, ARGV[4])
+end
+
+local function owner(member)
+    return string.match(member, '^(%S+) ')
+end
+
+local previous = redis.call('GET', KEYS[2])
+local leader = previous
+if leader and not redis.call('ZSCORE', KEYS[1], leader) then
+    -- disconnected or stopped heartbeating
+    leader = false
+end
+
+if not leader or owner(leader) ~= ARGV[3] then
+    local players = redis.call('ZRANGE', KEYS[1], 0, -1)
+    for _, member in ipairs(players) do
+        if owner(member) == ARGV[3] then
+            leader = member
+            break
+        end
+    end
+    if not leader then
+        leader = players[1] or false
+    end
+end
+
+if leader then
+    redis.call('SET', KEYS[2], leader, 'EX', ttl * 2)
+else
+    redis.call('DEL', KEYS[2])
+end
+redis.call('EXPIRE', KEYS[1], ttl * 2)
+
+return {leader or '', leader ~= previous and 1 or 0}
+""",
+)
+
+
+def _players_key(room_id):
+    return f"watchparty:{{{room_id}}}:players"
+
+
+def leader_key(room_id):
+    return f"watchparty:{{{room_id}}}:leader"
+
+
+def leader_member(username, connection):
+    return f"{username} {connection}"
+
+
+def _run(room_id, host, add="", remove=""):
+    leader, changed = LEADER_SCRIPT(
+        keys=[_players_key(room_id), leader_key(room_id)],
+        args=[
+            time.time(),
+            settings.WATCHPARTY_PRESENCE_TTL,
+            host,
+            add,
+            remove,
+        ],
+    )
+    return leader.decode() or None, bool(changed)
+
+
+def leader_join(room_id, host, username, connection):
+    """
+    Register a player connection as a time-source candidate.
+
+    Returns (leader member or None, whether the leader changed).
+    """
+    return _run(room_id, host, add=leader_member(username, connection))
+
+
+def leader_heartbeat(room_id, host, username, connection):
+    """Keep the candidate alive; re-elects if the leader went silent."""
+    return _run(room_id, host, add=leader_member(username, connection))
+
+
+def leader_leave(room_id, host, username, connection):
+    """Drop the candidate; fails over at once if it was the leader."""
+    return _run(room_id, host, remove=leader_member(username, connection))
@@ -0,0 +1,119 @@
+import json
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django_redis import get_redis_connection
+
+from rooms.state import refresh_hls_url
+from upload.models import segment_at
+
+__all__ = (
+    "cached_media",
+    "describe_media",
+    "load_media",
+    "media_segment",
+    "publish_media",
+    "publish_video",
+)
+
+# What playback commands need to know about the room's video: its id,
+# HLS manifest and segment index. Kept in Redis and, for the lifetime of
+# a connection, in the consumer; WatchParty.save publishes a change to
+# both through the "media_change" group event.
+#
+# A video still being processed has no manifest yet and is never cached,
+# so the room picks the manifest up as soon as processing finishes.
+# Finished processing (including reprocessing, which moves the output to
+# a new directory and deletes the old one) publishes the video to every
+# room playing it, see publish_video. The TTL heals the remaining changes
+# made behind save() (queryset updates, the video being deleted).
+MEDIA_TTL = 10 * 60
+NO_MEDIA = {"video_id": None, "hls_url": None, "segments": []}
+
+
+def _media_key(room_id):
+    return f"watchparty:{{{room_id}}}:media"
+
+
+def describe_media(video):
+    """Descriptor of the video (None — no video), None while processing."""
+    if video is None:
+        return NO_MEDIA
+
+    if not video.hls_manifest:
+        return None
+
+    return {
+        "video_id": video.pk,
+        "hls_url": video.hls_manifest.url,
+        "segments": video.hls_segment_index or [],
+    }
+
+
+def cached_media(room_id):
+    """Cached descriptor of the room's video, None if the cache is cold."""
+    raw = get_redis_connection("default").get(_media_key(room_id))
+    return json.loads(raw) if raw else None
+
+
+def load_media(room_id):
+    """
+    Descriptor read from the database: (media, whether it was cached).
+    """
+    from rooms.models import WatchParty
+
+    room = (
+        WatchParty.objects.select_related("video").filter(pk=room_id).first()
+    )
+    if room is None:
+        return NO_MEDIA, False
+
+    media = describe_media(room.video)
+    if media is None:
+        return NO_MEDIA, False
+
+    get_redis_connection("default").set(
+        _media_key(room_id),
+        json.dumps(media),
+        ex=MEDIA_TTL,
+    )
+    return media, True
+
+
+def publish_media(room_id, video):
+    """
+    Cache the room's new video, point the playback state at its manifest
+    and tell its connections.
+    """
+    media = describe_media(video)
+    if media is None:
+        get_redis_connection("default").delete(_media_key(room_id))
+    else:
+        get_redis_connection("default").set(
+            _media_key(room_id),
+            json.dumps(media),
+            ex=MEDIA_TTL,
+        )
+        if media["video_id"] is not None:
+            refresh_hls_url(room_id, media["video_id"], media["hls_url"])
+
+    async_to_sync(get_channel_layer().group_send)(
+        f"watchparty_{room_id}",
+        {"type": "media_change", "media": media},
+    )
+
+
+def publish_video(video):
+    """Publish a video whose HLS output changed to every room playing it."""
+    from rooms.models import WatchParty
+
+    for room_id in WatchParty.objects.filter(video=video).values_list(
+        "pk",
+        flat=True,
+    ):
+        publish_media(room_id, video)
+
+
+def media_segment(media, seconds):
+    """HLS segment containing the moment, None without a segment index."""
+    return segment_at(media["segments"], seconds)
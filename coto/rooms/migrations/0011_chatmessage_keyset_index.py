@@ -0,0 +1,20 @@
+# Generated by Django 4.2.16 on 2026-10-19 05:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("rooms", "0010_chatmessage_message_id"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="chatmessage",
+            index=models.Index(
+                fields=["room", "created_at", "id"],
+                name="rooms_chatm_room_id_a2152c_idx",
+            ),
+        ),
+    ]
@@ -1,8 +1,10 @@
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from rooms.media import publish_media
 from upload.models import Playlist, Video
 
 __all__ = ["WatchParty"]
@@ -85,6 +87,17 @@ class WatchParty(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        super().save(*args, **kwargs)
+
+        # Плеер комнаты берёт видео из кэша (rooms.media): после записи
+        # обновляем кэш и сообщаем подключённым клиентам
+        if update_fields is None or "video" in update_fields:
+            transaction.on_commit(
+                lambda: publish_media(self.pk, self.video),
+            )
+
     def clean(self):
         """Проверяем, что выбрано хотя бы видео или плейлист."""
         from django.core.exceptions import ValidationError
@@ -127,10 +140,24 @@ class ChatMessage(models.Model):
     )
     content = models.TextField(verbose_name=_("Собщение"))
     is_system = models.BooleanField(default=False)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # время отправки, а не записи: сообщения сохраняются пачками
+    created_at = models.DateTimeField(default=timezone.now)
+    # идентификатор из очереди записи: повторная запись пачки после сбоя
+    # не создаёт дублей
+    message_id = models.UUIDField(
+        _("Идентификатор сообщения"),
+        unique=True,
+        null=True,
+        blank=True,
+        editable=False,
+    )
 
     class Meta:
         ordering = ["created_at"]
+        indexes = [
+            # история и подгрузка старых сообщений по ключу (room, время, id)
+            models.Index(fields=["room", "created_at", "id"]),
+        ]
         verbose_name = _("Сообщение чата")
         verbose_name_plural = _("Сообщений чата")
 
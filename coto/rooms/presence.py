@@ -0,0 +1,117 @@
+from collections import Counter
+import time
+
+from django.conf import settings
+
+from rooms.redis_scripts import LuaScript
+
+__all__ = (
+    "online_counts",
+    "presence_connect",
+    "presence_disconnect",
+    "presence_heartbeat",
+)
+
+# One script call per presence change: expired connections are swept,
+# the connection is added/removed and the per-user counters are updated
+# atomically, so concurrent connects/disconnects never lose an update.
+#
+# KEYS[1] — zset: "<username> <channel_name>" -> heartbeat deadline
+# KEYS[2] — hash: username -> number of live connections
+# ARGV: now, ttl, member to add ("" — none), member to remove ("" — none)
+#
+# Returns {usernames whose online status flipped, flat HGETALL of counts}.
+PRESENCE_SCRIPT = LuaScript(
+    """
+local now, ttl = tonumber(ARGV[1]), tonumber(ARGV[2])
+local flipped = {}
+
+local function drop(member)
+    if redis.call('ZREM', KEYS[1], member) == 1 then
+        local user = string.match(member, '^(%S+) ')
+        if redis.call('HINCRBY', KEYS[2], user, -1) <= 0 then
+            redis.call('HDEL', KEYS[2], user)
+            table.insert(flipped, user)
+        end
+    end
+end
+
+local expired = redis.call(
+    'ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, 100
+)
+for _, member in ipairs(expired) do
+    drop(member)
+end
+
+if ARGV[4] ~= '' then
+    drop(ARGV[4])
+end
+
+if ARGV[3] ~= '' then
+    if redis.call('ZADD', KEYS[1], now + ttl, ARGV[3]) == 1 then
+        local user = string.match(ARGV[3], '^(%S+) ')
+        if redis.call('HINCRBY', KEYS[2], user, 1) == 1 then
+            table.insert(flipped, user)
+        end
+    end
+end
+
+-- a room nobody heartbeats cleans itself up
+redis.call('EXPIRE', KEYS[1], ttl * 2)
+redis.call('EXPIRE', KEYS[2], ttl * 2)
+return {flipped, redis.call('HGETALL', KEYS[2])}
+""",
+)
+
+
+def _presence_keys(room_id):
+    # hash tag keeps both keys in one slot for the script
+    return [
+        f"watchparty:{{{room_id}}}:connections",
+        f"watchparty:{{{room_id}}}:online",
+    ]
+
+
+def _run(room_id, add="", remove=""):
+    flipped, flat = PRESENCE_SCRIPT(
+        keys=_presence_keys(room_id),
+        args=[
+            time.time(),
+            settings.WATCHPARTY_PRESENCE_TTL,
+            add,
+            remove,
+        ],
+    )
+    counts = {
+        flat[i].decode(): int(flat[i + 1]) for i in range(0, len(flat), 2)
+    }
+    # a user swept and re-added in the same call did not really flip
+    flips = Counter(user.decode() for user in flipped)
+    return {user for user, n in flips.items() if n % 2}, counts
+
+
+def _member(username, connection):
+    return f"{username} {connection}"
+
+
+def presence_connect(room_id, username, connection):
+    """
+    Register a websocket connection of the user.
+
+    Returns (usernames whose online status changed, {username: connections}).
+    """
+    return _run(room_id, add=_member(username, connection))
+
+
+def presence_heartbeat(room_id, username, connection):
+    """Extend the connection deadline; re-adds it if it was swept."""
+    return _run(room_id, add=_member(username, connection))
+
+
+def presence_disconnect(room_id, username, connection):
+    return _run(room_id, remove=_member(username, connection))
+
+
+def online_counts(room_id):
+    """{username: live connections} with expired connections swept."""
+    return _run(room_id)[1]
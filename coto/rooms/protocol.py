@@ -0,0 +1,67 @@
+import json
+
+import msgpack
+
+__all__ = (
+    "decode_frame",
+    "encode_frame",
+    "frame_event",
+    "SUBPROTOCOL",
+)
+
+# Clients that offer this websocket subprotocol exchange binary
+# MessagePack frames; anyone else keeps talking JSON text. The hot sync
+# types travel as small integer codes instead of strings.
+SUBPROTOCOL = "coto.msgpack.v1"
+TYPE_CODES = {
+    "play": 1,
+    "pause": 2,
+    "seek": 3,
+    "keyframe": 4,
+    "ping": 5,
+    "pong": 6,
+    "player_state": 7,
+    "playlist_change": 8,
+    "leader": 9,
+}
+CODE_TYPES = {code: name for name, code in TYPE_CODES.items()}
+
+
+def encode_frame(message, binary):
+    """Message dict as a MessagePack frame (bytes) or JSON text."""
+    if not binary:
+        return json.dumps(message)
+
+    code = TYPE_CODES.get(message.get("type"))
+    if code is not None:
+        message = {**message, "type": code}
+
+    return msgpack.packb(message)
+
+
+def decode_frame(data):
+    """Message dict from a MessagePack frame; ValueError if malformed."""
+    try:
+        message = msgpack.unpackb(data)
+    except Exception as e:
+        raise ValueError("malformed frame") from e
+
+    if not isinstance(message, dict):
+        raise ValueError("frame is not a map")
+
+    if message.get("type") in CODE_TYPES:
+        message["type"] = CODE_TYPES[message["type"]]
+
+    return message
+
+
+def frame_event(message):
+    """
+    Group event carrying the message encoded once for both protocols;
+    each connection sends the encoding it negotiated.
+    """
+    return {
+        "type": "frame",
+        "text": encode_frame(message, binary=False),
+        "bytes": encode_frame(message, binary=True),
+    }
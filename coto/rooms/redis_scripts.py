@@ -0,0 +1,23 @@
+from django_redis import get_redis_connection
+
+__all__ = ("LuaScript",)
+
+
+class LuaScript:
+    """
+    Lua script registered on first use against the default cache's Redis
+    connection; calls go through EVALSHA and reload the script if Redis
+    was restarted.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self._script = None
+
+    def __call__(self, keys, args):
+        if self._script is None:
+            self._script = get_redis_connection("default").register_script(
+                self.source,
+            )
+
+        return self._script(keys=keys, args=args)
@@ -0,0 +1,140 @@
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django_redis import get_redis_connection
+
+from rooms.presence import online_counts
+from rooms.protocol import frame_event
+from rooms.redis_scripts import LuaScript
+
+__all__ = (
+    "announce_participant",
+    "decode_roster",
+    "load_roster",
+    "roster_event",
+    "roster_keys",
+    "roster_members",
+)
+
+# Participants of a room (usernames) are cached in a Redis set next to a
+# version that grows with every change of the roster or of anyone's
+# online status. Clients apply "participants_delta" events in version
+# order and ask for a full snapshot when they see a gap.
+#
+# A lost version restarts from the current time in ms, so it never goes
+# backwards for clients that remember a higher one.
+ROSTER_TTL = 60 * 60
+# the set always holds this marker, so an empty roster is cached too
+ROSTER_MARKER = ""
+
+# KEYS[1] — members set, KEYS[2] — version
+# ARGV: event (joined/left/online/offline), username, now (ms), ttl
+# Returns the new version.
+ROSTER_EVENT_SCRIPT = LuaScript(
+    """
+-- a cold roster is left alone: the next load reads the database, which
+-- already has the change
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    if ARGV[1] == 'joined' then
+        redis.call('SADD', KEYS[1], ARGV[2])
+    elseif ARGV[1] == 'left' then
+        redis.call('SREM', KEYS[1], ARGV[2])
+    end
+end
+
+local version = redis.call('INCR', KEYS[2])
+if version == 1 then
+    version = tonumber(ARGV[3])
+    redis.call('SET', KEYS[2], version)
+end
+redis.call('EXPIRE', KEYS[2], ARGV[4] * 24)
+return version
+""",
+)
+
+# KEYS[1] — members set, KEYS[2] — version
+# ARGV: now (ms), ttl, usernames...
+# Returns {members, version}; a roster loaded concurrently wins.
+LOAD_ROSTER_SCRIPT = LuaScript(
+    """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('SADD', KEYS[1], unpack(ARGV, 3))
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+
+local version = tonumber(redis.call('GET', KEYS[2]))
+if not version then
+    version = tonumber(ARGV[1])
+    redis.call('SET', KEYS[2], version, 'EX', ARGV[2] * 24)
+end
+return {redis.call('SMEMBERS', KEYS[1]), version}
+""",
+)
+
+
+def roster_keys(room_id):
+    return [
+        f"watchparty:{{{room_id}}}:roster",
+        f"watchparty:{{{room_id}}}:roster_version",
+    ]
+
+
+def _members(raw):
+    return sorted(
+        member.decode() for member in raw if member.decode() != ROSTER_MARKER
+    )
+
+
+def decode_roster(raw, version):
+    """Roster from raw SMEMBERS/GET replies, like roster_members."""
+    if not raw:
+        return None, None
+
+    return _members(raw), int(version or 0)
+
+
+def roster_members(room_id):
+    """(sorted usernames or None if the cache is cold, version)."""
+    members_key, version_key = roster_keys(room_id)
+    pipe = get_redis_connection("default").pipeline()
+    pipe.smembers(members_key)
+    pipe.get(version_key)
+    return decode_roster(*pipe.execute())
+
+
+def load_roster(room_id, usernames):
+    """Cache the roster read from the database; returns like roster_members."""
+    raw, version = LOAD_ROSTER_SCRIPT(
+        keys=roster_keys(room_id),
+        args=[int(time.time() * 1000), ROSTER_TTL, ROSTER_MARKER, *usernames],
+    )
+    return _members(raw), version
+
+
+def roster_event(room_id, event, username):
+    """Record a roster/presence change and return the new version."""
+    return ROSTER_EVENT_SCRIPT(
+        keys=roster_keys(room_id),
+        args=[event, username, int(time.time() * 1000), ROSTER_TTL],
+    )
+
+
+def announce_participant(room_id, event, username):
+    """Record a join/leave made outside the consumer and tell the room."""
+    version = roster_event(room_id, event, username)
+    # whoever joins from the room page is already connected
+    connections = online_counts(room_id).get(username, 0)
+    async_to_sync(get_channel_layer().group_send)(
+        f"watchparty_{room_id}",
+        frame_event(
+            {
+                "type": "participants_delta",
+                "event": event,
+                "username": username,
+                "version": version,
+                "online": connections > 0,
+                "connections": connections,
+            },
+        ),
+    )
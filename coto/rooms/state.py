@@ -0,0 +1,231 @@
+import time as _time
+
+from django.conf import settings
+from django_redis import get_redis_connection
+
+from rooms.leader import leader_key
+from rooms.redis_scripts import LuaScript
+
+__all__ = (
+    "apply_state",
+    "decode_state",
+    "get_state",
+    "project_state",
+    "refresh_hls_url",
+    "STATE_APPLIED",
+    "STATE_COALESCED",
+    "STATE_CONFLICT",
+    "STATE_NOT_LEADER",
+    "STATE_STALE",
+    "state_key",
+)
+
+STATE_APPLIED = "applied"
+# expected version did not match: the state changed concurrently
+STATE_CONFLICT = "conflict"
+# rejected by the stale-join / backtrack checks
+STATE_STALE = "stale"
+# keyframe from a connection that is not the room's time source
+STATE_NOT_LEADER = "not_leader"
+# keyframe within the room's rate limit or agreeing with the state
+STATE_COALESCED = "coalesced"
+
+# Playback state of a room lives in one Redis hash; every update goes
+# through this script, so the stale-join / backtrack checks and the write
+# happen atomically and concurrent play/seek commands cannot interleave.
+#
+# KEYS[1] — state hash, KEYS[2] — leader member (rooms.leader)
+# ARGV: kind (play/pause/seek/keyframe/select), time, ts (server time of
+#       the event, ms), video_id, hls_url, expected version ("" — no
+#       compare-and-set), time the client asked for (before seek
+#       snapping; used by the checks), sender member, server time (ms),
+#       keyframe interval (ms), keyframe tolerance (s), keyframe max gap
+#       (ms)
+#
+# Returns {status, current version}.
+APPLY_STATE_SCRIPT = LuaScript(
+    """
+local kind, time = ARGV[1], tonumber(ARGV[7])
+local now = tonumber(ARGV[9])
+local current = redis.call(
+    'HMGET', KEYS[1], 'version', 'time', 'is_playing', 'ts', 'keyframe_at'
+)
+local version = tonumber(current[1]) or 0
+
+if kind == 'keyframe' and redis.call('GET', KEYS[2]) ~= ARGV[8] then
+    return {'not_leader', version}
+end
+
+if ARGV[6] ~= '' and tonumber(ARGV[6]) ~= version then
+    return {'conflict', version}
+end
+
+if current[1] then
+    local stored = tonumber(current[2])
+    -- a room with real progress receiving t~0 from play/pause/seek is a
+    -- cold-start event from a joining client whose player hasn't synced
+    if kind ~= 'keyframe' and kind ~= 'select' and stored > 5 and time < 1 then
+        return {'stale', version}
+    end
+
+    if kind == 'keyframe' then
+        -- keyframes never move the room backwards (stale packet)
+        if time < stored - 1 then
+            return {'stale', version}
+        end
+
+        local since = now - (tonumber(current[5]) or 0)
+        if since < tonumber(ARGV[10]) then
+            return {'coalesced', version}
+        end
+
+        -- where the room should be by now; a keyframe agreeing with it
+        -- tells nobody anything, but one still goes out every max gap so
+        -- clients can tell the time source is alive
+        local expected = stored
+        if current[3] == '1' then
+            local elapsed = tonumber(ARGV[3]) - tonumber(current[4])
+            expected = stored + elapsed / 1000
+        end
+        if math.abs(time - expected) <= tonumber(ARGV[11])
+            and since < tonumber(ARGV[12]) then
+            return {'coalesced', version}
+        end
+    end
+end
+
+local playing
+if kind == 'keyframe' then
+    -- a keyframe does not override a pause
+    playing = current[3] or '1'
+elseif kind == 'play' or kind == 'select' then
+    playing = '1'
+else
+    playing = '0'
+end
+
+version = version + 1
+redis.call(
+    'HSET', KEYS[1],
+    'version', version,
+    'time', ARGV[2],
+    'ts', ARGV[3],
+    'is_playing', playing,
+    'video_id', ARGV[4],
+    'hls_url', ARGV[5]
+)
+if kind == 'keyframe' then
+    redis.call('HSET', KEYS[1], 'keyframe_at', now)
+end
+return {'applied', version}
+""",
+)
+
+
+# KEYS[1] — state hash
+# ARGV: video_id, hls_url
+# Returns 1 if the state plays that video and now points at hls_url.
+REFRESH_HLS_URL_SCRIPT = LuaScript(
+    """
+if redis.call('HGET', KEYS[1], 'video_id') ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'hls_url', ARGV[2])
+return 1
+""",
+)
+
+
+def state_key(room_id):
+    return f"watchparty:{{{room_id}}}:state"
+
+
+def apply_state(
+    room_id,
+    kind,
+    time,
+    ts,
+    video_id=None,
+    hls_url=None,
+    expected_version=None,
+    requested_time=None,
+    source="",
+):
+    """
+    Apply a playback command to the room state.
+
+    Returns (status, version). With expected_version the update is a
+    compare-and-set: it is rejected if the state changed in the meantime.
+    Keyframes are accepted only from the room's leader (source is the
+    sender's leader member) and are coalesced per room.
+    """
+    status, version = APPLY_STATE_SCRIPT(
+        keys=[state_key(room_id), leader_key(room_id)],
+        args=[
+            kind,
+            float(time),
+            int(ts),
+            int(video_id) if video_id else "",
+            str(hls_url) if hls_url else "",
+            "" if expected_version is None else int(expected_version),
+            float(time if requested_time is None else requested_time),
+            source,
+            int(_time.time() * 1000),
+            int(settings.WATCHPARTY_KEYFRAME_INTERVAL * 1000),
+            settings.WATCHPARTY_KEYFRAME_TOLERANCE,
+            int(settings.WATCHPARTY_KEYFRAME_MAX_GAP * 1000),
+        ],
+    )
+    return status.decode(), version
+
+
+def refresh_hls_url(room_id, video_id, hls_url):
+    """
+    Point the state at the video's new manifest if the room still plays
+    it. Playback does not move, so the version stays the same.
+    """
+    return bool(
+        REFRESH_HLS_URL_SCRIPT(
+            keys=[state_key(room_id)],
+            args=[int(video_id), str(hls_url)],
+        ),
+    )
+
+
+def decode_state(raw):
+    """State from the raw hash, None if the room has none."""
+    if not raw:
+        return None
+
+    state = {key.decode(): value.decode() for key, value in raw.items()}
+    return {
+        "time": float(state["time"]),
+        "ts": int(state["ts"]),
+        "is_playing": state["is_playing"] == "1",
+        "video_id": int(state["video_id"]) if state["video_id"] else None,
+        "hls_url": state["hls_url"] or None,
+        "version": int(state["version"]),
+    }
+
+
+def get_state(room_id):
+    """Current playback state of the room or None."""
+    return decode_state(
+        get_redis_connection("default").hgetall(state_key(room_id)),
+    )
+
+
+def project_state(state, now_ms):
+    """
+    The state as of now_ms (server time): while playing, the position has
+    advanced by the time elapsed since the last event.
+    """
+    if state is None:
+        return None
+
+    projected = dict(state)
+    if state["is_playing"]:
+        projected["time"] = state["time"] + max(now_ms - state["ts"], 0) / 1000
+
+    projected["ts"] = projected["server_ts"] = now_ms
+    return projected
@@ -0,0 +1,14 @@
+from celery import shared_task
+
+from rooms.chat import flush_pending_messages
+
+__all__ = ("flush_chat_messages",)
+
+
+@shared_task
+def flush_chat_messages():
+    """
+    Write queued chat messages to the database. Scheduled by the chat
+    itself and periodically as a safety net.
+    """
+    return flush_pending_messages()
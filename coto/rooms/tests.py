@@ -0,0 +1,448 @@
+import json
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import override_settings, SimpleTestCase, TestCase
+import fakeredis
+
+from rooms import chat
+from rooms.chat import (
+    enqueue_message,
+    flush_pending_messages,
+    LEGACY_PENDING_KEY,
+    pending_key,
+    pending_messages,
+    PENDING_ROOMS_KEY,
+)
+from rooms.leader import leader_key
+from rooms.models import ChatMessage, WatchParty
+from rooms.presence import (
+    online_counts,
+    presence_connect,
+    presence_disconnect,
+    presence_heartbeat,
+    PRESENCE_SCRIPT,
+)
+from rooms.roster import (
+    load_roster,
+    LOAD_ROSTER_SCRIPT,
+    roster_event,
+    ROSTER_EVENT_SCRIPT,
+    roster_keys,
+    roster_members,
+)
+from rooms.state import (
+    apply_state,
+    APPLY_STATE_SCRIPT,
+    get_state,
+    STATE_APPLIED,
+    STATE_COALESCED,
+    STATE_CONFLICT,
+    STATE_NOT_LEADER,
+    STATE_STALE,
+)
+
+__all__ = []
+
+ROOM_ID = 1
+LEADER = "alice specific.channel"
+
+
+class FakeRedisMixin:
+    """Runs rooms' Redis helpers and Lua scripts against fakeredis"""
+
+    modules = ("rooms.redis_scripts", "rooms.state")
+    scripts = (APPLY_STATE_SCRIPT,)
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        for module in self.modules:
+            patcher = mock.patch(
+                f"{module}.get_redis_connection",
+                return_value=self.redis,
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        # scripts register against the connection on first use
+        for script in self.scripts:
+            patcher = mock.patch.object(script, "_script", None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class FakeRedisTestCase(FakeRedisMixin, SimpleTestCase):
+    pass
+
+
+class ApplyStateTestCase(FakeRedisTestCase):
+    """Test playback commands applied atomically to the room state"""
+
+    def apply(self, kind, time, ts=1000, **kwargs):
+        return apply_state(ROOM_ID, kind, time=time, ts=ts, **kwargs)
+
+    def test_first_command_creates_state(self):
+        self.assertEqual(
+            self.apply("play", 0.0, video_id=7, hls_url="/m.m3u8"),
+            (STATE_APPLIED, 1),
+        )
+        state = get_state(ROOM_ID)
+        self.assertTrue(state["is_playing"])
+        self.assertEqual(state["video_id"], 7)
+        self.assertEqual(state["hls_url"], "/m.m3u8")
+
+    def test_versions_grow(self):
+        self.apply("play", 10.0)
+        self.assertEqual(self.apply("pause", 12.0), (STATE_APPLIED, 2))
+        self.assertEqual(self.apply("seek", 30.0), (STATE_APPLIED, 3))
+        state = get_state(ROOM_ID)
+        self.assertFalse(state["is_playing"])
+        self.assertEqual(state["time"], 30.0)
+
+    def test_cold_start_command_is_stale(self):
+        """Test t~0 from a joining client does not rewind the room"""
+        self.apply("play", 60.0)
+        self.assertEqual(self.apply("pause", 0.2), (STATE_STALE, 1))
+        self.assertEqual(get_state(ROOM_ID)["time"], 60.0)
+
+    def test_select_may_start_from_zero(self):
+        self.apply("play", 60.0)
+        self.assertEqual(self.apply("select", 0.0), (STATE_APPLIED, 2))
+
+    def test_stale_check_uses_requested_time(self):
+        """Test a seek snapped to 0 is not taken for a cold start"""
+        self.apply("play", 60.0)
+        self.assertEqual(
+            self.apply("seek", 0.0, requested_time=3.0),
+            (STATE_APPLIED, 2),
+        )
+
+    def test_keyframe_never_moves_backwards(self):
+        self.redis.set(leader_key(ROOM_ID), LEADER)
+        self.apply("play", 60.0)
+        self.assertEqual(
+            self.apply("keyframe", 50.0, ts=2000, source=LEADER),
+            (STATE_STALE, 1),
+        )
+
+    def test_compare_and_set(self):
+        self.apply("play", 10.0)
+        self.apply("seek", 40.0)
+        self.assertEqual(
+            self.apply("pause", 11.0, expected_version=1),
+            (STATE_CONFLICT, 2),
+        )
+        self.assertEqual(
+            self.apply("pause", 41.0, expected_version=2),
+            (STATE_APPLIED, 3),
+        )
+
+
+@override_settings(
+    WATCHPARTY_KEYFRAME_INTERVAL=1.0,
+    WATCHPARTY_KEYFRAME_TOLERANCE=0.5,
+    WATCHPARTY_KEYFRAME_MAX_GAP=6.0,
+)
+class KeyframeTestCase(FakeRedisTestCase):
+    """Test leader-only keyframes and their coalescing"""
+
+    def setUp(self):
+        super().setUp()
+        self.redis.set(leader_key(ROOM_ID), LEADER)
+        # server clock in seconds, see keyframe()
+        self.now = 100.0
+        patcher = mock.patch(
+            "rooms.state._time.time",
+            side_effect=lambda: self.now,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        apply_state(ROOM_ID, "play", time=10.0, ts=100_000)
+
+    def keyframe(self, time, after, source=LEADER):
+        """Keyframe sent `after` seconds past the play command."""
+        self.now = 100.0 + after
+        return apply_state(
+            ROOM_ID,
+            "keyframe",
+            time=time,
+            ts=int(self.now * 1000),
+            source=source,
+        )
+
+    def test_only_leader_keyframes(self):
+        self.assertEqual(
+            self.keyframe(20.0, 10, source="bob other.channel"),
+            (STATE_NOT_LEADER, 1),
+        )
+
+    def test_keyframe_within_interval_is_coalesced(self):
+        self.assertEqual(self.keyframe(13.0, 2), (STATE_APPLIED, 2))
+        self.assertEqual(self.keyframe(13.5, 2.5), (STATE_COALESCED, 2))
+
+    def test_keyframe_agreeing_with_state_is_coalesced(self):
+        self.assertEqual(self.keyframe(13.0, 2), (STATE_APPLIED, 2))
+        self.assertEqual(self.keyframe(14.4, 3.2), (STATE_COALESCED, 2))
+        self.assertEqual(self.keyframe(15.0, 3.4), (STATE_APPLIED, 3))
+
+    def test_drifted_keyframe_is_applied(self):
+        self.assertEqual(self.keyframe(14.0, 2), (STATE_APPLIED, 2))
+        state = get_state(ROOM_ID)
+        self.assertEqual(state["time"], 14.0)
+        self.assertTrue(state["is_playing"])
+
+    def test_keyframe_goes_out_every_max_gap(self):
+        self.assertEqual(self.keyframe(13.0, 2), (STATE_APPLIED, 2))
+        self.assertEqual(self.keyframe(18.0, 7), (STATE_COALESCED, 2))
+        self.assertEqual(self.keyframe(21.0, 10), (STATE_APPLIED, 3))
+
+    def test_keyframe_keeps_pause(self):
+        apply_state(ROOM_ID, "pause", time=12.0, ts=102_000)
+        self.assertEqual(self.keyframe(13.0, 3), (STATE_APPLIED, 3))
+        self.assertFalse(get_state(ROOM_ID)["is_playing"])
+
+
+@override_settings(WATCHPARTY_PRESENCE_TTL=30)
+class PresenceTestCase(FakeRedisTestCase):
+    """Test per-user connection counts kept by the presence script"""
+
+    scripts = (PRESENCE_SCRIPT,)
+
+    def setUp(self):
+        super().setUp()
+        self.now = 100.0
+        patcher = mock.patch(
+            "rooms.presence.time.time",
+            side_effect=lambda: self.now,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_tabs_flip_status_once(self):
+        self.assertEqual(
+            presence_connect(ROOM_ID, "alice", "tab1"),
+            ({"alice"}, {"alice": 1}),
+        )
+        self.assertEqual(
+            presence_connect(ROOM_ID, "alice", "tab2"),
+            (set(), {"alice": 2}),
+        )
+        self.assertEqual(
+            presence_connect(ROOM_ID, "bob", "tab1"),
+            ({"bob"}, {"alice": 2, "bob": 1}),
+        )
+
+        self.assertEqual(
+            presence_disconnect(ROOM_ID, "alice", "tab1"),
+            (set(), {"alice": 1, "bob": 1}),
+        )
+        self.assertEqual(
+            presence_disconnect(ROOM_ID, "alice", "tab2"),
+            ({"alice"}, {"bob": 1}),
+        )
+
+    def test_repeated_connect_and_disconnect(self):
+        presence_connect(ROOM_ID, "alice", "tab1")
+        self.assertEqual(
+            presence_connect(ROOM_ID, "alice", "tab1"),
+            (set(), {"alice": 1}),
+        )
+        presence_disconnect(ROOM_ID, "alice", "tab1")
+        self.assertEqual(
+            presence_disconnect(ROOM_ID, "alice", "tab1"),
+            (set(), {}),
+        )
+
+    def test_silent_connections_expire(self):
+        presence_connect(ROOM_ID, "alice", "tab1")
+        presence_connect(ROOM_ID, "bob", "tab1")
+        self.now = 120.0
+        presence_heartbeat(ROOM_ID, "bob", "tab1")
+
+        self.now = 140.0
+        self.assertEqual(online_counts(ROOM_ID), {"bob": 1})
+        self.assertEqual(
+            presence_disconnect(ROOM_ID, "alice", "tab1"),
+            (set(), {"bob": 1}),
+        )
+
+    def test_heartbeat_after_sweep_does_not_flip(self):
+        """Test a connection swept and re-added in one call stays online"""
+        presence_connect(ROOM_ID, "alice", "tab1")
+        self.now = 140.0
+        self.assertEqual(
+            presence_heartbeat(ROOM_ID, "alice", "tab1"),
+            (set(), {"alice": 1}),
+        )
+
+
+class RosterTestCase(FakeRedisTestCase):
+    """Test the cached roster and its version"""
+
+    modules = ("rooms.redis_scripts", "rooms.roster")
+    scripts = (LOAD_ROSTER_SCRIPT, ROSTER_EVENT_SCRIPT)
+
+    def setUp(self):
+        super().setUp()
+        self.now = 100.0
+        patcher = mock.patch(
+            "rooms.roster.time.time",
+            side_effect=lambda: self.now,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_load_caches_roster(self):
+        self.assertEqual(roster_members(ROOM_ID), (None, None))
+        self.assertEqual(
+            load_roster(ROOM_ID, ["bob", "alice"]),
+            (["alice", "bob"], 100_000),
+        )
+        self.assertEqual(roster_members(ROOM_ID), (["alice", "bob"], 100_000))
+
+    def test_empty_roster_is_cached(self):
+        self.assertEqual(load_roster(ROOM_ID, []), ([], 100_000))
+        self.assertEqual(roster_members(ROOM_ID), ([], 100_000))
+
+    def test_concurrent_load_keeps_first(self):
+        load_roster(ROOM_ID, ["alice"])
+        self.now = 101.0
+        self.assertEqual(
+            load_roster(ROOM_ID, ["alice", "bob"]),
+            (["alice"], 100_000),
+        )
+
+    def test_events_grow_version(self):
+        load_roster(ROOM_ID, ["alice", "bob"])
+        self.assertEqual(roster_event(ROOM_ID, "joined", "carol"), 100_001)
+        self.assertEqual(roster_event(ROOM_ID, "left", "bob"), 100_002)
+        self.assertEqual(roster_event(ROOM_ID, "offline", "alice"), 100_003)
+        self.assertEqual(
+            roster_members(ROOM_ID),
+            (["alice", "carol"], 100_003),
+        )
+
+    def test_event_on_cold_roster(self):
+        """Test a cold roster is left for the database load"""
+        self.assertEqual(roster_event(ROOM_ID, "joined", "alice"), 100_000)
+        self.assertEqual(roster_members(ROOM_ID), (None, None))
+        # the version survives the load
+        self.now = 101.0
+        self.assertEqual(load_roster(ROOM_ID, ["alice"]), (["alice"], 100_000))
+        self.assertEqual(roster_event(ROOM_ID, "online", "alice"), 100_001)
+
+    def test_lost_version_does_not_go_backwards(self):
+        load_roster(ROOM_ID, ["alice"])
+        roster_event(ROOM_ID, "online", "alice")
+        self.redis.delete(roster_keys(ROOM_ID)[1])
+        self.now = 102.0
+        self.assertEqual(roster_event(ROOM_ID, "offline", "alice"), 102_000)
+
+
+@override_settings(
+    WATCHPARTY_CHAT_FLUSH_BATCH=2,
+    WATCHPARTY_CHAT_FLUSH_INTERVAL=2,
+    WATCHPARTY_CHAT_HISTORY=50,
+)
+class ChatWriteBehindTestCase(FakeRedisMixin, TestCase):
+    """Test per-room chat queues and their flush to the database"""
+
+    modules = ("rooms.chat",)
+    scripts = ()
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch("rooms.tasks.flush_chat_messages")
+        self.flush_task = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user("alice", "a@example.com")
+        self.room, self.other = (
+            WatchParty.objects.create(name=name, host=self.user)
+            for name in ("Room", "Other")
+        )
+
+    def send(self, room, content):
+        return enqueue_message(room.pk, self.user, content)
+
+    def saved(self, room):
+        return list(
+            ChatMessage.objects.filter(room=room).values_list(
+                "content",
+                flat=True,
+            ),
+        )
+
+    def test_queues_are_per_room(self):
+        self.send(self.room, "hi")
+        self.send(self.other, "hello")
+        self.assertEqual(
+            [message["content"] for message in pending_messages(self.room.pk)],
+            ["hi"],
+        )
+        self.assertEqual(
+            self.redis.smembers(PENDING_ROOMS_KEY),
+            {str(self.room.pk).encode(), str(self.other.pk).encode()},
+        )
+
+    def test_flush_scheduling(self):
+        self.send(self.room, "one")
+        self.flush_task.apply_async.assert_called_once_with(countdown=2)
+        self.send(self.room, "two")
+        self.flush_task.delay.assert_called_once_with()
+
+    def test_flush_writes_and_empties_queues(self):
+        for content in ("one", "two", "three"):
+            self.send(self.room, content)
+        self.send(self.other, "other")
+
+        self.assertEqual(flush_pending_messages(), 4)
+        self.assertEqual(self.saved(self.room), ["one", "two", "three"])
+        self.assertEqual(self.saved(self.other), ["other"])
+        self.assertFalse(self.redis.exists(pending_key(self.room.pk)))
+        self.assertFalse(self.redis.smembers(PENDING_ROOMS_KEY))
+
+    def test_rewritten_batch_is_not_duplicated(self):
+        """Test a batch written before a crash is skipped the next time"""
+        self.send(self.room, "one")
+        flush_pending_messages()
+        # the crash: rows written, the queue not trimmed
+        ChatMessage.objects.all().delete()
+        self.send(self.room, "two")
+        key = pending_key(self.room.pk)
+        self.redis.rpush(key, self.redis.lindex(key, 0))
+
+        flush_pending_messages()
+        self.assertEqual(self.saved(self.room), ["two"])
+
+    def test_flush_drains_legacy_queue(self):
+        payload = self.send(self.room, "queued before")
+        self.redis.delete(pending_key(self.room.pk), PENDING_ROOMS_KEY)
+        self.redis.rpush(LEGACY_PENDING_KEY, json.dumps(payload))
+
+        self.assertEqual(flush_pending_messages(), 1)
+        self.assertFalse(self.redis.exists(LEGACY_PENDING_KEY))
+
+    def test_busy_lock_turns_flush_away(self):
+        self.send(self.room, "one")
+        self.redis.set("watchparty:chat:flush_lock", "other flusher")
+        self.assertEqual(flush_pending_messages(), 0)
+        self.assertEqual(self.saved(self.room), [])
+
+    def test_flush_outliving_its_lock(self):
+        for content in ("one", "two", "three"):
+            self.send(self.room, content)
+
+        save_batch = chat._save_batch
+
+        def save_and_expire(messages):
+            save_batch(messages)
+            # the lock expires while the first batch is written
+            self.redis.delete("watchparty:chat:flush_lock")
+
+        with mock.patch.object(chat, "_save_batch", save_and_expire):
+            self.assertEqual(flush_pending_messages(), 2)
+
+        self.assertEqual(self.saved(self.room), ["one", "two"])
+        # the rest is left for the flusher that took over
+        self.assertEqual(len(pending_messages(self.room.pk)), 1)
@@ -1,6 +1,7 @@
 from django.urls import path
 
 from rooms.views import (
+    ChatHistoryView,
     ExternalStreamView,
     google_drive_proxy_view,
     JoinPrivateRoomView,
@@ -28,4 +29,9 @@ urlpatterns = [
     path("<int:pk>/leave/", LeaveRoomView.as_view(), name="leave"),
     path("<int:pk>/stream/", ExternalStreamView.as_view(), name="stream"),
     path("<int:pk>/proxy/", google_drive_proxy_view, name="gdrive_proxy"),
+    path(
+        "<int:pk>/chat/history/",
+        ChatHistoryView.as_view(),
+        name="chat_history",
+    ),
 ]
@@ -1,5 +1,4 @@
 import asyncio
-import json
 import re
 import time
 from urllib.parse import parse_qs, urlparse
@@ -28,8 +27,11 @@ from django.views.generic import (
 import httpx
 import yt_dlp
 
+from rooms.chat import older_messages, parse_cursor
 from rooms.forms import JoinPrivateRoomForm, RoomCreateForm, RoomUpdateForm
 from rooms.models import WatchParty
+from rooms.protocol import frame_event
+from rooms.roster import announce_participant
 
 __all__ = ()
 
@@ -81,6 +83,42 @@ class RoomDetailView(DetailView):
         return super().get(request, *args, **kwargs)
 
 
+class ChatHistoryView(LoginRequiredMixin, View):
+    """
+    Подгрузка старых сообщений чата: GET ?before=<курсор>&limit=<n>.
+    Курсор берётся из истории при подключении или из прошлого ответа.
+    """
+
+    max_limit = 100
+
+    def get(self, request, pk):
+        room = get_object_or_404(WatchParty, pk=pk)
+        if (
+            room.is_private
+            and request.user != room.host
+            and not room.participants.filter(pk=request.user.pk).exists()
+            and not request.session.get(f"room_access_{room.pk}")
+        ):
+            return JsonResponse({"error": "Нет доступа к комнате"}, status=403)
+
+        try:
+            limit = int(request.GET.get("limit", 50))
+            limit = max(1, min(limit, self.max_limit))
+            before = request.GET.get("before")
+            before = parse_cursor(before) if before else None
+        except ValueError:
+            return JsonResponse({"error": "Неверные параметры"}, status=400)
+
+        page = older_messages(room.pk, before=before, limit=limit)
+        return JsonResponse(
+            {
+                "messages": page,
+                # неполная страница — дальше сообщений нет
+                "before": page[0]["cursor"] if len(page) >= limit else None,
+            },
+        )
+
+
 class JoinRoomView(LoginRequiredMixin, View):
     def post(self, request, pk):
         room = get_object_or_404(WatchParty, pk=pk)
@@ -109,38 +147,21 @@ class JoinRoomView(LoginRequiredMixin, View):
                 f"Вы присоединились к комнате «{room.name}».",
             )
 
-            # Отправляем системное сообщение и список участников
+            # Отправляем системное сообщение и изменение списка участников
             channel_layer = get_channel_layer()
-            participants = list(
-                room.participants.values_list("username", flat=True),
-            )
             async_to_sync(channel_layer.group_send)(
                 f"watchparty_{room.pk}",
-                {
-                    "type": "broadcast",
-                    "text": json.dumps(
-                        {
-                            "type": "message",
-                            "message": f"{request.user.username} \
+                frame_event(
+                    {
+                        "type": "message",
+                        "message": f"{request.user.username} \
                                 присоединился к комнате",
-                            "system": True,
-                            "username": request.user.username,
-                        },
-                    ),
-                },
-            )
-            async_to_sync(channel_layer.group_send)(
-                f"watchparty_{room.pk}",
-                {
-                    "type": "broadcast",
-                    "text": json.dumps(
-                        {
-                            "type": "participants",
-                            "participants": participants,
-                        },
-                    ),
-                },
+                        "system": True,
+                        "username": request.user.username,
+                    },
+                ),
             )
+            announce_participant(room.pk, "joined", request.user.username)
 
         return redirect(reverse("rooms:detail", kwargs={"pk": room.pk}))
 
@@ -152,36 +173,19 @@ class LeaveRoomView(LoginRequiredMixin, View):
         messages.success(request, f"Вы покинули комнату «{room.name}».")
 
         channel_layer = get_channel_layer()
-        participants = list(
-            room.participants.values_list("username", flat=True),
-        )
         async_to_sync(channel_layer.group_send)(
             f"watchparty_{room.pk}",
-            {
-                "type": "broadcast",
-                "text": json.dumps(
-                    {
-                        "type": "message",
-                        "message": f"{request.user.username}\
+            frame_event(
+                {
+                    "type": "message",
+                    "message": f"{request.user.username}\
                             покинул(а) комнату",
-                        "system": True,
-                        "username": request.user.username,
-                    },
-                ),
-            },
-        )
-        async_to_sync(channel_layer.group_send)(
-            f"watchparty_{room.pk}",
-            {
-                "type": "broadcast",
-                "text": json.dumps(
-                    {
-                        "type": "participants",
-                        "participants": participants,
-                    },
-                ),
-            },
+                    "system": True,
+                    "username": request.user.username,
+                },
+            ),
         )
+        announce_participant(room.pk, "left", request.user.username)
         return redirect(reverse("rooms:list"))
 
 
@@ -266,37 +270,24 @@ class JoinPrivateRoomView(LoginRequiredMixin, FormView):
                     ате "{room.name}"!',
             )
 
-            # Отправляем системное сообщение
+            # Отправляем системное сообщение и изменение списка участников
             channel_layer = get_channel_layer()
-            participants = list(
-                room.participants.values_list("username", flat=True),
-            )
             async_to_sync(channel_layer.group_send)(
                 f"watchparty_{room.pk}",
-                {
-                    "type": "broadcast",
-                    "text": json.dumps(
-                        {
-                            "type": "message",
-                            "message": f"{self.request.user.username} \
+                frame_event(
+                    {
+                        "type": "message",
+                        "message": f"{self.request.user.username} \
                                 присоединился к комнате",
-                            "system": True,
-                            "username": self.request.user.username,
-                        },
-                    ),
-                },
+                        "system": True,
+                        "username": self.request.user.username,
+                    },
+                ),
             )
-            async_to_sync(channel_layer.group_send)(
-                f"watchparty_{room.pk}",
-                {
-                    "type": "broadcast",
-                    "text": json.dumps(
-                        {
-                            "type": "participants",
-                            "participants": participants,
-                        },
-                    ),
-                },
+            announce_participant(
+                room.pk,
+                "joined",
+                self.request.user.username,
             )
 
             return redirect("rooms:detail", pk=room.pk)
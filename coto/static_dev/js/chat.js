@@ -138,7 +138,7 @@ document.addEventListener("DOMContentLoaded", function () {
     });
 
     // ── Chat messages ─────────────────────────────────────────────────────
-    function appendMessage(username, message, system = false, timestamp = null) {
+    function buildMessage(username, message, system = false, timestamp = null) {
         const div = document.createElement("div");
         div.classList.add("chat-message");
 
@@ -157,10 +157,62 @@ document.addEventListener("DOMContentLoaded", function () {
             div.innerHTML = `<strong>${escapeHtml(username)}:</strong> ${escapeHtml(message)}<span class="message-meta">${timeText}</span>`;
         }
 
-        chatMessages.appendChild(div);
+        return div;
+    }
+
+    function appendMessage(username, message, system = false, timestamp = null) {
+        chatMessages.appendChild(buildMessage(username, message, system, timestamp));
         chatMessages.scrollTop = chatMessages.scrollHeight;
     }
 
+    // ── Older history (keyset pages from /rooms/<id>/chat/history/) ──────
+    let olderCursor = null;
+    let olderButton = null;
+
+    function renderOlderButton() {
+        if (!olderCursor) {
+            if (olderButton) olderButton.remove();
+            olderButton = null;
+            return;
+        }
+        if (!olderButton) {
+            olderButton = document.createElement("button");
+            olderButton.type = "button";
+            olderButton.className = "btn btn-sm btn-link align-self-center";
+            olderButton.textContent = "Загрузить ранее";
+            olderButton.addEventListener("click", loadOlderMessages);
+        }
+        chatMessages.prepend(olderButton);
+    }
+
+    async function loadOlderMessages() {
+        if (!olderCursor) return;
+        olderButton.disabled = true;
+        try {
+            const url = `/rooms/${roomId}/chat/history/?before=${encodeURIComponent(olderCursor)}`;
+            const resp = await fetch(url, { credentials: "same-origin" });
+            if (!resp.ok) throw new Error(`HTTP ${resp.status}`);
+            const data = await resp.json();
+
+            // keep the view where it was while content grows above it
+            const fromBottom = chatMessages.scrollHeight - chatMessages.scrollTop;
+            const anchor = olderButton.nextSibling;
+            data.messages.forEach(msg => {
+                chatMessages.insertBefore(
+                    buildMessage(msg.username, msg.message, msg.system, msg.timestamp),
+                    anchor,
+                );
+            });
+            chatMessages.scrollTop = chatMessages.scrollHeight - fromBottom;
+            olderCursor = data.before;
+        } catch (e) {
+            console.error("Older chat history failed:", e);
+        } finally {
+            if (olderButton) olderButton.disabled = false;
+            renderOlderButton();
+        }
+    }
+
     // ── Participants rendering ─────────────────────────────────────────────
     function renderParticipants(participants, count) {
         console.log("Rendering participants:", participants);
@@ -175,8 +227,8 @@ document.addEventListener("DOMContentLoaded", function () {
         participants.forEach(entry => {
             try {
                 // Support BOTH formats:
-                //  • string  (from views.py broadcast)         → always online
-                //  • object  (from consumers.py participants_update) → has .online flag
+                //  • string  (old views.py broadcast)          → always online
+                //  • object  (from consumers.py snapshot)      → has .online flag
                 let username, isOnline;
                 if (typeof entry === "object" && entry !== null) {
                     username = String(entry.username || "Anonymous");
@@ -206,6 +258,59 @@ document.addEventListener("DOMContentLoaded", function () {
         }
     }
 
+    function setHistory(data) {
+        // sent again on every reconnect: replace, don't append
+        chatMessages.innerHTML = "";
+        olderButton = null;
+        data.messages.forEach(msg => {
+            appendMessage(msg.username, msg.message, msg.system, msg.timestamp);
+        });
+        olderCursor = data.before;
+        renderOlderButton();
+    }
+
+    // ── Participants deltas ────────────────────────────────────────────────
+    // The server sends the full list once on connect and then only
+    // versioned changes; a gap in versions means a delta was missed and a
+    // fresh snapshot is requested.
+    let participants = [];
+    let participantsVersion = null;
+    let participantsResync = false;
+
+    function setParticipants(data) {
+        participantsResync = false;
+        participants = Array.isArray(data.participants) ? data.participants : [];
+        participantsVersion = (typeof data.version === "number") ? data.version : null;
+        renderParticipants(participants, data.count);
+    }
+
+    function applyParticipantsDelta(data) {
+        if (participantsVersion === null || participantsResync) return;
+        if (data.version <= participantsVersion) return;
+        if (data.version !== participantsVersion + 1) {
+            participantsResync = true;
+            chatSocket.send(JSON.stringify({ type: "participants_update" }));
+            return;
+        }
+        participantsVersion = data.version;
+
+        const index = participants.findIndex(p => p.username === data.username);
+        if (data.event === "joined" && index === -1) {
+            participants.push({
+                username: data.username,
+                online: Boolean(data.online),
+                connections: data.connections || 0,
+            });
+            participants.sort((a, b) => (a.username < b.username ? -1 : a.username > b.username ? 1 : 0));
+        } else if (data.event === "left" && index !== -1) {
+            participants.splice(index, 1);
+        } else if ((data.event === "online" || data.event === "offline") && index !== -1) {
+            participants[index].online = data.event === "online";
+            participants[index].connections = data.connections || 0;
+        }
+        renderParticipants(participants, participants.length);
+    }
+
     // ── WebSocket ─────────────────────────────────────────────────────────
     let chatSocket = null;
     let reconnectAttempts = 0;
@@ -213,6 +318,9 @@ document.addEventListener("DOMContentLoaded", function () {
     const reconnectDelay = 3000;
     let reconnectTimeout = null;
     let messageQueue = [];
+    // presence heartbeat: the server drops connections silent for a minute
+    const heartbeatInterval = 20000;
+    let heartbeatTimer = null;
 
     function connectWebSocket() {
         if (chatSocket && (chatSocket.readyState === WebSocket.CONNECTING || chatSocket.readyState === WebSocket.OPEN)) {
@@ -229,6 +337,12 @@ document.addEventListener("DOMContentLoaded", function () {
                 const msg = messageQueue.shift();
                 chatSocket.send(msg);
             }
+            clearInterval(heartbeatTimer);
+            heartbeatTimer = setInterval(() => {
+                if (chatSocket.readyState === WebSocket.OPEN) {
+                    chatSocket.send(JSON.stringify({ type: "ping", ts: Date.now() }));
+                }
+            }, heartbeatInterval);
         };
 
         chatSocket.onmessage = function (e) {
@@ -244,13 +358,21 @@ document.addEventListener("DOMContentLoaded", function () {
             }
 
             if (data.type === "participants") {
-                renderParticipants(data.participants, data.count);
+                setParticipants(data);
+            }
+
+            if (data.type === "participants_delta") {
+                applyParticipantsDelta(data);
             }
 
             if (data.type === "history") {
-                data.messages.forEach(msg => {
-                    appendMessage(msg.username, msg.message, msg.system, msg.timestamp);
-                });
+                setHistory(data);
+            }
+
+            // one frame on connect: history and participants
+            if (data.type === "bootstrap") {
+                setHistory(data.history);
+                setParticipants(data.participants);
             }
 
             // Ignore player_state / playlist_change / keyframe / play / pause etc.
@@ -263,6 +385,7 @@ document.addEventListener("DOMContentLoaded", function () {
 
         chatSocket.onclose = function (e) {
             console.log("Chat WS disconnected, code:", e.code);
+            clearInterval(heartbeatTimer);
 
             // code 4003 = not authenticated, do not retry
             if (e.code === 4003) {
@@ -311,6 +434,7 @@ document.addEventListener("DOMContentLoaded", function () {
     // ── Cleanup ───────────────────────────────────────────────────────────
     window.addEventListener("beforeunload", function () {
         if (reconnectTimeout) clearTimeout(reconnectTimeout);
+        clearInterval(heartbeatTimer);
         if (chatSocket) chatSocket.close();
     });
 
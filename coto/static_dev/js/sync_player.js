@@ -9,6 +9,18 @@ function uuidv4() {
   });
 }
 
+// Binary sync protocol (rooms/protocol.py): MessagePack frames with the hot
+// message types as small integer codes. Offered only when the MessagePack
+// library is loaded; a server that doesn't pick it keeps talking JSON.
+const SYNC_SUBPROTOCOL = "coto.msgpack.v1";
+const SYNC_TYPE_CODES = {
+  play: 1, pause: 2, seek: 3, keyframe: 4, ping: 5, pong: 6,
+  player_state: 7, playlist_change: 8, leader: 9,
+};
+const SYNC_CODE_TYPES = Object.fromEntries(
+  Object.entries(SYNC_TYPE_CODES).map(([name, code]) => [code, name])
+);
+
 class ReconnectingWebSocket {
   constructor(url, protocols = [], opts = {}) {
     this.url = url;
@@ -23,6 +35,7 @@ class ReconnectingWebSocket {
       autoReconnect: true,
       clientId: uuidv4(),
       requestStateOnOpen: true,
+      pingExtra: null,
     }, opts);
 
     this.ws = null;
@@ -63,6 +76,8 @@ class ReconnectingWebSocket {
       return;
     }
 
+    this.ws.binaryType = 'arraybuffer';
+
     this.ws.onopen = (ev) => {
       this.retryCount = 0;
       this._startHeartbeat();
@@ -78,7 +93,8 @@ class ReconnectingWebSocket {
 
     this.ws.onmessage = (ev) => {
       this._resetHeartbeatTimeout();
-      this.messageHandlers.forEach(h => h.call(this, ev));
+      const event = this._decode(ev);
+      this.messageHandlers.forEach(h => h.call(this, event));
     };
 
     this.ws.onclose = (ev) => {
@@ -131,13 +147,13 @@ class ReconnectingWebSocket {
       if (typeof data === 'object') {
         const copy = Object.assign({}, data);
         if (!copy.client_id) copy.client_id = this.opts.clientId;
-        out = JSON.stringify(copy);
+        out = this._encode(copy);
       } else {
         try {
           const obj = JSON.parse(data);
           if (obj && typeof obj === 'object') {
             if (!obj.client_id) obj.client_id = this.opts.clientId;
-            out = JSON.stringify(obj);
+            out = this._encode(obj);
           }
         } catch (_) {
           out = data;
@@ -147,6 +163,30 @@ class ReconnectingWebSocket {
     return this.send(out);
   }
 
+  get binary() {
+    return Boolean(this.ws && this.ws.protocol === SYNC_SUBPROTOCOL);
+  }
+
+  _encode(obj) {
+    if (!this.binary) return JSON.stringify(obj);
+    const code = SYNC_TYPE_CODES[obj.type];
+    return MessagePack.encode(code ? Object.assign({}, obj, { type: code }) : obj);
+  }
+
+  // Binary frames are handed to the handlers already decoded, as
+  // { data, message }; text frames stay plain MessageEvents
+  _decode(ev) {
+    if (!(ev.data instanceof ArrayBuffer)) return ev;
+    let message = null;
+    try {
+      message = MessagePack.decode(new Uint8Array(ev.data));
+      if (typeof message.type === 'number') message.type = SYNC_CODE_TYPES[message.type];
+    } catch (e) {
+      console.warn('malformed binary frame', e);
+    }
+    return { data: ev.data, message };
+  }
+
   _flushQueue() {
     while (this.messageQueue.length && this.ws && this.ws.readyState === WebSocket.OPEN) {
       const msg = this.messageQueue.shift();
@@ -169,7 +209,7 @@ class ReconnectingWebSocket {
     if (!this.opts.heartbeatInterval) return;
     this._heartbeatTimer = setInterval(() => {
       try {
-        this.sendSafe({ type: 'ping', client_id: this.opts.clientId, ts: Date.now() });
+        this.ping();
         this._heartbeatTimeoutTimer = setTimeout(() => {
           console.warn('heartbeat timeout, forcing reconnect');
           try { if (this.ws) this.ws.close(); } catch (e) { }
@@ -178,6 +218,11 @@ class ReconnectingWebSocket {
     }, this.opts.heartbeatInterval);
   }
 
+  ping() {
+    const extra = this.opts.pingExtra ? this.opts.pingExtra() : {};
+    this.sendSafe(Object.assign({ type: 'ping', client_id: this.opts.clientId, ts: Date.now() }, extra));
+  }
+
   _resetHeartbeatTimeout() {
     if (this._heartbeatTimeoutTimer) {
       clearTimeout(this._heartbeatTimeoutTimer);
@@ -210,12 +255,53 @@ document.addEventListener("DOMContentLoaded", () => {
   if (!videoEl) return;
 
   const roomId = videoEl.dataset.roomId;
-  const isHost = videoEl.dataset.isHost === "true";
+  // The server elects one player per room as the time source (the host's
+  // when connected) and tells it via a "leader" message
+  let isTimeSource = false;
 
   // ── Sync state variables (initialized early to avoid TDZ) ────────────────
   let waitingForInitialState = true;
   let suppressEvent = false;
   let lastSeekSent = 0;
+  // Version of the room state last applied (server increments it on
+  // every accepted change); older broadcasts are out of order
+  let stateVersion = 0;
+
+  // ── Clock sync (NTP-style) ───────────────────────────────────────────────
+  // offset = server clock - local clock, from ping/pong:
+  //   rtt = (t3 - t0) - (t2 - t1), offset = ((t1 - t0) + (t2 - t3)) / 2
+  // The sample with the smallest round trip is the most accurate; the
+  // estimate is reported back in pings so the server can date our commands.
+  const clock = { offset: 0, rtt: 0, synced: false, samples: [] };
+
+  function _onPong(msg) {
+    if (typeof msg.server_received !== "number" || typeof msg.ts !== "number") return;
+    const t3 = Date.now();
+    const rtt = Math.max(0, (t3 - msg.ts) - (msg.server_sent - msg.server_received));
+    const offset = ((msg.server_received - msg.ts) + (msg.server_sent - t3)) / 2;
+    clock.samples.push({ rtt, offset });
+    if (clock.samples.length > 8) clock.samples.shift();
+    const best = clock.samples.reduce((a, b) => (b.rtt < a.rtt ? b : a));
+    clock.offset = best.offset;
+    clock.rtt = best.rtt;
+    clock.synced = true;
+  }
+
+  // Seconds since a server-stamped event (player_state is stamped when sent)
+  function latencySince(msg) {
+    if (typeof msg.server_ts === "number") {
+      if (!clock.synced) return 0;
+      return Math.max(0, Date.now() + clock.offset - msg.server_ts) / 1000;
+    }
+    return msg.ts ? (Date.now() - msg.ts) / 1000 : 0;
+  }
+
+  function _acceptVersion(msg) {
+    if (typeof msg.version !== "number") return true;
+    if (msg.version < stateVersion) return false;
+    stateVersion = msg.version;
+    return true;
+  }
 
   // Drift correction state
   let _lastKeyframeTime = null;
@@ -711,16 +797,18 @@ document.addEventListener("DOMContentLoaded", () => {
   }
 
   const wsScheme = window.location.protocol === "https:" ? "wss" : "ws";
-  const wsUrl = `${wsScheme}://${window.location.host}/ws/room/${roomId}/`;
+  const wsUrl = `${wsScheme}://${window.location.host}/ws/room/${roomId}/?player=1`;
 
-  const socket = new ReconnectingWebSocket(wsUrl, [], {
+  const socket = new ReconnectingWebSocket(wsUrl, window.MessagePack ? [SYNC_SUBPROTOCOL] : [], {
     minDelay: 500,
     maxDelay: 25000,
     jitter: 0.25,
     heartbeatInterval: 20000,
     heartbeatTimeout: 8000,
     clientId: uuidv4(),
-    requestStateOnOpen: true,
+    // the state already comes in the bootstrap frame
+    requestStateOnOpen: false,
+    pingExtra: () => (clock.synced ? { offset: clock.offset, rtt: clock.rtt } : {}),
   });
   window.roomSocket = socket;
 
@@ -729,7 +817,13 @@ document.addEventListener("DOMContentLoaded", () => {
   const playlistItems = document.querySelectorAll(".playlist-item");
   const currentEpisodeLabel = document.getElementById("current-episode");
 
-  socket.addEventListener('open', () => console.log("🔌 WS connected"));
+  socket.addEventListener('open', () => {
+    console.log("🔌 WS connected");
+    // a short burst of pings gives a clock estimate within the first second
+    [0, 150, 300, 450].forEach(delay => setTimeout(() => {
+      if (socket.readyState === WebSocket.OPEN) socket.ping();
+    }, delay));
+  });
   socket.addEventListener('close', (ev) => {
     console.log("🔌 WS disconnected, code:", ev.code);
     if (ev.code === 4003) {
@@ -768,14 +862,14 @@ document.addEventListener("DOMContentLoaded", () => {
     sendCmd("seek");
   });
 
-  // ── Host keyframe broadcaster (2s interval) ──────────────────────────────
-  if (isHost) {
-    setInterval(() => {
-      if (!player.paused && socket.readyState === WebSocket.OPEN) {
-        socket.sendSafe({ type: "keyframe", time: player.currentTime, ts: Date.now() });
-      }
-    }, 2000);
-  }
+  // ── Time-source keyframe broadcaster (2s interval) ───────────────────────
+  setInterval(() => {
+    if (isTimeSource && !player.paused && socket.readyState === WebSocket.OPEN) {
+      // carries the version it was computed against: if the room changed
+      // meanwhile (someone seeked) the server drops it instead of undoing it
+      socket.sendSafe({ type: "keyframe", time: player.currentTime, ts: Date.now(), version: stateVersion });
+    }
+  }, 2000);
 
   // ── Drift correction ─────────────────────────────────────────────────────
   // δ < 4s  → no action (tolerate network jitter)
@@ -873,8 +967,21 @@ document.addEventListener("DOMContentLoaded", () => {
 
   // ── Central message handler ──────────────────────────────────────────────
   socket.addEventListener('message', (ev) => {
-    let msg;
-    try { msg = JSON.parse(ev.data); } catch (e) { return; }
+    let msg = ev.message;
+    if (msg === undefined) {
+      try { msg = JSON.parse(ev.data); } catch (e) { return; }
+    }
+    if (!msg) return;
+
+    if (msg.type === "pong") {
+      _onPong(msg);
+      return;
+    }
+
+    // one frame on connect; this socket only needs the playback state
+    if (msg.type === "bootstrap") {
+      msg = { type: "player_state", state: msg.state };
+    }
 
     if (msg.type === "player_state") {
       const st = msg.state;
@@ -886,8 +993,9 @@ document.addEventListener("DOMContentLoaded", () => {
         setSyncingUI(false);
         return;
       }
+      if (typeof st.version === "number") stateVersion = st.version;
 
-      const latency = st.ts ? (Date.now() - st.ts) / 1000 : 0;
+      const latency = latencySince(st);
       const target = (typeof st.time === "number") ? (st.time + latency) : null;
 
       if (st.hls_url) {
@@ -936,6 +1044,7 @@ document.addEventListener("DOMContentLoaded", () => {
     }
 
     if (msg.type === "playlist_change") {
+      if (!_acceptVersion(msg)) return;
       const it = msg.item || {};
       const echoId = it.video_id || it.hls_url;
       if (pendingPlaylistItemId && pendingPlaylistItemId === echoId) {
@@ -964,8 +1073,9 @@ document.addEventListener("DOMContentLoaded", () => {
 
     if (["play", "pause", "seek", "keyframe"].includes(msg.type)) {
       if (waitingForInitialState) return;
+      if (!_acceptVersion(msg)) return;
 
-      const latency = msg.ts ? (Date.now() - msg.ts) / 1000 : 0;
+      const latency = latencySince(msg);
       const target = (typeof msg.time === "number") ? (msg.time + latency) : null;
 
       switch (msg.type) {
@@ -987,6 +1097,10 @@ document.addEventListener("DOMContentLoaded", () => {
           if (target !== null && Math.abs(player.currentTime - target) > 0.5) {
             suppressEvent = true;
             setTimeout(() => { suppressEvent = false; }, 400);
+            // Prefetch hint: start loading the segment every peer will need
+            if (msg.prefetch && hls && typeof msg.prefetch.start === "number") {
+              hls.startLoad(msg.prefetch.start);
+            }
             player.currentTime = target;
           }
           break;
@@ -1004,6 +1118,13 @@ document.addEventListener("DOMContentLoaded", () => {
       return;
     }
 
+    if (msg.type === "leader") {
+      isTimeSource = Boolean(msg.is_leader);
+      _hostAlive = true;
+      _resetKeyframeTimeout();
+      return;
+    }
+
     if (msg.type === "effect") {
       if (effectsManager) effectsManager.handleEffect(msg);
       return;
@@ -5,12 +5,20 @@
     // Конфигурация
     const CONFIG = {
         chunkSize: 1024 * 1024 * 5, // 5MB chunks для быстрой загрузки
+        parallelChunks: 4, // Сколько чанков отправлять одновременно
         maxRetries: 3,
         retryDelay: 1000,
         maxFileSize: 1024 * 1024 * 1024 * 5, // 5GB
         allowedExtensions: ['mp4', 'mkv', 'avi', 'mov', 'wmv', 'flv', 'webm', 'm4v', 'mpg', 'mpeg', '3gp', 'ogv'],
         uploadUrl: '/upload/my/chunked/start/',
         completeUrl: '/upload/my/chunked/complete/',
+        batchCompleteUrl: '/upload/my/chunked/complete-batch/',
+        resumeUrl: '/upload/my/chunked/resume/',
+        directStartUrl: '/upload/my/direct/start/',
+        directCompleteUrl: '/upload/my/direct/complete/',
+        // Прямая загрузка в nginx по тикету (включается на сервере)
+        directUpload: document.querySelector('[data-direct-upload]')?.dataset.directUpload === 'true',
+        fingerprintBytes: 1024 * 1024, // Хеш начала файла для возобновления
     };
 
     // Состояние
@@ -62,41 +70,9 @@
             return div.innerHTML;
         },
 
-        async calculateMD5(file, onProgress) {
-            return new Promise((resolve, reject) => {
-                const chunkSize = 1024 * 1024 * 5; // 5MB для быстрого MD5
-                const chunks = Math.ceil(file.size / chunkSize);
-                const spark = new SparkMD5.ArrayBuffer();
-                const fileReader = new FileReader();
-                let currentChunk = 0;
-
-                fileReader.onload = (e) => {
-                    spark.append(e.target.result);
-                    currentChunk++;
-                    
-                    if (onProgress) {
-                        onProgress(Math.round((currentChunk / chunks) * 100));
-                    }
-
-                    if (currentChunk < chunks) {
-                        loadNext();
-                    } else {
-                        resolve(spark.end());
-                    }
-                };
-
-                fileReader.onerror = () => {
-                    reject(new Error('Ошибка чтения файла'));
-                };
-
-                function loadNext() {
-                    const start = currentChunk * chunkSize;
-                    const end = Math.min(start + chunkSize, file.size);
-                    fileReader.readAsArrayBuffer(file.slice(start, end));
-                }
-
-                loadNext();
-            });
+        async calculateFingerprint(file) {
+            const head = file.slice(0, Math.min(file.size, CONFIG.fingerprintBytes));
+            return SparkMD5.ArrayBuffer.hash(await head.arrayBuffer());
         }
     };
 
@@ -145,15 +121,19 @@
             }
         },
 
-        async updateOrder(playlistId, items) {
+        async updateOrder(playlistId, items, move = null) {
             try {
+                // move — перемещение одного элемента: { item, before } или { item, after }
                 const response = await fetch('/upload/my/playlist/update-order/', {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json',
                         'X-CSRFToken': utils.getCookie('csrftoken'),
                     },
-                    body: JSON.stringify({
+                    body: JSON.stringify(move ? {
+                        playlist_id: playlistId,
+                        move: move,
+                    } : {
                         playlist_id: playlistId,
                         items: items,
                     }),
@@ -823,8 +803,12 @@
                 
                 this.render();
                 
-                // Сохраняем изменения на сервере
-                await this.saveExistingVideoChanges();
+                // На сервере меняется только перемещённый элемент
+                const previous = state.existingVideos[toIndex - 1];
+                const next = state.existingVideos[toIndex + 1];
+                await playlistManager.updateOrder(state.selectedPlaylistId, null, previous
+                    ? { item: movedVideo.id, after: previous.id }
+                    : { item: movedVideo.id, before: next.id });
             }
         }
     };
@@ -836,10 +820,15 @@
             this.file = fileInfo.file;
             this.metadata = metadata;
             this.uploadId = null;
+            this.fingerprint = '';
+            this.receivedRanges = []; // Уже полученные сервером диапазоны (при возобновлении)
+            this.chunkChecksums = []; // MD5 каждого чанка по индексу
+            this.ticket = null; // Тикет прямой загрузки в nginx
+            this.deferComplete = false; // Завершение общим запросом пакета
             this.offset = 0;
-            this.chunks = Math.ceil(this.file.size / CONFIG.chunkSize);
+            this.chunkSize = CONFIG.chunkSize; // При прямой загрузке размер частей задаёт тикет
+            this.chunks = Math.max(1, Math.ceil(this.file.size / this.chunkSize));
             this.currentChunk = 0;
-            this.retries = 0;
         }
 
         async start() {
@@ -847,68 +836,186 @@
                 this.startTime = Date.now(); // Запоминаем время начала
                 this.updateStatus('Подготовка...');
                 
+                // Ищем незавершённую загрузку этого файла (например, после закрытия вкладки)
+                this.fingerprint = await utils.calculateFingerprint(this.file);
+                await this.findResumable();
+                if (CONFIG.directUpload) {
+                    await this.requestTicket();
+                }
+
                 // Начинаем загрузку (БЕЗ MD5 сначала, как в админке)
-                this.updateStatus('Загрузка...');
+                this.updateStatus(this.uploadId ? 'Возобновление загрузки...' : 'Загрузка...');
                 await this.uploadChunks();
                 
-                // ПОСЛЕ загрузки вычисляем MD5
+                // Контрольная сумма собирается из сумм чанков, файл повторно не читается
+                // (при прямой загрузке её сверяет сборка файла из частей)
                 this.updateStatus('Вычисление контрольной суммы...');
-                const md5 = await utils.calculateMD5(this.file, (progress) => {
-                    const md5Progress = 90 + (progress * 0.08); // 90-98%
-                    this.updateProgress(md5Progress);
-                });
-                
+                const checksum = await this.calculateChecksum();
+
                 // Завершаем
                 this.updateStatus('Обработка...');
                 this.updateProgress(98);
-                const result = await this.complete(md5);
-                
-                this.updateStatus('Готово!');
-                this.updateProgress(100); // Показываем 100%
-                this.fileInfo.status = 'success';
-                this.fileInfo.result = result;
-                this.updateFileCard('success');
-                
+                if (this.deferComplete) {
+                    // Видео создаст общий запрос пакета, см. uploadManager.completeBatch
+                    this.updateStatus('Ожидание остальных файлов...');
+                    return { upload_id: this.uploadId, checksum };
+                }
+                const result = await this.complete(checksum);
+                this.finish(result);
                 return result;
 
             } catch (error) {
-                console.error('Upload error:', error);
-                this.fileInfo.status = 'error';
-                this.fileInfo.error = error.message;
-                this.updateStatus('Ошибка: ' + error.message);
-                this.updateFileCard('error');
+                this.fail(error);
                 throw error;
             }
         }
 
+        finish(result) {
+            this.updateStatus('Готово!');
+            this.updateProgress(100); // Показываем 100%
+            this.fileInfo.status = 'success';
+            this.fileInfo.result = result;
+            this.updateFileCard('success');
+        }
+
+        fail(error) {
+            console.error('Upload error:', error);
+            this.fileInfo.status = 'error';
+            this.fileInfo.error = error.message;
+            this.updateStatus('Ошибка: ' + error.message);
+            this.updateFileCard('error');
+        }
+
+        async findResumable() {
+            const params = new URLSearchParams({
+                filename: this.file.name,
+                size: this.file.size,
+                fingerprint: this.fingerprint,
+            });
+            try {
+                const response = await fetch(`${CONFIG.resumeUrl}?${params}`);
+                if (!response.ok) {
+                    return;
+                }
+                const data = await response.json();
+                this.uploadId = data.upload_id;
+                this.receivedRanges = data.ranges;
+            } catch (error) {
+                console.log('[WARN] Resume lookup failed', error);
+            }
+        }
+
+        async requestTicket() {
+            // Тикет прямой загрузки; для существующей загрузки — продление
+            const formData = new FormData();
+            formData.append('filename', this.file.name);
+            formData.append('size', this.file.size);
+            formData.append('fingerprint', this.fingerprint);
+            if (this.uploadId) {
+                formData.append('upload_id', this.uploadId);
+            }
+
+            const response = await fetch(CONFIG.directStartUrl, {
+                method: 'POST',
+                headers: {
+                    'X-CSRFToken': utils.getCSRFToken(),
+                },
+                body: formData,
+            });
+            if (!response.ok) {
+                throw new Error(`Ошибка получения тикета (${response.status})`);
+            }
+
+            const data = await response.json();
+            this.uploadId = data.upload_id;
+            this.receivedRanges = data.ranges;
+            this.ticket = data;
+            // Подпись есть только у частей своего разбиения файла
+            this.chunkSize = data.part_size;
+            this.chunks = data.signatures.length;
+        }
+
+        async uploadDirectChunk(chunk, start, end) {
+            const params = new URLSearchParams({
+                signature: this.ticket.signatures[start / this.chunkSize],
+                expires: this.ticket.expires,
+            });
+            const response = await fetch(`${this.ticket.url}${start}-${end}?${params}`, {
+                method: 'PUT',
+                body: chunk,
+            });
+
+            if (response.status === 403 || response.status === 410) {
+                // Тикет истёк — продлеваем, чанк уйдёт при повторе
+                await this.requestTicket();
+            }
+            if (!response.ok) {
+                throw new Error(`Ошибка загрузки (${response.status}): ${response.statusText}`);
+            }
+            return null;
+        }
+
+        isChunkReceived(index) {
+            const start = index * this.chunkSize;
+            const end = Math.min(start + this.chunkSize, this.file.size);
+            return this.receivedRanges.some(([s, e]) => s <= start && end <= e);
+        }
+
         async uploadChunks() {
-            while (this.offset < this.file.size) {
+            const pending = [];
+            for (let i = 0; i < this.chunks; i++) {
+                if (this.isChunkReceived(i)) {
+                    this.offset += Math.min(this.chunkSize, this.file.size - i * this.chunkSize);
+                } else {
+                    pending.push(i);
+                }
+            }
+
+            // Первый чанк новой загрузки отправляем отдельно: он создаёт её на сервере
+            if (!this.uploadId && pending.length) {
+                await this.uploadChunkWithRetry(pending.shift());
+            }
+
+            // Остальные — параллельно, сервер пишет их по смещениям
+            const worker = async () => {
+                while (pending.length) {
+                    await this.uploadChunkWithRetry(pending.shift());
+                }
+            };
+            const workers = [];
+            for (let i = 0; i < Math.min(CONFIG.parallelChunks, pending.length); i++) {
+                workers.push(worker());
+            }
+            await Promise.all(workers);
+        }
+
+        async uploadChunkWithRetry(index) {
+            const start = index * this.chunkSize;
+            const end = Math.min(start + this.chunkSize, this.file.size);
+            let retries = 0;
+
+            while (true) {
                 try {
-                    const end = Math.min(this.offset + CONFIG.chunkSize, this.file.size);
-                    const chunk = this.file.slice(this.offset, end);
-                    const isFirst = this.offset === 0;
-                    
-                    const data = await this.uploadChunk(chunk, isFirst, this.offset, end, this.file.size);
-                    
+                    const chunk = this.file.slice(start, end);
+                    const data = await this.uploadChunk(chunk, !this.uploadId, start, end, this.file.size);
+
                     // Получаем upload_id из первого ответа
                     if (data && data.upload_id) {
                         this.uploadId = data.upload_id;
                     }
-                    
-                    // Обновляем offset как в админке
-                    this.offset = end;
+
+                    this.offset += end - start;
                     this.currentChunk++;
-                    
+
                     const progress = (this.offset / this.file.size) * 90; // 0-90%
                     // Плавное обновление без скачков
                     requestAnimationFrame(() => this.updateProgress(progress));
-                    
-                    this.retries = 0;
+                    return data;
                 } catch (error) {
                     // Для ошибок пытаемся повторить
-                    if (this.retries < CONFIG.maxRetries) {
-                        this.retries++;
-                        console.log('[WARN] Retry', this.retries, 'of', CONFIG.maxRetries);
+                    if (retries < CONFIG.maxRetries) {
+                        retries++;
+                        console.log('[WARN] Retry', retries, 'of', CONFIG.maxRetries, 'chunk', index);
                         await this.sleep(CONFIG.retryDelay);
                         continue;
                     }
@@ -917,13 +1024,40 @@
             }
         }
 
+        async chunkChecksum(index) {
+            if (!this.chunkChecksums[index]) {
+                const start = index * this.chunkSize;
+                const end = Math.min(start + this.chunkSize, this.file.size);
+                const buffer = await this.file.slice(start, end).arrayBuffer();
+                this.chunkChecksums[index] = SparkMD5.ArrayBuffer.hash(buffer);
+            }
+            return this.chunkChecksums[index];
+        }
+
+        async calculateChecksum() {
+            // MD5 от склеенных MD5 чанков — так же считает сервер
+            const checksums = [];
+            for (let i = 0; i < this.chunks; i++) {
+                checksums.push(await this.chunkChecksum(i));
+            }
+            return SparkMD5.hash(checksums.join(''));
+        }
+
         async uploadChunk(chunk, isFirst, start, end, total) {
+            if (this.ticket) {
+                return this.uploadDirectChunk(chunk, start, end);
+            }
+
             const formData = new FormData();
             formData.append('file', chunk, this.file.name); // Используем реальное имя файла
+            formData.append('algorithm', 'md5');
+            formData.append('chunk_checksum', await this.chunkChecksum(start / this.chunkSize));
             
             // Добавляем upload_id только если это НЕ первый чанк
             if (!isFirst && this.uploadId) {
                 formData.append('upload_id', this.uploadId);
+            } else {
+                formData.append('fingerprint', this.fingerprint);
             }
 
             // Content-Range как в админке
@@ -953,10 +1087,12 @@
             return data;
         }
 
-        async complete(md5) {
+        async complete(checksum) {
             const formData = new FormData();
             formData.append('upload_id', this.uploadId);
-            formData.append('md5', md5);
+            if (checksum) {
+                formData.append('checksum', checksum);
+            }
             
             // Добавляем метаданные
             Object.entries(this.metadata).forEach(([key, value]) => {
@@ -970,7 +1106,7 @@
                 }
             });
 
-            const response = await fetch(CONFIG.completeUrl, {
+            const response = await fetch(this.ticket ? CONFIG.directCompleteUrl : CONFIG.completeUrl, {
                 method: 'POST',
                 headers: {
                     'X-CSRFToken': utils.getCSRFToken(),
@@ -1106,6 +1242,9 @@
 
             const results = [];
             let createdPlaylistId = null; // Для хранения ID созданного плейлиста
+            // Файлы плейлиста завершаются одним запросом после загрузки всех чанков
+            const batch = state.uploadMode === 'playlist' && !CONFIG.directUpload && state.files.length > 1;
+            const pending = [];
 
             for (const fileInfo of state.files) {
                 try {
@@ -1139,9 +1278,14 @@
                     }
 
                     const upload = new ChunkedUpload(fileInfo, fileMetadata);
+                    upload.deferComplete = batch;
                     state.uploads.set(fileInfo.id, upload);
                     
                     const result = await upload.start();
+                    if (batch) {
+                        pending.push({ upload, fileInfo, fileMetadata, result });
+                        continue;
+                    }
                     
                     // Сохраняем ID созданного плейлиста для последующих видео
                     if (state.uploadMode === 'playlist' && result.playlist && result.playlist.id && !createdPlaylistId) {
@@ -1155,9 +1299,68 @@
                 }
             }
 
+            if (pending.length) {
+                results.push(...await this.completeBatch(metadata, pending));
+            }
+
             this.showResults(results);
         },
 
+        async completeBatch(metadata, pending) {
+            const formData = new FormData();
+            const manifest = { uploads: [] };
+            if (metadata.playlist_id) {
+                manifest.playlist_id = metadata.playlist_id;
+            } else {
+                manifest.playlist_title = metadata.playlist_title;
+                manifest.playlist_description = metadata.playlist_description;
+                if (metadata.playlist_cover) {
+                    formData.append('playlist_cover', metadata.playlist_cover);
+                }
+            }
+
+            pending.forEach(({ fileMetadata, result }) => {
+                manifest.uploads.push({
+                    upload_id: result.upload_id,
+                    checksum: result.checksum,
+                    title: fileMetadata.title,
+                    description: fileMetadata.description,
+                    season_number: fileMetadata.season_number,
+                    episode_number: fileMetadata.episode_number,
+                    order: fileMetadata.order,
+                });
+                if (fileMetadata.thumbnail) {
+                    formData.append(`thumbnail_${result.upload_id}`, fileMetadata.thumbnail);
+                }
+            });
+            formData.append('manifest', JSON.stringify(manifest));
+
+            try {
+                const response = await fetch(CONFIG.batchCompleteUrl, {
+                    method: 'POST',
+                    headers: {
+                        'X-CSRFToken': utils.getCSRFToken(),
+                    },
+                    body: formData,
+                });
+                const data = await response.json();
+                if (!response.ok) {
+                    throw new Error(data.detail || `Ошибка завершения (${response.status})`);
+                }
+
+                return pending.map(({ upload, fileInfo }, index) => {
+                    const result = { ...data.videos[index], playlist: data.playlist };
+                    upload.finish(result);
+                    return { success: true, file: fileInfo, result };
+                });
+            } catch (error) {
+                return pending.map(({ upload, fileInfo }) => {
+                    upload.fail(error);
+                    return { success: false, file: fileInfo, error: error.message };
+                });
+            }
+        },
+
         getMetadata() {
             const metadata = {};
 
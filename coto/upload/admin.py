@@ -1,12 +1,28 @@
+from datetime import timedelta
+
 from django import forms
-from django.contrib import admin
+from django.conf import settings
+from django.contrib import admin, messages
 from django.core.exceptions import ValidationError
-from django.http import JsonResponse
+from django.db.models import F
+from django.http import HttpResponse, JsonResponse
+from django.template.defaultfilters import filesizeformat
 from django.urls import path
+from django.utils import timezone
 from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _
 
-from upload.models import Playlist, PlaylistItem, Video
+from upload.hls_jobs import filter_hls_backlog, get_hls_backlog
+from upload.metrics import render_upload_metrics
+from upload.models import (
+    Playlist,
+    PlaylistItem,
+    ReprocessBatch,
+    UploadQuota,
+    UserChunkedUpload,
+    UserStorage,
+    Video,
+)
 from upload.widgets import ChunkedAdminFileWidget
 
 __all__ = ["VideoAdmin"]
@@ -93,6 +109,58 @@ class VideoAdminForm(forms.ModelForm):
         return super().clean()
 
 
+class HLSBacklogFilter(admin.SimpleListFilter):
+    title = _("очередь HLS")
+    parameter_name = "hls_backlog"
+
+    def lookups(self, request, model_admin):
+        return (
+            ("queued", _("В очереди")),
+            ("running", _("В работе")),
+            ("stale", _("Зависшие")),
+            ("error", _("Ошибки")),
+        )
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+
+        return filter_hls_backlog(queryset, self.value())
+
+
+class SlowUploadsFilter(admin.SimpleListFilter):
+    """
+    Самые медленные недавние загрузки по частям. Прямые загрузки и
+    загрузки без полученных чанков скорости не имеют и не показываются.
+    """
+
+    title = _("медленные загрузки")
+    parameter_name = "slowest"
+    windows = {
+        "hour": timedelta(hours=1),
+        "day": timedelta(days=1),
+        "week": timedelta(weeks=1),
+    }
+
+    def lookups(self, request, model_admin):
+        return (
+            ("hour", _("За час")),
+            ("day", _("За сутки")),
+            ("week", _("За неделю")),
+        )
+
+    def queryset(self, request, queryset):
+        if self.value() not in self.windows:
+            return queryset
+
+        return queryset.filter(
+            updated_on__gte=timezone.now() - self.windows[self.value()],
+            direct=False,
+            chunk_count__gt=0,
+            throughput__gt=0,
+        )
+
+
 @admin.register(Video)
 class VideoAdmin(admin.ModelAdmin):
     form = VideoAdminForm
@@ -103,9 +171,18 @@ class VideoAdmin(admin.ModelAdmin):
         "created_at",
         "get_human_duration",
         "get_hls_progress",
+        "hls_heartbeat",
+        "hls_attempts",
+    )
+    list_filter = (
+        HLSBacklogFilter,
+        "hls_status",
+        "video_codec",
+        "uploaded_by",
+        "created_at",
     )
-    list_filter = ("uploaded_by", "created_at")
     search_fields = ("title", "description", "uploaded_by__username")
+    actions = ["reprocess_selected"]
     readonly_fields = (
         "get_thumbnail",
         "get_human_duration",
@@ -113,6 +190,12 @@ class VideoAdmin(admin.ModelAdmin):
         "get_hls_status_field",
         "get_human_filesize_field",
         "chunk_file_name_filed",
+        "hls_heartbeat",
+        "hls_attempts",
+        "video_codec",
+        "reprocess_batch",
+        "reprocess_status",
+        "get_storage_field",
     )
     fieldsets = (
         (
@@ -139,6 +222,12 @@ class VideoAdmin(admin.ModelAdmin):
                     "created_at",
                     "get_hls_progress_field",
                     "get_hls_status_field",
+                    "hls_heartbeat",
+                    "hls_attempts",
+                    "video_codec",
+                    "reprocess_batch",
+                    "reprocess_status",
+                    "get_storage_field",
                 ),
             },
         ),
@@ -150,6 +239,34 @@ class VideoAdmin(admin.ModelAdmin):
             "all": ("admin/css/hls_progress.css",),
         }
 
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        extra_context["hls_backlog"] = get_hls_backlog()
+        return super().changelist_view(request, extra_context=extra_context)
+
+    @admin.action(description=_("Переобработать HLS (пакетом)"))
+    def reprocess_selected(self, request, queryset):
+        ids = list(queryset.order_by("pk").values_list("pk", flat=True))
+        batch = ReprocessBatch.objects.create(
+            created_by=request.user,
+            filters={"ids": ids},
+            rate_per_minute=settings.HLS_REPROCESS_RATE,
+            total=len(ids),
+        )
+        self.message_user(
+            request,
+            _(
+                "Создан пакет переобработки %(batch)s: %(total)d видео, "
+                "%(rate)d в минуту",
+            )
+            % {
+                "batch": batch,
+                "total": batch.total,
+                "rate": batch.rate_per_minute,
+            },
+            messages.SUCCESS,
+        )
+
     def get_hls_progress(self, obj):
         # мини-полоска в списке
         return format_html(
@@ -246,6 +363,27 @@ class VideoAdmin(admin.ModelAdmin):
 
     get_human_filesize_field.short_description = "Размер файла"
 
+    def get_storage_field(self, obj):
+        if not obj.pk:
+            return "—"
+
+        renditions = ", ".join(
+            f"{name}: {filesizeformat(size)}"
+            for name, size in (obj.hls_renditions or {}).items()
+        )
+        return format_html(
+            "Всего: {}<br>Исходник: {}<br>HLS: {} ({} сегм.; {})"
+            "<br>Превью: {}",
+            filesizeformat(obj.storage_bytes),
+            filesizeformat(obj.source_bytes),
+            filesizeformat(obj.hls_bytes),
+            obj.hls_segment_count,
+            renditions or "—",
+            filesizeformat(obj.thumbnail_bytes),
+        )
+
+    get_storage_field.short_description = _("Место на диске")
+
     # добавим view для ajax polling
     def get_urls(self):
         urls = super().get_urls()
@@ -369,3 +507,229 @@ class PlaylistItemAdmin(admin.ModelAdmin):
     )
     ordering = ("playlist", "season_number", "episode_number", "order")
     autocomplete_fields = ["playlist", "video"]
+
+
+@admin.register(ReprocessBatch)
+class ReprocessBatchAdmin(admin.ModelAdmin):
+    list_display = (
+        "__str__",
+        "created_by",
+        "created_at",
+        "rate_per_minute",
+        "total",
+        "enqueued",
+        "get_progress_display",
+    )
+    list_filter = ("status", "created_at")
+    readonly_fields = (
+        "created_by",
+        "created_at",
+        "filters",
+        "total",
+        "enqueued",
+        "last_video_id",
+        "get_progress_display",
+    )
+    fields = (
+        "status",
+        "rate_per_minute",
+        "created_by",
+        "created_at",
+        "filters",
+        "total",
+        "enqueued",
+        "last_video_id",
+        "get_progress_display",
+    )
+    actions = ["pause_batches", "resume_batches", "cancel_batches"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_progress_display(self, obj):
+        progress = obj.get_progress()
+        return format_html(
+            '<div class="hls-mini-bar">'
+            '  <div class="hls-mini-fill" style="width: {}%;">{}%</div>'
+            '  <div class="hls-mini-status">{}</div>'
+            "</div>",
+            progress["percent"],
+            progress["percent"],
+            _("готово %(done)d, ошибок %(error)d, в работе %(in_progress)d")
+            % progress,
+        )
+
+    get_progress_display.short_description = _("Прогресс")
+
+    @admin.action(description=_("Приостановить"))
+    def pause_batches(self, request, queryset):
+        queryset.filter(status=ReprocessBatch.Status.RUNNING).update(
+            status=ReprocessBatch.Status.PAUSED,
+        )
+
+    @admin.action(description=_("Возобновить"))
+    def resume_batches(self, request, queryset):
+        queryset.filter(status=ReprocessBatch.Status.PAUSED).update(
+            status=ReprocessBatch.Status.RUNNING,
+        )
+
+    @admin.action(description=_("Отменить"))
+    def cancel_batches(self, request, queryset):
+        queryset.exclude(status=ReprocessBatch.Status.FINISHED).update(
+            status=ReprocessBatch.Status.CANCELLED,
+        )
+
+    class Media:
+        css = {
+            "all": ("admin/css/hls_progress.css",),
+        }
+
+
+@admin.register(UserStorage)
+class UserStorageAdmin(admin.ModelAdmin):
+    list_display = (
+        "user",
+        "video_count",
+        "get_total",
+        "get_source",
+        "get_hls",
+        "get_thumbnails",
+        "hls_segment_count",
+        "updated_at",
+    )
+    search_fields = ("user__username", "user__email")
+    readonly_fields = (
+        "user",
+        "video_count",
+        "source_bytes",
+        "hls_bytes",
+        "thumbnail_bytes",
+        "hls_segment_count",
+        "updated_at",
+    )
+    actions = ["rebuild_totals"]
+
+    def get_queryset(self, request):
+        return (
+            super()
+            .get_queryset(request)
+            .select_related("user")
+            .annotate(
+                total=F("source_bytes")
+                + F("hls_bytes")
+                + F("thumbnail_bytes"),
+            )
+        )
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(description=_("Всего"), ordering="total")
+    def get_total(self, obj):
+        return filesizeformat(obj.total_bytes)
+
+    @admin.display(description=_("Исходники"), ordering="source_bytes")
+    def get_source(self, obj):
+        return filesizeformat(obj.source_bytes)
+
+    @admin.display(description=_("HLS"), ordering="hls_bytes")
+    def get_hls(self, obj):
+        return filesizeformat(obj.hls_bytes)
+
+    @admin.display(description=_("Превью"), ordering="thumbnail_bytes")
+    def get_thumbnails(self, obj):
+        return filesizeformat(obj.thumbnail_bytes)
+
+    @admin.action(description=_("Пересчитать по видео"))
+    def rebuild_totals(self, request, queryset):
+        for user_id in queryset.values_list("user_id", flat=True):
+            UserStorage.rebuild(user_id)
+
+
+@admin.register(UploadQuota)
+class UploadQuotaAdmin(admin.ModelAdmin):
+    list_display = (
+        "user",
+        "max_bytes",
+        "max_concurrent_uploads",
+        "max_uploads_per_day",
+        "max_transcode_minutes",
+    )
+    search_fields = ("user__username", "user__email")
+    raw_id_fields = ("user",)
+
+
+@admin.register(UserChunkedUpload)
+class UserChunkedUploadAdmin(admin.ModelAdmin):
+    """
+    Загрузки по частям, новые сверху; фильтр «медленные загрузки»
+    сортирует недавние по скорости. metrics/ отдаёт сводку за последний
+    час в формате Prometheus.
+    """
+
+    list_display = (
+        "filename",
+        "user",
+        "status",
+        "get_size",
+        "chunk_count",
+        "get_throughput",
+        "receive_seconds",
+        "write_seconds",
+        "db_seconds",
+        "slowest_chunk_seconds",
+        "get_completion",
+        "created_on",
+    )
+    list_filter = (SlowUploadsFilter, "status", "direct", "created_on")
+    search_fields = ("filename", "upload_id", "user__username")
+    date_hierarchy = "created_on"
+    ordering = ("-created_on",)
+    list_select_related = ("user",)
+    readonly_fields = [field.name for field in UserChunkedUpload._meta.fields]
+    exclude = ("received_ranges", "chunk_checksums")
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_ordering(self, request):
+        if request.GET.get(SlowUploadsFilter.parameter_name):
+            return ("throughput",)
+
+        return super().get_ordering(request)
+
+    def get_urls(self):
+        return [
+            path(
+                "metrics/",
+                self.admin_site.admin_view(self.metrics_view),
+                name="upload_userchunkedupload_metrics",
+            ),
+            *super().get_urls(),
+        ]
+
+    def metrics_view(self, request):
+        return HttpResponse(
+            render_upload_metrics(),
+            content_type="text/plain; version=0.0.4",
+        )
+
+    def get_size(self, obj):
+        return filesizeformat(obj.total_size)
+
+    get_size.short_description = _("Размер")
+    get_size.admin_order_field = "total_size"
+
+    def get_throughput(self, obj):
+        return f"{filesizeformat(obj.throughput)}/s"
+
+    get_throughput.short_description = _("Скорость")
+    get_throughput.admin_order_field = "throughput"
+
+    def get_completion(self, obj):
+        return ", ".join(
+            f"{phase} {seconds:.2f}"
+            for phase, seconds in obj.completion_timings.items()
+        )
+
+    get_completion.short_description = _("Завершение, с")
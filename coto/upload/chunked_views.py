@@ -5,6 +5,7 @@ from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import ensure_csrf_cookie
 
+from upload.files import finalize_chunked_upload
 from upload.models import Video
 
 __all__ = [
@@ -57,9 +58,12 @@ class AdminChunkedUploadCompleteView(
             description=(
                 req.POST.get("description", "") if req is not None else ""
             ),
-            file=file_field,
             uploaded_by=(req.user if req is not None else None),
         )
+        if file_field:
+            video.file_size = chunked_upload.offset
+            finalize_chunked_upload(chunked_upload, video)
+
         video.save()
 
         return {
@@ -0,0 +1,235 @@
+from collections import defaultdict
+import logging
+from pathlib import Path
+import shutil
+
+from chunked_upload.constants import UPLOADING
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from upload.direct import direct_upload_dir, TEMP_DIR
+from upload.quotas import release_upload
+
+__all__ = [
+    "cleanup_stale_chunked_uploads",
+]
+
+logger = logging.getLogger(__name__)
+
+GC_BATCH_SIZE = 500
+
+
+def _chunked_upload_models():
+    from chunked_upload.models import ChunkedUpload
+    from upload.models import UserChunkedUpload
+
+    # админская загрузка идёт через модель пакета по умолчанию
+    return (ChunkedUpload, UserChunkedUpload)
+
+
+def _activity_field(model):
+    """Поле с временем последней активности загрузки."""
+    field_names = {field.name for field in model._meta.get_fields()}
+    return "updated_on" if "updated_on" in field_names else "created_on"
+
+
+def _upload_paths(upload):
+    paths = []
+    if upload.file and upload.file.name:
+        paths.append(Path(upload.file.path))
+
+    if getattr(upload, "direct", False):
+        paths.append(direct_upload_dir(upload.upload_id))
+
+    return paths
+
+
+def _walk(path):
+    """Сам путь и, для каталога, всё его содержимое."""
+    yield path
+    if path.is_dir():
+        yield from path.rglob("*")
+
+
+def _stat_path(path):
+    """(байт, время последнего изменения) файла или каталога целиком."""
+    size = mtime = 0
+    for item in _walk(path):
+        try:
+            stat = item.stat()
+        except FileNotFoundError:
+            continue
+
+        mtime = max(mtime, stat.st_mtime)
+        if item.is_file():
+            size += stat.st_size
+
+    return size, mtime
+
+
+def _remove_paths(paths):
+    for path in paths:
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+
+
+def _release_slots(released):
+    for user_id, (count, size) in released.items():
+        release_upload(user_id, size, count)
+
+
+def _expire_batch(model, pks, deadline, dry_run):
+    """
+    Удаляет порцию устаревших загрузок одним запросом.
+
+    Строки блокируются (занятые пропускаются — их держит mark_received
+    активного запроса), а загрузка, файлы которой менялись позже
+    deadline, считается живой: чанк мог записаться до обновления строки.
+    """
+    field = _activity_field(model)
+    expired, paths, reclaimed = [], [], 0
+    released = defaultdict(lambda: [0, 0])
+    with transaction.atomic():
+        uploads = model.objects.select_for_update(skip_locked=True).filter(
+            pk__in=pks,
+            status=UPLOADING,
+            **{f"{field}__lt": deadline},
+        )
+        for upload in uploads:
+            upload_paths = _upload_paths(upload)
+            stats = [_stat_path(path) for path in upload_paths]
+            if any(mtime >= deadline.timestamp() for _size, mtime in stats):
+                continue
+
+            expired.append(upload.pk)
+            if model is _chunked_upload_models()[1]:
+                # слот квоты занимают только пользовательские загрузки
+                released[upload.user_id][0] += 1
+                released[upload.user_id][1] += upload.total_size
+
+            paths.extend(upload_paths)
+            reclaimed += sum(size for size, _mtime in stats)
+
+        if expired and not dry_run:
+            model.objects.filter(pk__in=expired).delete()
+            transaction.on_commit(lambda: _remove_paths(paths))
+            # счётчик в кеше не откатится вместе с транзакцией
+            transaction.on_commit(lambda: _release_slots(released))
+
+    return len(expired), reclaimed
+
+
+def _sweep_orphans(deadline, dry_run):
+    """
+    Файлы в каталогах загрузок, на которые не ссылается ни одна строка
+    (строка удалена вместе с пользователем, воркер упал посреди
+    завершения и т.п.). Трогаются только давно не менявшиеся.
+    """
+    known_files, known_dirs = set(), set()
+    for model in _chunked_upload_models():
+        for name in model.objects.exclude(file="").values_list(
+            "file",
+            flat=True,
+        ):
+            known_files.add(Path(settings.MEDIA_ROOT) / name)
+
+    from upload.models import UserChunkedUpload
+
+    for upload_id in UserChunkedUpload.objects.filter(
+        direct=True,
+    ).values_list("upload_id", flat=True):
+        known_dirs.add(direct_upload_dir(upload_id))
+
+    # постоянная часть CHUNKED_UPLOAD_PATH до шаблона даты
+    chunked_prefix = settings.CHUNKED_UPLOAD_PATH.split("%", 1)[0].strip("/")
+    chunked_root = Path(settings.MEDIA_ROOT) / chunked_prefix
+    candidates = []
+    if chunked_prefix and chunked_root.is_dir():
+        candidates.extend(
+            path
+            for path in chunked_root.rglob("*")
+            if path.is_file() and path not in known_files
+        )
+
+    direct_root = Path(settings.DIRECT_UPLOAD_ROOT)
+    if direct_root.is_dir():
+        candidates.extend(
+            path
+            for path in direct_root.iterdir()
+            if path.is_dir()
+            and path not in known_dirs
+            and path.name != TEMP_DIR
+        )
+
+    orphans, reclaimed = [], 0
+    for path in candidates:
+        size, mtime = _stat_path(path)
+        if mtime < deadline.timestamp():
+            orphans.append(path)
+            reclaimed += size
+
+    if not dry_run:
+        _remove_paths(orphans)
+        if chunked_prefix and chunked_root.is_dir():
+            _remove_empty_dirs(chunked_root, deadline)
+
+    return len(orphans), reclaimed
+
+
+def _remove_empty_dirs(root, deadline):
+    # глубокие каталоги раньше родительских; свежие не трогаем — в них
+    # вот-вот может появиться файл новой загрузки
+    for path in sorted(root.rglob("*"), reverse=True):
+        if (
+            path.is_dir()
+            and not any(path.iterdir())
+            and path.stat().st_mtime < deadline.timestamp()
+        ):
+            path.rmdir()
+
+
+def cleanup_stale_chunked_uploads(older_than=None, dry_run=False):
+    """
+    Удаляет незавершённые загрузки по частям без активности дольше
+    older_than (по умолчанию CHUNKED_UPLOAD_GC_AFTER) вместе с их файлами,
+    затем — осиротевшие файлы в каталогах загрузок.
+    Возвращает число удалённых загрузок, файлов и освобождённые байты.
+    """
+    older_than = older_than or settings.CHUNKED_UPLOAD_GC_AFTER
+    deadline = timezone.now() - older_than
+    result = {"uploads": 0, "orphans": 0, "bytes": 0}
+
+    for model in _chunked_upload_models():
+        pks = list(
+            model.objects.filter(
+                status=UPLOADING,
+                **{f"{_activity_field(model)}__lt": deadline},
+            ).values_list("pk", flat=True),
+        )
+        for i in range(0, len(pks), GC_BATCH_SIZE):
+            expired, reclaimed = _expire_batch(
+                model,
+                pks[i : i + GC_BATCH_SIZE],
+                deadline,
+                dry_run,
+            )
+            result["uploads"] += expired
+            result["bytes"] += reclaimed
+
+    orphans, reclaimed = _sweep_orphans(deadline, dry_run)
+    result["orphans"] = orphans
+    result["bytes"] += reclaimed
+
+    if result["uploads"] or result["orphans"]:
+        logger.info(
+            "[Upload GC] %s загрузок: %s, файлов без загрузки: %s, байт: %s",
+            "Найдено" if dry_run else "Удалено",
+            result["uploads"],
+            result["orphans"],
+            result["bytes"],
+        )
+
+    return result
@@ -0,0 +1,201 @@
+import base64
+import hashlib
+import logging
+import os
+from pathlib import Path
+import re
+import shutil
+import time
+
+from django.conf import settings
+
+from upload.models import CHECKSUM_ALGORITHMS
+
+__all__ = [
+    "assemble_direct_upload_parts",
+    "collect_direct_upload_parts",
+    "direct_upload_checksum",
+    "direct_upload_dir",
+    "direct_upload_parts",
+    "issue_direct_upload_ticket",
+]
+
+logger = logging.getLogger(__name__)
+
+PART_NAME_RE = re.compile(r"^(?P<start>\d+)-(?P<end>\d+)$")
+COPY_BLOCK = 64 * 1024 * 1024
+TEMP_DIR = ".tmp"
+
+
+def direct_upload_dir(upload_id):
+    return Path(settings.DIRECT_UPLOAD_ROOT) / upload_id
+
+
+def direct_upload_parts(total_size):
+    """
+    Разбиение файла на части прямой загрузки: [(start, end), ...] по
+    DIRECT_UPLOAD_PART_SIZE. Тикет подписывает только эти части.
+    """
+    part_size = settings.DIRECT_UPLOAD_PART_SIZE
+    return [
+        (start, min(start + part_size, total_size))
+        for start in range(0, total_size, part_size)
+    ]
+
+
+def _make_shared_dir(path):
+    """
+    Каталог, в который пишет nginx: группа DIRECT_UPLOAD_GID (общая
+    с nginx) и права 0o2770 — setgid, чтобы файлы внутри наследовали
+    группу; остальным пользователям доступа нет.
+    """
+    path.mkdir(parents=True, exist_ok=True)
+    if settings.DIRECT_UPLOAD_GID is not None:
+        os.chown(path, -1, settings.DIRECT_UPLOAD_GID)
+
+    path.chmod(0o2770)
+
+
+def _sign(upload_id, start, end, expires):
+    """
+    Подпись части в формате модуля nginx secure_link:
+    base64url(md5("<expires><upload_id>/<start>-<end> <secret>")) без
+    паддинга.
+    """
+    raw = (
+        f"{expires}{upload_id}/{start}-{end} "
+        f"{settings.DIRECT_UPLOAD_SECRET}"
+    )
+    digest = hashlib.md5(raw.encode()).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def issue_direct_upload_ticket(chunked_upload):
+    """
+    Короткоживущий тикет на загрузку чанков напрямую в nginx.
+
+    Файл делится на части по part_size (direct_upload_parts), часть
+    отправляется PUT-запросом на <url><start>-<end>?signature=&expires=
+    (end не включается) с подписью из signatures по номеру части; nginx
+    проверяет подпись и срок и сам пишет тело в отдельный файл каталога
+    загрузки. Подпись привязана к диапазону, поэтому по тикету нельзя
+    записать ничего, кроме частей этого файла.
+    """
+    expires = int(
+        time.time() + settings.DIRECT_UPLOAD_TICKET_TTL.total_seconds(),
+    )
+    root = Path(settings.DIRECT_UPLOAD_ROOT)
+    # .tmp — client_body_temp_path nginx, тело запроса сначала пишется туда
+    for path in (
+        root,
+        root / TEMP_DIR,
+        direct_upload_dir(chunked_upload.upload_id),
+    ):
+        _make_shared_dir(path)
+
+    return {
+        "url": f"{settings.DIRECT_UPLOAD_URL}{chunked_upload.upload_id}/",
+        "part_size": settings.DIRECT_UPLOAD_PART_SIZE,
+        "signatures": [
+            _sign(chunked_upload.upload_id, start, end, expires)
+            for start, end in direct_upload_parts(chunked_upload.total_size)
+        ],
+        "expires": expires,
+    }
+
+
+def collect_direct_upload_parts(chunked_upload):
+    """
+    Чанки, записанные nginx: список (start, end, path) по возрастанию.
+    Файлы, размер которых не совпадает с диапазоном в имени (ещё пишутся
+    или оборваны), пропускаются. Части вне разбиения файла (за пределами
+    [0, total_size) или с другими границами) удаляются: собрать из них
+    файл всё равно нельзя, а место на диске они занимают.
+    """
+    upload_dir = direct_upload_dir(chunked_upload.upload_id)
+    if not upload_dir.is_dir():
+        return []
+
+    expected = set(direct_upload_parts(chunked_upload.total_size))
+    parts = []
+    for path in upload_dir.iterdir():
+        match = PART_NAME_RE.match(path.name)
+        if not match:
+            continue
+
+        start, end = int(match.group("start")), int(match.group("end"))
+        if (start, end) not in expected:
+            logger.warning(
+                "Часть %s вне разбиения загрузки %s удалена",
+                path.name,
+                chunked_upload.upload_id,
+            )
+            path.unlink(missing_ok=True)
+            continue
+
+        if path.stat().st_size == end - start:
+            parts.append((start, end, path))
+
+    return sorted(parts)
+
+
+def direct_upload_checksum(parts, algorithm):
+    """
+    Контрольная сумма файла из частей по той же схеме, что
+    UserChunkedUpload.get_checksum: хеш от склеенных hex-сумм частей
+    по порядку. Части nginx никто не хешировал, поэтому они читаются.
+    """
+    hasher = CHECKSUM_ALGORITHMS[algorithm]
+    digests = []
+    for _start, _end, path in parts:
+        with path.open("rb") as src:
+            digests.append(hashlib.file_digest(src, hasher).hexdigest())
+
+    checksum = hasher()
+    checksum.update("".join(digests).encode())
+    return checksum.hexdigest()
+
+
+def assemble_direct_upload_parts(parts, target, total_size):
+    """
+    Собирает чанки в файл target. Данные копируются внутри ядра
+    (copy_file_range, на поддерживающих ФС — без копирования блоков),
+    при недоступности — обычным потоковым копированием.
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with target.open("wb") as out:
+        out.truncate(total_size)
+        for start, end, path in parts:
+            with path.open("rb") as src:
+                try:
+                    _copy_range(src.fileno(), out.fileno(), start, end - start)
+                except (AttributeError, OSError):
+                    logger.info(
+                        "copy_file_range недоступен, копируем %s потоком",
+                        path,
+                    )
+                    src.seek(0)
+                    out.seek(start)
+                    shutil.copyfileobj(src, out, COPY_BLOCK)
+
+    if target.stat().st_size != total_size:
+        raise OSError(
+            f"размер собранного файла {target.stat().st_size}, "
+            f"ожидался {total_size}",
+        )
+
+
+def _copy_range(src_fd, dst_fd, offset, length):
+    copied = 0
+    while copied < length:
+        n = os.copy_file_range(
+            src_fd,
+            dst_fd,
+            min(COPY_BLOCK, length - copied),
+            copied,
+            offset + copied,
+        )
+        if n == 0:
+            raise OSError("copy_file_range: неожиданный конец файла")
+
+        copied += n
@@ -0,0 +1,64 @@
+import logging
+import os
+from pathlib import Path
+
+__all__ = ["finalize_chunked_upload"]
+
+logger = logging.getLogger(__name__)
+
+LINK_ATTEMPTS = 5
+
+
+def finalize_chunked_upload(chunked_upload, video):
+    """
+    Переносит собранный файл загрузки в video.file без копирования данных.
+
+    На той же ФС файл получает новое имя жёсткой ссылкой (os.link не
+    перезаписывает существующий файл, поэтому гонка за свободное имя
+    безопасна), после чего старое имя удаляется. Если хранилище не
+    локальное или каталоги на разных ФС, файл потоково копируется через
+    storage. Загрузка после этого больше не ссылается на файл, так что её
+    удаление не затронет видео.
+    """
+    source = chunked_upload.file
+    source.close()
+    field = video.file.field
+    name = field.generate_filename(video, Path(chunked_upload.filename).name)
+    try:
+        name = _link(source.path, video.file.storage, name, field.max_length)
+    except (NotImplementedError, OSError) as e:
+        logger.info(
+            "Перенос загрузки %s без копирования невозможен (%s), "
+            "копируем файл",
+            chunked_upload.upload_id,
+            e,
+        )
+        with source.open("rb"):
+            name = video.file.storage.save(
+                name,
+                source,
+                max_length=field.max_length,
+            )
+
+    # после ссылки или копии данные уже под новым именем
+    source.storage.delete(source.name)
+
+    video.file.name = name
+    chunked_upload.file.name = ""
+    chunked_upload.save(update_fields=["file"])
+    return name
+
+
+def _link(source_path, storage, name, max_length):
+    for _attempt in range(LINK_ATTEMPTS):
+        name = storage.get_available_name(name, max_length=max_length)
+        target = Path(storage.path(name))
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(source_path, target)
+        except FileExistsError:
+            continue
+
+        return name
+
+    raise FileExistsError(name)
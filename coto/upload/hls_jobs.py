@@ -0,0 +1,293 @@
+import logging
+from pathlib import Path
+import shutil
+import socket
+
+from celery import uuid
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+import psutil
+
+__all__ = [
+    "HLSJobCancelledError",
+    "cancel_hls_job",
+    "filter_hls_backlog",
+    "find_stale_hls_jobs",
+    "get_hls_backlog",
+    "hls_job_signature",
+    "is_hls_job_cancelled",
+    "requeue_stale_hls_job",
+    "start_hls_job",
+    "terminate_ffmpeg",
+]
+
+logger = logging.getLogger(__name__)
+
+CANCEL_TOKEN_TTL = 24 * 60 * 60
+
+QUEUED_HLS_STATUSES = ("awaiting processing",)
+RUNNING_HLS_STATUSES = ("pending", "copy", "transcode", "segment")
+
+
+class HLSJobCancelledError(Exception):
+    """Задача HLS отменена: видео удалено или файл заменён."""
+
+
+def _cancel_key(task_id):
+    return f"hls_cancel_{task_id}"
+
+
+def hls_job_signature(video, priority=None, force_transcode=False):
+    """
+    Подпись generate_hls с заранее известным task_id — для отправки
+    в составе группы задач.
+
+    task_id записывается в видео до отправки задачи, чтобы воркер,
+    стартовавший раньше, чем завершится save(), не посчитал себя устаревшим.
+    Пока задача в очереди, hls_heartbeat — время постановки: по нему
+    watchdog находит задачи, сообщение которых потерялось.
+    """
+    from upload.models import Video
+    from upload.tasks import generate_hls
+
+    task_id = uuid()
+    queued_at = timezone.now()
+    Video.objects.filter(pk=video.pk).update(
+        hls_task_id=task_id,
+        hls_heartbeat=queued_at,
+    )
+    video.hls_task_id = task_id
+    video.hls_heartbeat = queued_at
+    options = {"task_id": task_id}
+    if priority is not None:
+        options["priority"] = priority
+
+    kwargs = {"force_transcode": True} if force_transcode else {}
+    return generate_hls.signature((video.pk,), kwargs, **options)
+
+
+def start_hls_job(video, priority=None, force_transcode=False):
+    """Ставит generate_hls в очередь с заранее известным task_id."""
+    hls_job_signature(video, priority, force_transcode).apply_async()
+    return video.hls_task_id
+
+
+def is_hls_job_cancelled(task_id):
+    if not task_id:
+        return False
+
+    return bool(cache.get(_cancel_key(task_id)))
+
+
+def cancel_hls_job(video):
+    """
+    Отменяет текущую задачу generate_hls видео.
+
+    Выставляет токен отмены (его проверяет воркер во время работы ffmpeg),
+    отзывает задачу в Celery, если она ещё в очереди, и завершает ffmpeg
+    напрямую, когда он запущен на этом же хосте.
+    """
+    task_id = video.hls_task_id
+    if not task_id:
+        return False
+
+    cache.set(_cancel_key(task_id), True, CANCEL_TOKEN_TTL)
+    try:
+        from coto.celery import app
+
+        app.control.revoke(task_id)
+    except Exception:
+        logger.warning(
+            "[HLS Cancel] Не удалось отозвать задачу %s",
+            task_id,
+            exc_info=True,
+        )
+
+    if video.hls_pid and video.hls_worker == socket.gethostname():
+        terminate_ffmpeg(video.hls_pid)
+
+    logger.info(
+        "[HLS Cancel] Задача %s видео %s отменена",
+        task_id,
+        video.pk,
+    )
+    return True
+
+
+def terminate_ffmpeg(pid, timeout=5):
+    """Завершает процесс ffmpeg: SIGTERM, затем SIGKILL по таймауту."""
+    try:
+        proc = psutil.Process(pid)
+        if "ffmpeg" not in proc.name():
+            return False
+
+        proc.terminate()
+        try:
+            proc.wait(timeout=timeout)
+        except psutil.TimeoutExpired:
+            proc.kill()
+    except psutil.Error:
+        return False
+
+    return True
+
+
+def _status_q(statuses):
+    """Статус обработки среди statuses: первичной или переобработки."""
+    return Q(hls_status__in=statuses) | Q(reprocess_status__in=statuses)
+
+
+def _stale_filter(now=None):
+    now = now or timezone.now()
+    running_deadline = now - settings.HLS_STALE_AFTER
+    queued_deadline = now - settings.HLS_QUEUED_STALE_AFTER
+    return (
+        _status_q(RUNNING_HLS_STATUSES)
+        & (
+            Q(hls_heartbeat__lt=running_deadline)
+            | Q(hls_heartbeat__isnull=True)
+        )
+    ) | (
+        # без heartbeat — задача так и не была поставлена (видео
+        # сохранено с _skip_tasks и ждёт, например, сборки файла)
+        _status_q(QUEUED_HLS_STATUSES)
+        & (
+            Q(hls_heartbeat__lt=queued_deadline)
+            | Q(hls_heartbeat__isnull=True, created_at__lt=queued_deadline)
+        )
+    )
+
+
+def find_stale_hls_jobs():
+    """
+    Видео в статусе обработки, heartbeat которых давно не обновлялся,
+    и видео, слишком долго ждущие в очереди.
+    """
+    from upload.models import Video
+
+    return Video.objects.filter(_stale_filter()).only(
+        "pk",
+        "hls_status",
+        "reprocess_status",
+        "hls_heartbeat",
+        "hls_attempts",
+        "hls_task_id",
+        "hls_pid",
+        "hls_worker",
+        "hls_log",
+        "hls_manifest",
+        "reprocess_batch_id",
+    )
+
+
+def _job_options(video):
+    """
+    Параметры generate_hls для перезапуска: переобработка идёт с полным
+    перекодированием и пониженным приоритетом, как в ReprocessBatch.
+    """
+    if video.reprocess_status or video.reprocess_batch_id:
+        return {
+            "priority": settings.HLS_REPROCESS_PRIORITY,
+            "force_transcode": True,
+        }
+
+    return {}
+
+
+def requeue_stale_hls_job(video):
+    """
+    Перезапускает зависшую задачу или, если попытки исчерпаны,
+    помечает видео ошибкой с указанием причины.
+
+    Строка захватывается условным UPDATE по старому heartbeat'у, поэтому
+    задача, успевшая «ожить» между выборкой и обновлением, не трогается.
+    """
+    from upload.models import Video
+
+    stale_task_id = video.hls_task_id
+    status_field = video.job_status_field
+    status = getattr(video, status_field)
+    exhausted = video.hls_attempts >= settings.HLS_MAX_ATTEMPTS
+    if exhausted:
+        reason = (
+            f"[watchdog] Обработка остановилась на этапе "
+            f"'{status}', попытки исчерпаны "
+            f"({video.hls_attempts}/{settings.HLS_MAX_ATTEMPTS})"
+        )
+        new_status = "error"
+    else:
+        reason = (
+            f"[watchdog] Нет heartbeat на этапе '{status}', "
+            f"перезапуск ({video.hls_attempts + 1}/"
+            f"{settings.HLS_MAX_ATTEMPTS})"
+        )
+        new_status = "awaiting processing"
+
+    claimed = Video.objects.filter(
+        pk=video.pk,
+        hls_heartbeat=video.hls_heartbeat,
+        **{status_field: status},
+    ).update(
+        **{status_field: new_status},
+        hls_attempts=video.hls_attempts + (0 if exhausted else 1),
+        hls_log=(video.hls_log + "\n" + reason)[-8000:],
+        hls_pid=None,
+    )
+    if not claimed:
+        return None
+
+    logger.warning("[HLS Watchdog] Видео %s: %s", video.pk, reason)
+    cancel_hls_job(video)
+    _discard_job_output(video, stale_task_id)
+    if exhausted:
+        return "failed"
+
+    start_hls_job(video, **_job_options(video))
+    return "requeued"
+
+
+def _discard_job_output(video, task_id):
+    """Удаляет частичный вывод задачи, если он не используется манифестом."""
+    if not task_id:
+        return
+
+    job_dir = Path(settings.MEDIA_ROOT) / "streams" / str(video.pk) / task_id
+    manifest = video.hls_manifest.name if video.hls_manifest else ""
+    if f"/{task_id}/" in f"/{manifest}":
+        return
+
+    shutil.rmtree(job_dir, ignore_errors=True)
+
+
+def _backlog_filters(now=None):
+    now = now or timezone.now()
+    return {
+        "queued": _status_q(QUEUED_HLS_STATUSES) & ~_stale_filter(now),
+        "running": _status_q(RUNNING_HLS_STATUSES)
+        & Q(hls_heartbeat__gte=now - settings.HLS_STALE_AFTER),
+        "stale": _stale_filter(now),
+        "error": _status_q(["error"]),
+    }
+
+
+def filter_hls_backlog(queryset, bucket):
+    """Фильтрует видео по группе очереди HLS (queued/running/stale/error)."""
+    q = _backlog_filters().get(bucket)
+    if q is None:
+        return queryset
+
+    return queryset.filter(q)
+
+
+def get_hls_backlog():
+    """Сводка очереди HLS для админки одним агрегирующим запросом."""
+    from upload.models import Video
+
+    return Video.objects.aggregate(
+        **{
+            bucket: Count("pk", filter=q)
+            for bucket, q in _backlog_filters().items()
+        },
+    )
@@ -0,0 +1,44 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from upload.cleanup import cleanup_stale_chunked_uploads
+
+__all__ = ()
+
+
+class Command(BaseCommand):
+    help = (  # noqa: A003
+        "Удаляет незавершённые загрузки по частям без активности и "
+        "осиротевшие файлы в каталогах загрузок."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than",
+            type=float,
+            default=settings.CHUNKED_UPLOAD_GC_AFTER.total_seconds() / 3600,
+            help="Возраст последней активности в часах "
+            "(по умолчанию CHUNKED_UPLOAD_GC_AFTER)",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Только показать, что будет удалено",
+        )
+
+    def handle(self, *args, **options):
+        result = cleanup_stale_chunked_uploads(
+            older_than=timedelta(hours=options["older_than"]),
+            dry_run=options["dry_run"],
+        )
+        verb = "Будет удалено" if options["dry_run"] else "Удалено"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{verb} загрузок: {result['uploads']}, "
+                f"файлов без загрузки: {result['orphans']}, "
+                f"освобождено: {filesizeformat(result['bytes'])}",
+            ),
+        )
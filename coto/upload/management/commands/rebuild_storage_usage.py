@@ -0,0 +1,59 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+from upload.models import UserStorage, Video
+from upload.tasks import measure_hls_output
+
+__all__ = ()
+
+
+class Command(BaseCommand):
+    help = (  # noqa: A003
+        "Пересчитывает учёт места: по умолчанию итоги пользователей по "
+        "полям видео, с --scan дополнительно измеряет файлы на диске."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scan",
+            action="store_true",
+            help="Измерить исходники, вывод HLS и превью на диске",
+        )
+
+    def handle(self, *args, **options):
+        if options["scan"]:
+            scanned = 0
+            for video in Video.objects.iterator():
+                self._scan_video(video)
+                scanned += 1
+
+            self.stdout.write(f"Измерено видео: {scanned}")
+
+        user_ids = set(
+            Video.objects.values_list("uploaded_by_id", flat=True),
+        ) | set(UserStorage.objects.values_list("user_id", flat=True))
+        for user_id in user_ids:
+            UserStorage.rebuild(user_id)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Пересчитаны итоги: {len(user_ids)}"),
+        )
+
+    def _scan_video(self, video):
+        values = {
+            "source_bytes": Video.stored_size(video.file),
+            "thumbnail_bytes": Video.stored_size(video.thumbnail),
+            "hls_bytes": 0,
+            "hls_segment_count": 0,
+        }
+        renditions = {}
+        if video.hls_manifest:
+            out_dir = Path(video.hls_manifest.path).parent
+            if out_dir.is_dir():
+                renditions, total, segment_count = measure_hls_output(out_dir)
+                values["hls_bytes"] = total
+                values["hls_segment_count"] = segment_count
+
+        Video.objects.filter(pk=video.pk).update(hls_renditions=renditions)
+        video.update_storage(**values)
@@ -0,0 +1,138 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from upload.models import ReprocessBatch
+
+__all__ = ()
+
+
+class Command(BaseCommand):
+    help = (  # noqa: A003
+        "Пакетная переобработка HLS: создание пакета по фильтрам, "
+        "пауза, возобновление и просмотр прогресса."
+    )
+
+    def add_arguments(self, parser):
+        actions = parser.add_mutually_exclusive_group()
+        actions.add_argument("--pause", type=int, metavar="BATCH_ID")
+        actions.add_argument("--resume", type=int, metavar="BATCH_ID")
+        actions.add_argument("--cancel", type=int, metavar="BATCH_ID")
+        actions.add_argument(
+            "--progress",
+            type=int,
+            nargs="?",
+            const=0,
+            metavar="BATCH_ID",
+            help="Прогресс пакета (без ID — всех незавершённых)",
+        )
+
+        parser.add_argument(
+            "--status",
+            action="append",
+            dest="statuses",
+            help="Статус HLS (можно указать несколько раз)",
+        )
+        parser.add_argument(
+            "--created-from",
+            help="Дата загрузки от (ГГГГ-ММ-ДД)",
+        )
+        parser.add_argument(
+            "--created-to",
+            help="Дата загрузки до (ГГГГ-ММ-ДД)",
+        )
+        parser.add_argument(
+            "--codec",
+            action="append",
+            dest="codecs",
+            help="Видеокодек исходника (можно указать несколько раз)",
+        )
+        parser.add_argument("--min-size-mb", type=int)
+        parser.add_argument("--max-size-mb", type=int)
+        parser.add_argument(
+            "--rate",
+            type=int,
+            default=settings.HLS_REPROCESS_RATE,
+            help="Сколько видео ставить в очередь в минуту",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Только показать, сколько видео попадёт в пакет",
+        )
+
+    def handle(self, *args, **options):
+        for action, status in (
+            ("pause", ReprocessBatch.Status.PAUSED),
+            ("resume", ReprocessBatch.Status.RUNNING),
+            ("cancel", ReprocessBatch.Status.CANCELLED),
+        ):
+            if options[action]:
+                batch = self._get_batch(options[action])
+                batch.status = status
+                batch.save(update_fields=["status"])
+                self.stdout.write(self.style.SUCCESS(f"Пакет {batch}"))
+                return
+
+        if options["progress"] is not None:
+            self._print_progress(options["progress"])
+            return
+
+        self._create_batch(options)
+
+    def _get_batch(self, batch_id):
+        try:
+            return ReprocessBatch.objects.get(pk=batch_id)
+        except ReprocessBatch.DoesNotExist:
+            raise CommandError(f"Пакет {batch_id} не найден")
+
+    def _print_progress(self, batch_id):
+        if batch_id:
+            batches = [self._get_batch(batch_id)]
+        else:
+            batches = ReprocessBatch.objects.exclude(
+                status=ReprocessBatch.Status.CANCELLED,
+            )
+
+        for batch in batches:
+            p = batch.get_progress()
+            self.stdout.write(
+                f"{batch}: в очереди {batch.enqueued}/{batch.total}, "
+                f"готово {p['done']} ({p['percent']}%), "
+                f"ошибок {p['error']}, в работе {p['in_progress']}",
+            )
+
+    def _create_batch(self, options):
+        mb = 1024 * 1024
+        filters = {
+            "statuses": options["statuses"] or [],
+            "created_from": options["created_from"],
+            "created_to": options["created_to"],
+            "codecs": options["codecs"] or [],
+            "min_size": (
+                options["min_size_mb"] * mb
+                if options["min_size_mb"] is not None
+                else None
+            ),
+            "max_size": (
+                options["max_size_mb"] * mb
+                if options["max_size_mb"] is not None
+                else None
+            ),
+        }
+        batch = ReprocessBatch(
+            filters=filters,
+            rate_per_minute=max(1, options["rate"]),
+        )
+        total = batch.get_queryset().count()
+        if options["dry_run"]:
+            self.stdout.write(f"Под фильтры попадает видео: {total}")
+            return
+
+        batch.total = total
+        batch.save()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Создан пакет {batch}: {total} видео, "
+                f"{batch.rate_per_minute} в минуту",
+            ),
+        )
@@ -0,0 +1,99 @@
+from contextlib import contextmanager
+from datetime import timedelta
+import logging
+import time
+
+from chunked_upload.constants import COMPLETE, UPLOADING
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+
+__all__ = [
+    "log_chunk_metrics",
+    "log_completion_metrics",
+    "measure",
+    "received_seconds",
+    "render_upload_metrics",
+]
+
+# отдельный логгер: строки key=value разбирает сборщик логов
+logger = logging.getLogger("upload.metrics")
+
+METRICS_WINDOW_HOURS = 1
+
+
+def received_seconds(request):
+    """
+    Время от начала запроса в nginx до входа в представление: приём тела
+    по сети и очередь. nginx передаёт начало в X-Request-Start
+    ("t=<секунды>"), без заголовка возвращается None.
+    """
+    header = request.META.get("HTTP_X_REQUEST_START", "")
+    try:
+        started = float(header.removeprefix("t="))
+    except ValueError:
+        return None
+
+    return max(time.time() - started, 0.0)
+
+
+@contextmanager
+def measure(timings, phase):
+    """Добавляет длительность блока (в секундах) к timings[phase]."""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0.0) + time.monotonic() - started
+
+
+def log_chunk_metrics(chunked_upload, size, timings):
+    logger.info(
+        "upload_chunk upload_id=%s bytes=%s receive=%.4f write=%.4f "
+        "db=%.4f throughput=%.0f",
+        chunked_upload.upload_id,
+        size,
+        timings.get("receive") or 0.0,
+        timings.get("write", 0.0),
+        timings.get("db", 0.0),
+        chunked_upload.throughput,
+    )
+
+
+def log_completion_metrics(chunked_upload, timings):
+    logger.info(
+        "upload_complete upload_id=%s bytes=%s chunks=%s %s",
+        chunked_upload.upload_id,
+        chunked_upload.offset,
+        chunked_upload.chunk_count,
+        " ".join(
+            f"{phase}={seconds:.4f}" for phase, seconds in timings.items()
+        ),
+    )
+
+
+def render_upload_metrics():
+    """
+    Сводка по загрузкам, активным за последний час, в текстовом формате
+    Prometheus. Считается одним агрегирующим запросом.
+    """
+    from upload.models import UserChunkedUpload
+
+    since = timezone.now() - timedelta(hours=METRICS_WINDOW_HOURS)
+    totals = UserChunkedUpload.objects.filter(updated_on__gte=since).aggregate(
+        uploads=Count("pk"),
+        uploading=Count("pk", filter=Q(status=UPLOADING)),
+        completed=Count("pk", filter=Q(status=COMPLETE)),
+        chunks=Sum("chunk_count"),
+        bytes=Sum("offset"),
+        receive_seconds=Sum("receive_seconds"),
+        write_seconds=Sum("write_seconds"),
+        db_seconds=Sum("db_seconds"),
+        slowest_chunk_seconds=Max("slowest_chunk_seconds"),
+    )
+    lines = []
+    for name, value in totals.items():
+        metric = f"coto_upload_{name}"
+        lines.append(f"# TYPE {metric} gauge")
+        lines.append(f"{metric} {value or 0}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.16 on 2026-10-19 04:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("upload", "0009_alter_playlistitem_options"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="video",
+            name="hls_pid",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="video",
+            name="hls_task_id",
+            field=models.CharField(blank=True, default="", max_length=255),
+        ),
+        migrations.AddField(
+            model_name="video",
+            name="hls_worker",
+            field=models.CharField(blank=True, default="", max_length=255),
+        ),
+    ]
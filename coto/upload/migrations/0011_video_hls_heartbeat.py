@@ -0,0 +1,23 @@
+# Generated by Django 4.2.16 on 2026-10-19 04:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("upload", "0010_video_hls_job_tracking"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="video",
+            name="hls_attempts",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="video",
+            name="hls_heartbeat",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
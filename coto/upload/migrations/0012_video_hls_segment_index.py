@@ -0,0 +1,22 @@
+# Generated by Django 4.2.16 on 2026-10-19 04:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("upload", "0011_video_hls_heartbeat"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="video",
+            name="hls_segment_index",
+            field=models.JSONField(
+                blank=True,
+                default=list,
+                help_text="Время начала каждого HLS-сегмента в секундах",
+            ),
+        ),
+    ]
@@ -0,0 +1,115 @@
+# Generated by Django 4.2.16 on 2026-10-19 04:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("upload", "0012_video_hls_segment_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="video",
+            name="video_codec",
+            field=models.CharField(
+                blank=True,
+                default="",
+                max_length=32,
+                verbose_name="Видеокодек исходника",
+            ),
+        ),
+        migrations.CreateModel(
+            name="ReprocessBatch",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "created_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now,
+                        verbose_name="Дата создания",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("running", "Выполняется"),
+                            ("paused", "Приостановлен"),
+                            ("finished", "Всё поставлено в очередь"),
+                            ("cancelled", "Отменён"),
+                        ],
+                        default="running",
+                        max_length=16,
+                        verbose_name="Статус",
+                    ),
+                ),
+                (
+                    "filters",
+                    models.JSONField(
+                        blank=True, default=dict, verbose_name="Фильтры"
+                    ),
+                ),
+                (
+                    "rate_per_minute",
+                    models.PositiveIntegerField(
+                        default=10, verbose_name="Видео в минуту"
+                    ),
+                ),
+                (
+                    "total",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Всего видео"
+                    ),
+                ),
+                (
+                    "enqueued",
+                    models.PositiveIntegerField(
+                        default=0, verbose_name="Поставлено в очередь"
+                    ),
+                ),
+                ("last_video_id", models.BigIntegerField(default=0)),
+                (
+                    "created_by",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="reprocess_batches",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Создал",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Пакет переобработки",
+                "verbose_name_plural": "Пакеты переобработки",
+                "ordering": ["-created_at"],
+            },
+        ),
+        migrations.AddField(
+            model_name="video",
+            name="reprocess_batch",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="videos",
+                to="upload.reprocessbatch",
+                verbose_name="Пакет переобработки",
+            ),
+        ),
+    ]
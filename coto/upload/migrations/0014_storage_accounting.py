@@ -0,0 +1,115 @@
+# Generated by Django 4.2.16 on 2026-10-19 04:24
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("upload", "0013_reprocess_batch"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="video",
+            name="hls_bytes",
+            field=models.BigIntegerField(
+                default=0, verbose_name="HLS на диске (в байтах)"
+            ),
+        ),
+        migrations.AddField(
+            model_name="video",
+            name="hls_renditions",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                help_text="Байты по каждому плейлисту HLS (с его сегментами)",
+                verbose_name="Размер вариантов HLS",
+            ),
+        ),
+        migrations.AddField(
+            model_name="video",
+            name="hls_segment_count",
+            field=models.PositiveIntegerField(
+                default=0, verbose_name="Сегментов HLS"
+            ),
+        ),
+        migrations.AddField(
+            model_name="video",
+            name="source_bytes",
+            field=models.BigIntegerField(
+                default=0, verbose_name="Исходник на диске (в байтах)"
+            ),
+        ),
+        migrations.AddField(
+            model_name="video",
+            name="thumbnail_bytes",
+            field=models.BigIntegerField(
+                default=0, verbose_name="Превью на диске (в байтах)"
+            ),
+        ),
+        migrations.CreateModel(
+            name="UserStorage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "video_count",
+                    models.IntegerField(default=0, verbose_name="Видео"),
+                ),
+                (
+                    "source_bytes",
+                    models.BigIntegerField(
+                        default=0, verbose_name="Исходники (байт)"
+                    ),
+                ),
+                (
+                    "hls_bytes",
+                    models.BigIntegerField(
+                        default=0, verbose_name="HLS (байт)"
+                    ),
+                ),
+                (
+                    "thumbnail_bytes",
+                    models.BigIntegerField(
+                        default=0, verbose_name="Превью (байт)"
+                    ),
+                ),
+                (
+                    "hls_segment_count",
+                    models.BigIntegerField(
+                        default=0, verbose_name="Сегментов HLS"
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(
+                        auto_now=True, verbose_name="Обновлено"
+                    ),
+                ),
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="storage",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Пользователь",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Место пользователя",
+                "verbose_name_plural": "Место пользователей",
+            },
+        ),
+    ]
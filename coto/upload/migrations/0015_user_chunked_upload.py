@@ -0,0 +1,84 @@
+# Generated by Django 4.2.16 on 2026-10-19 04:27
+
+import chunked_upload.models
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("upload", "0014_storage_accounting"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserChunkedUpload",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "upload_id",
+                    models.CharField(
+                        default=chunked_upload.models.generate_upload_id,
+                        editable=False,
+                        max_length=32,
+                        unique=True,
+                    ),
+                ),
+                (
+                    "file",
+                    models.FileField(
+                        max_length=255,
+                        upload_to="chunked_uploads/%Y/%m/%d/%Y/%m/%d.part",
+                    ),
+                ),
+                ("filename", models.CharField(max_length=255)),
+                ("offset", models.BigIntegerField(default=0)),
+                ("created_on", models.DateTimeField(auto_now_add=True)),
+                (
+                    "status",
+                    models.PositiveSmallIntegerField(
+                        choices=[(1, "Uploading"), (2, "Complete")], default=1
+                    ),
+                ),
+                ("completed_on", models.DateTimeField(blank=True, null=True)),
+                (
+                    "total_size",
+                    models.BigIntegerField(
+                        default=0, verbose_name="Полный размер"
+                    ),
+                ),
+                (
+                    "received_ranges",
+                    models.JSONField(
+                        blank=True,
+                        default=list,
+                        verbose_name="Полученные диапазоны",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="user_chunked_uploads",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Пользователь",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Загрузка по частям",
+                "verbose_name_plural": "Загрузки по частям",
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.16 on 2026-10-19 04:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("upload", "0015_user_chunked_upload"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="userchunkedupload",
+            name="fingerprint",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="MD5 первого мегабайта файла, для возобновления",
+                max_length=64,
+                verbose_name="Хеш начала файла",
+            ),
+        ),
+        migrations.AddField(
+            model_name="userchunkedupload",
+            name="updated_on",
+            field=models.DateTimeField(
+                auto_now=True, verbose_name="Последний чанк"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="userchunkedupload",
+            index=models.Index(
+                fields=["user", "filename", "total_size", "fingerprint"],
+                name="upload_user_user_id_ceb9f9_idx",
+            ),
+        ),
+    ]
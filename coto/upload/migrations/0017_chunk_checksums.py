@@ -0,0 +1,32 @@
+# Generated by Django 4.2.16 on 2026-10-19 04:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("upload", "0016_chunked_upload_resume"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="userchunkedupload",
+            name="checksum_algorithm",
+            field=models.CharField(
+                default="md5",
+                max_length=16,
+                verbose_name="Алгоритм контрольной суммы",
+            ),
+        ),
+        migrations.AddField(
+            model_name="userchunkedupload",
+            name="chunk_checksums",
+            field=models.JSONField(
+                blank=True,
+                default=list,
+                help_text="[start, end, hexdigest] каждого полученного чанка",
+                verbose_name="Контрольные суммы чанков",
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.16 on 2026-10-19 04:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("upload", "0017_chunk_checksums"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="userchunkedupload",
+            name="direct",
+            field=models.BooleanField(
+                default=False,
+                help_text="Чанки принимает nginx по тикету, минуя Django",
+                verbose_name="Прямая загрузка",
+            ),
+        ),
+    ]
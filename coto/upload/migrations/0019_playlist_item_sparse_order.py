@@ -0,0 +1,46 @@
+# Generated by Django 4.2.16 on 2026-10-19 04:45
+
+from django.db import migrations, models
+
+ORDER_STEP = 1024
+
+
+def spread_playlist_order(apps, schema_editor):
+    PlaylistItem = apps.get_model("upload", "PlaylistItem")
+    items = PlaylistItem.objects.order_by(
+        "playlist_id",
+        "order",
+        "season_number",
+        "episode_number",
+    ).only("playlist_id", "order")
+    changed, playlist_id, position = [], None, 0
+    for item in items.iterator():
+        if item.playlist_id != playlist_id:
+            playlist_id, position = item.playlist_id, 0
+
+        position += 1
+        item.order = position * ORDER_STEP
+        changed.append(item)
+
+    PlaylistItem.objects.bulk_update(changed, ["order"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("upload", "0018_chunked_upload_direct"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="playlistitem",
+            index=models.Index(
+                fields=["playlist", "order"],
+                name="upload_play_playlis_b7d4c6_idx",
+            ),
+        ),
+        migrations.RunPython(
+            spread_playlist_order,
+            migrations.RunPython.noop,
+        ),
+    ]
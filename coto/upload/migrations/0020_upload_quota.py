@@ -0,0 +1,71 @@
+# Generated by Django 4.2.16 on 2026-10-19 04:48
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("upload", "0019_playlist_item_sparse_order"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UploadQuota",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "max_bytes",
+                    models.BigIntegerField(
+                        blank=True, null=True, verbose_name="Место (байт)"
+                    ),
+                ),
+                (
+                    "max_concurrent_uploads",
+                    models.PositiveIntegerField(
+                        blank=True,
+                        null=True,
+                        verbose_name="Одновременных загрузок",
+                    ),
+                ),
+                (
+                    "max_uploads_per_day",
+                    models.PositiveIntegerField(
+                        blank=True, null=True, verbose_name="Загрузок в сутки"
+                    ),
+                ),
+                (
+                    "max_transcode_minutes",
+                    models.PositiveIntegerField(
+                        blank=True,
+                        null=True,
+                        verbose_name="Минут обработки в сутки",
+                    ),
+                ),
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="upload_quota",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Пользователь",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Квота загрузки",
+                "verbose_name_plural": "Квоты загрузки",
+            },
+        ),
+    ]
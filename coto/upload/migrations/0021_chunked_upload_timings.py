@@ -0,0 +1,68 @@
+# Generated by Django 4.2.16 on 2026-10-19 04:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("upload", "0020_upload_quota"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="userchunkedupload",
+            name="chunk_count",
+            field=models.PositiveIntegerField(
+                default=0, verbose_name="Чанков получено"
+            ),
+        ),
+        migrations.AddField(
+            model_name="userchunkedupload",
+            name="completion_timings",
+            field=models.JSONField(
+                blank=True, default=dict, verbose_name="Этапы завершения, с"
+            ),
+        ),
+        migrations.AddField(
+            model_name="userchunkedupload",
+            name="db_seconds",
+            field=models.FloatField(
+                default=0,
+                help_text="Ожидание блокировки и чтение строки загрузки",
+                verbose_name="Обновление строки, с",
+            ),
+        ),
+        migrations.AddField(
+            model_name="userchunkedupload",
+            name="receive_seconds",
+            field=models.FloatField(
+                default=0,
+                help_text="Сумма времени от nginx до представления (сеть, очередь)",
+                verbose_name="Приём чанков, с",
+            ),
+        ),
+        migrations.AddField(
+            model_name="userchunkedupload",
+            name="slowest_chunk_seconds",
+            field=models.FloatField(
+                default=0, verbose_name="Самый медленный чанк, с"
+            ),
+        ),
+        migrations.AddField(
+            model_name="userchunkedupload",
+            name="throughput",
+            field=models.FloatField(
+                default=0,
+                help_text="Полученные байты к времени от начала загрузки",
+                verbose_name="Скорость, байт/с",
+            ),
+        ),
+        migrations.AddField(
+            model_name="userchunkedupload",
+            name="write_seconds",
+            field=models.FloatField(
+                default=0, verbose_name="Запись чанков, с"
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.16 on 2026-10-19 05:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("upload", "0021_chunked_upload_timings"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="video",
+            name="reprocess_status",
+            field=models.CharField(
+                blank=True,
+                default="",
+                max_length=32,
+                verbose_name="Статус переобработки",
+            ),
+        ),
+    ]
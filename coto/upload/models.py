@@ -1,17 +1,52 @@
+from bisect import bisect_right
+import hashlib
 import logging
+import os
 from pathlib import Path
+import time
 
+from chunked_upload.constants import UPLOADING
+from chunked_upload.models import AbstractChunkedUpload
+from chunked_upload.settings import EXPIRATION_DELTA
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.files.storage import default_storage
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
 __all__ = "Video"
 
 
 logger = logging.getLogger(__name__)
 
+CHECKSUM_ALGORITHMS = {
+    "md5": hashlib.md5,
+    "sha256": hashlib.sha256,
+    "blake2b": hashlib.blake2b,
+}
+if xxhash is not None:
+    CHECKSUM_ALGORITHMS["xxh64"] = xxhash.xxh64
+
+
+def segment_at(starts, seconds):
+    """
+    Сегмент HLS по списку времён начала сегментов:
+    {"segment": номер, "start": время начала} или None без индекса.
+    """
+    if not starts:
+        return None
+
+    number = max(0, bisect_right(starts, seconds) - 1)
+    return {"segment": number, "start": starts[number]}
+
 
 class Video(models.Model):
     title = models.CharField(_("Название"), max_length=200)
@@ -36,6 +71,11 @@ class Video(models.Model):
         null=True,
         help_text="Путь до файла master.m3u8",
     )
+    hls_segment_index = models.JSONField(
+        default=list,
+        blank=True,
+        help_text="Время начала каждого HLS-сегмента в секундах",
+    )
     hls_progress = models.PositiveSmallIntegerField(default=0)
     hls_status = models.CharField(
         max_length=32,
@@ -43,11 +83,57 @@ class Video(models.Model):
         default="awaiting processing",
     )
     hls_log = models.TextField(blank=True, default="")
+    hls_task_id = models.CharField(max_length=255, blank=True, default="")
+    hls_pid = models.PositiveIntegerField(null=True, blank=True)
+    hls_worker = models.CharField(max_length=255, blank=True, default="")
+    hls_heartbeat = models.DateTimeField(null=True, blank=True)
+    hls_attempts = models.PositiveSmallIntegerField(default=0)
+    # этап переобработки готового видео; hls_status остаётся "done",
+    # пока новый вывод не заменит старый, и видео не пропадает
+    reprocess_status = models.CharField(
+        _("Статус переобработки"),
+        max_length=32,
+        blank=True,
+        default="",
+    )
     file_size = models.BigIntegerField(
         _("Размер файла (в байтах)"),
         null=True,
         blank=True,
     )
+    source_bytes = models.BigIntegerField(
+        _("Исходник на диске (в байтах)"),
+        default=0,
+    )
+    hls_bytes = models.BigIntegerField(_("HLS на диске (в байтах)"), default=0)
+    hls_renditions = models.JSONField(
+        _("Размер вариантов HLS"),
+        default=dict,
+        blank=True,
+        help_text="Байты по каждому плейлисту HLS (с его сегментами)",
+    )
+    hls_segment_count = models.PositiveIntegerField(
+        _("Сегментов HLS"),
+        default=0,
+    )
+    thumbnail_bytes = models.BigIntegerField(
+        _("Превью на диске (в байтах)"),
+        default=0,
+    )
+    video_codec = models.CharField(
+        _("Видеокодек исходника"),
+        max_length=32,
+        blank=True,
+        default="",
+    )
+    reprocess_batch = models.ForeignKey(
+        "upload.ReprocessBatch",
+        on_delete=models.SET_NULL,
+        related_name="videos",
+        null=True,
+        blank=True,
+        verbose_name=_("Пакет переобработки"),
+    )
 
     class Meta:
         verbose_name = _("Видео")
@@ -57,6 +143,19 @@ class Video(models.Model):
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if "file" in field_names:
+            instance._original_file_name = values[field_names.index("file")]
+
+        if "thumbnail" in field_names:
+            instance._original_thumbnail_name = values[
+                field_names.index("thumbnail")
+            ]
+
+        return instance
+
     def save(self, *args, **kwargs):
         skip_tasks = kwargs.pop("_skip_tasks", False)
         update_fields = kwargs.get("update_fields")
@@ -67,14 +166,143 @@ class Video(models.Model):
             except Video.DoesNotExist:
                 return
 
+        file_replaced = (
+            not is_new
+            and (update_fields is None or "file" in update_fields)
+            and hasattr(self, "_original_file_name")
+            and (self.file.name or "") != (self._original_file_name or "")
+        )
+        if file_replaced:
+            self._reset_processing_state()
+            if update_fields is not None:
+                kwargs["update_fields"] = set(update_fields) | {
+                    "duration",
+                    "file_size",
+                    "hls_progress",
+                    "hls_status",
+                    "reprocess_status",
+                    "hls_log",
+                    "hls_pid",
+                    "hls_worker",
+                    "hls_heartbeat",
+                    "hls_attempts",
+                }
+
+        thumbnail_changed = (
+            update_fields is None or "thumbnail" in update_fields
+        ) and (self.thumbnail.name or "") != (
+            getattr(self, "_original_thumbnail_name", "") or ""
+        )
+
         super().save(*args, **kwargs)
-        if is_new and not skip_tasks:
-            from upload.tasks import extract_video_metadata, generate_hls
+        self._original_file_name = self.file.name
+        self._original_thumbnail_name = self.thumbnail.name
+        if is_new:
+            UserStorage.add(self.uploaded_by_id, video_count=1)
+
+        if thumbnail_changed:
+            self.update_storage(
+                thumbnail_bytes=self.stored_size(self.thumbnail),
+            )
+
+        if (is_new or file_replaced) and not skip_tasks:
+            from upload.hls_jobs import start_hls_job
+            from upload.tasks import extract_video_metadata
 
             extract_video_metadata.delay(self.pk)
-            generate_hls.delay(self.pk)
+            start_hls_job(self)
+
+    STORAGE_FIELDS = (
+        "source_bytes",
+        "hls_bytes",
+        "thumbnail_bytes",
+        "hls_segment_count",
+    )
+
+    @property
+    def storage_bytes(self):
+        return self.source_bytes + self.hls_bytes + self.thumbnail_bytes
+
+    def update_storage(self, **values):
+        """
+        Записывает новые значения учёта места (STORAGE_FIELDS) и прибавляет
+        разницу со старыми к итогам владельца в UserStorage.
+        """
+        with transaction.atomic():
+            current = (
+                Video.objects.select_for_update()
+                .filter(pk=self.pk)
+                .values("uploaded_by_id", *values)
+                .first()
+            )
+            if current is None:
+                return
+
+            Video.objects.filter(pk=self.pk).update(**values)
+            UserStorage.add(
+                current["uploaded_by_id"],
+                **{name: values[name] - current[name] for name in values},
+            )
+
+        for name, value in values.items():
+            setattr(self, name, value)
+
+    @staticmethod
+    def stored_size(field_file):
+        if not field_file:
+            return 0
+
+        try:
+            return field_file.storage.size(field_file.name)
+        except (OSError, NotImplementedError):
+            logger.warning("Не удалось получить размер %s", field_file.name)
+            return 0
+
+    def segment_for_time(self, seconds):
+        """
+        Возвращает сегмент HLS, содержащий момент seconds:
+        {"segment": номер, "start": время начала} или None без индекса.
+        """
+        return segment_at(self.hls_segment_index, seconds)
+
+    @property
+    def job_status_field(self):
+        """Поле, в котором идёт статус текущей обработки HLS."""
+        return "reprocess_status" if self.reprocess_status else "hls_status"
+
+    def _reset_processing_state(self):
+        """Файл заменён: отменяем текущую обработку и сбрасываем метаданные."""
+        from upload.hls_jobs import cancel_hls_job
+
+        cancel_hls_job(self)
+        self.duration = None
+        self.file_size = None
+        self.hls_progress = 0
+        self.hls_status = "awaiting processing"
+        self.reprocess_status = ""
+        self.hls_log = ""
+        self.hls_pid = None
+        self.hls_worker = ""
+        self.hls_heartbeat = None
+        self.hls_attempts = 0
 
     def delete(self, *args, **kwargs):
+        from upload.hls_jobs import cancel_hls_job
+
+        cancel_hls_job(self)
+
+        stored = (
+            Video.objects.filter(pk=self.pk)
+            .values("uploaded_by_id", *self.STORAGE_FIELDS)
+            .first()
+        )
+        if stored is not None:
+            UserStorage.add(
+                stored.pop("uploaded_by_id"),
+                video_count=-1,
+                **{name: -value for name, value in stored.items()},
+            )
+
         if self.file and default_storage.exists(self.file.name):
             try:
                 default_storage.delete(self.file.name)
@@ -120,6 +348,284 @@ class Video(models.Model):
         super().delete(*args, **kwargs)
 
 
+class UserStorage(models.Model):
+    """
+    Итоги занятого места по пользователю.
+
+    Обновляются инкрементально (F-выражениями) при изменении учёта у
+    видео, поэтому читаются без обхода файлов. rebuild() пересчитывает
+    итоги по полям видео, если они разошлись (например, после массового
+    удаления через QuerySet.delete()).
+    """
+
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        related_name="storage",
+        verbose_name=_("Пользователь"),
+    )
+    video_count = models.IntegerField(_("Видео"), default=0)
+    source_bytes = models.BigIntegerField(_("Исходники (байт)"), default=0)
+    hls_bytes = models.BigIntegerField(_("HLS (байт)"), default=0)
+    thumbnail_bytes = models.BigIntegerField(_("Превью (байт)"), default=0)
+    hls_segment_count = models.BigIntegerField(_("Сегментов HLS"), default=0)
+    updated_at = models.DateTimeField(_("Обновлено"), auto_now=True)
+
+    class Meta:
+        verbose_name = _("Место пользователя")
+        verbose_name_plural = _("Место пользователей")
+
+    def __str__(self):
+        return str(self.user)
+
+    @property
+    def total_bytes(self):
+        return self.source_bytes + self.hls_bytes + self.thumbnail_bytes
+
+    @classmethod
+    def add(cls, user_id, **deltas):
+        from upload.quotas import add_stored_bytes
+
+        deltas = {name: delta for name, delta in deltas.items() if delta}
+        if not user_id or not deltas:
+            return
+
+        cls.objects.get_or_create(user_id=user_id)
+        cls.objects.filter(user_id=user_id).update(
+            updated_at=timezone.now(),
+            **{name: F(name) + delta for name, delta in deltas.items()},
+        )
+        add_stored_bytes(
+            user_id,
+            sum(
+                deltas.get(name, 0)
+                for name in ("source_bytes", "hls_bytes", "thumbnail_bytes")
+            ),
+        )
+
+    @classmethod
+    def rebuild(cls, user_id):
+        totals = Video.objects.filter(uploaded_by_id=user_id).aggregate(
+            video_count=Count("pk"),
+            **{name: Coalesce(Sum(name), 0) for name in Video.STORAGE_FIELDS},
+        )
+        return cls.objects.update_or_create(
+            user_id=user_id,
+            defaults=totals,
+        )[0]
+
+
+class UploadQuota(models.Model):
+    """
+    Индивидуальные лимиты загрузки пользователя. Пустое поле — лимит
+    из настроек (UPLOAD_QUOTA_*), 0 — без ограничения.
+    """
+
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        related_name="upload_quota",
+        verbose_name=_("Пользователь"),
+    )
+    max_bytes = models.BigIntegerField(
+        _("Место (байт)"),
+        null=True,
+        blank=True,
+    )
+    max_concurrent_uploads = models.PositiveIntegerField(
+        _("Одновременных загрузок"),
+        null=True,
+        blank=True,
+    )
+    max_uploads_per_day = models.PositiveIntegerField(
+        _("Загрузок в сутки"),
+        null=True,
+        blank=True,
+    )
+    max_transcode_minutes = models.PositiveIntegerField(
+        _("Минут обработки в сутки"),
+        null=True,
+        blank=True,
+    )
+
+    class Meta:
+        verbose_name = _("Квота загрузки")
+        verbose_name_plural = _("Квоты загрузки")
+
+    def __str__(self):
+        return str(self.user)
+
+    def save(self, *args, **kwargs):
+        from upload.quotas import invalidate_upload_limits
+
+        super().save(*args, **kwargs)
+        invalidate_upload_limits(self.user_id)
+
+    def delete(self, *args, **kwargs):
+        from upload.quotas import invalidate_upload_limits
+
+        invalidate_upload_limits(self.user_id)
+        return super().delete(*args, **kwargs)
+
+
+class ReprocessBatch(models.Model):
+    """
+    Пакетная переобработка HLS для уже загруженных видео.
+
+    Видео выбираются по фильтрам и ставятся в очередь порциями не быстрее
+    rate_per_minute с пониженным приоритетом, чтобы не задерживать
+    обработку свежих загрузок. Пакет можно приостановить и возобновить.
+    """
+
+    class Status(models.TextChoices):
+        RUNNING = "running", _("Выполняется")
+        PAUSED = "paused", _("Приостановлен")
+        FINISHED = "finished", _("Всё поставлено в очередь")
+        CANCELLED = "cancelled", _("Отменён")
+
+    created_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        related_name="reprocess_batches",
+        null=True,
+        blank=True,
+        verbose_name=_("Создал"),
+    )
+    created_at = models.DateTimeField(_("Дата создания"), default=timezone.now)
+    status = models.CharField(
+        _("Статус"),
+        max_length=16,
+        choices=Status.choices,
+        default=Status.RUNNING,
+    )
+    filters = models.JSONField(_("Фильтры"), default=dict, blank=True)
+    rate_per_minute = models.PositiveIntegerField(
+        _("Видео в минуту"),
+        default=10,
+    )
+    total = models.PositiveIntegerField(_("Всего видео"), default=0)
+    enqueued = models.PositiveIntegerField(
+        _("Поставлено в очередь"),
+        default=0,
+    )
+    last_video_id = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = _("Пакет переобработки")
+        verbose_name_plural = _("Пакеты переобработки")
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"#{self.pk} ({self.get_status_display()})"
+
+    def get_queryset(self):
+        """Видео, подходящие под фильтры пакета."""
+        f = self.filters or {}
+        lookups = {
+            "pk__in": f.get("ids"),
+            "hls_status__in": f.get("statuses"),
+            "created_at__date__gte": f.get("created_from"),
+            "created_at__date__lte": f.get("created_to"),
+            "video_codec__in": f.get("codecs"),
+            "file_size__gte": f.get("min_size"),
+            "file_size__lte": f.get("max_size"),
+        }
+        return Video.objects.filter(
+            **{
+                lookup: value
+                for lookup, value in lookups.items()
+                if value not in (None, "", [])
+            },
+        )
+
+    def get_progress(self):
+        """Сколько видео пакета уже обработано, с ошибкой и в работе."""
+        counts = self.videos.aggregate(
+            done=Count(
+                "pk",
+                filter=models.Q(hls_status="done", reprocess_status=""),
+            ),
+            error=Count(
+                "pk",
+                filter=models.Q(hls_status="error")
+                | models.Q(reprocess_status="error"),
+            ),
+        )
+        counts["in_progress"] = (
+            self.enqueued - counts["done"] - counts["error"]
+        )
+        # видео, пропущенные из-за уже идущей обработки, в пакет не попали
+        total = (
+            self.enqueued
+            if self.status == self.Status.FINISHED
+            else self.total
+        )
+        counts["percent"] = int(100 * counts["done"] / total) if total else 100
+        return counts
+
+    def enqueue_next(self):
+        """
+        Ставит в очередь следующую порцию видео (не больше rate_per_minute).
+        Видео, которые уже в очереди или в работе, пропускаются.
+        """
+        from upload.hls_jobs import (
+            QUEUED_HLS_STATUSES,
+            RUNNING_HLS_STATUSES,
+            start_hls_job,
+        )
+
+        with transaction.atomic():
+            batch = ReprocessBatch.objects.select_for_update().get(pk=self.pk)
+            if batch.status != self.Status.RUNNING:
+                return 0
+
+            candidates = list(
+                batch.get_queryset()
+                .filter(pk__gt=batch.last_video_id)
+                .order_by("pk")[: batch.rate_per_minute],
+            )
+            if not candidates:
+                batch.status = self.Status.FINISHED
+                batch.save(update_fields=["status"])
+                self.status = batch.status
+                return 0
+
+            batch.last_video_id = candidates[-1].pk
+            videos = [
+                v
+                for v in candidates
+                if getattr(v, v.job_status_field)
+                not in QUEUED_HLS_STATUSES + RUNNING_HLS_STATUSES
+            ]
+            for video in videos:
+                # готовое видео остаётся доступным со старым выводом,
+                # ход переобработки пишется в reprocess_status
+                status_field = (
+                    "reprocess_status"
+                    if video.hls_status == "done"
+                    else "hls_status"
+                )
+                Video.objects.filter(pk=video.pk).update(
+                    reprocess_batch=batch,
+                    hls_progress=0,
+                    hls_attempts=0,
+                    **{status_field: "awaiting processing"},
+                )
+                transaction.on_commit(
+                    lambda video=video: start_hls_job(
+                        video,
+                        priority=settings.HLS_REPROCESS_PRIORITY,
+                        force_transcode=True,
+                    ),
+                )
+
+            batch.enqueued += len(videos)
+            batch.save(update_fields=["last_video_id", "enqueued"])
+
+        self.refresh_from_db()
+        return len(videos)
+
+
 class Playlist(models.Model):
     """
     Плейлист (сериал, шоу, сборник видео).
@@ -155,8 +661,15 @@ class PlaylistItem(models.Model):
     """
     Связь между плейлистом и видео.
     Можно указывать сезон, номер серии, порядок.
+
+    order — разреженный ранг: соседние элементы отстоят на ORDER_STEP,
+    поэтому перемещение элемента меняет только его строку (ранг между
+    соседями). Когда между соседями не остаётся места, ранги плейлиста
+    переразмечаются одним bulk_update (rebalance).
     """
 
+    ORDER_STEP = 1024
+
     playlist = models.ForeignKey(
         Playlist,
         on_delete=models.CASCADE,
@@ -182,7 +695,391 @@ class PlaylistItem(models.Model):
         verbose_name_plural = _("Эпизоды плейлиста")
         ordering = ["order", "season_number", "episode_number"]
         unique_together = ("playlist", "season_number", "episode_number")
+        indexes = [
+            models.Index(fields=["playlist", "order"]),
+        ]
 
     def __str__(self):
         return f"{self.playlist.title} — \
             S{self.season_number:02d}E{self.episode_number:02d}"
+
+    @classmethod
+    def rank_between(cls, previous, following):
+        """
+        Ранг между соседями (None — край списка) или None, если
+        между ними не осталось места.
+        """
+        low = previous or 0
+        if following is None:
+            return low + cls.ORDER_STEP
+
+        if following - low < 2:
+            return None
+
+        return (low + following) // 2
+
+    @classmethod
+    def rebalance(cls, playlist_id):
+        """Переразмечает ранги плейлиста с шагом ORDER_STEP."""
+        items = cls.objects.filter(playlist_id=playlist_id).only("order")
+        changed = []
+        for position, item in enumerate(items, 1):
+            if item.order != position * cls.ORDER_STEP:
+                item.order = position * cls.ORDER_STEP
+                changed.append(item)
+
+        cls.objects.bulk_update(changed, ["order"], batch_size=500)
+        return len(changed)
+
+    @classmethod
+    def plan_ranks(cls, playlist_id, positions):
+        """
+        Ранги для новых элементов, вставляемых по очереди на позиции
+        positions (с 1; пусто или за концом списка — в конец).
+        Если места между соседями нет, плейлист переразмечается; если не
+        хватает и после этого, элемент уходит в конец.
+        """
+        for attempt in range(2):
+            ranks = list(
+                cls.objects.filter(playlist_id=playlist_id).values_list(
+                    "order",
+                    flat=True,
+                ),
+            )
+            planned = []
+            for position in positions:
+                index = min(position - 1, len(ranks)) if position else None
+                rank = None
+                if index is not None:
+                    rank = cls.rank_between(
+                        ranks[index - 1] if index > 0 else None,
+                        ranks[index] if index < len(ranks) else None,
+                    )
+
+                if rank is None and (index is None or attempt):
+                    index = len(ranks)
+                    rank = cls.rank_between(
+                        ranks[-1] if ranks else None,
+                        None,
+                    )
+
+                if rank is None:
+                    break
+
+                ranks.insert(index, rank)
+                planned.append(rank)
+            else:
+                return planned
+
+            cls.rebalance(playlist_id)
+
+        return planned
+
+    def move(self, before=None, after=None):
+        """
+        Ставит элемент сразу перед before или сразу после after (элементы
+        того же плейлиста). Обычно меняется только строка элемента;
+        возвращает True, если понадобилась переразметка плейлиста.
+        """
+        anchor = before or after
+        others = PlaylistItem.objects.filter(
+            playlist_id=self.playlist_id,
+        ).exclude(pk__in=[self.pk, anchor.pk])
+        rebalanced = False
+        with transaction.atomic():
+            # перемещения в одном плейлисте выполняются по очереди
+            Playlist.objects.select_for_update().only("pk").get(
+                pk=self.playlist_id,
+            )
+            for _attempt in range(2):
+                anchor.refresh_from_db(fields=["order"])
+                if before is not None:
+                    neighbour = (
+                        others.filter(order__lte=anchor.order)
+                        .order_by("-order")
+                        .values_list("order", flat=True)
+                        .first()
+                    )
+                    previous, following = neighbour, anchor.order
+                else:
+                    neighbour = (
+                        others.filter(order__gte=anchor.order)
+                        .order_by("order")
+                        .values_list("order", flat=True)
+                        .first()
+                    )
+                    previous, following = anchor.order, neighbour
+
+                # одинаковый ранг с якорем не даёт однозначной позиции
+                rank = (
+                    None
+                    if neighbour == anchor.order
+                    else self.rank_between(previous, following)
+                )
+                if rank is not None:
+                    break
+
+                PlaylistItem.rebalance(self.playlist_id)
+                rebalanced = True
+
+            PlaylistItem.objects.filter(pk=self.pk).update(order=rank)
+
+        self.order = rank
+        return rebalanced
+
+
+def merge_ranges(ranges):
+    """Сливает полуинтервалы [start, end) в отсортированный список."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    return merged
+
+
+class UserChunkedUpload(AbstractChunkedUpload):
+    """
+    Загрузка по частям с произвольным порядком чанков.
+
+    Файл заранее выделяется под полный размер, чанки пишутся по своим
+    смещениям (их можно слать параллельно), а полученные диапазоны
+    хранятся в received_ranges как отсортированный список
+    непересекающихся полуинтервалов [start, end). offset — число
+    полученных байт.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="user_chunked_uploads",
+        verbose_name=_("Пользователь"),
+    )
+    total_size = models.BigIntegerField(_("Полный размер"), default=0)
+    received_ranges = models.JSONField(
+        _("Полученные диапазоны"),
+        default=list,
+        blank=True,
+    )
+    fingerprint = models.CharField(
+        _("Хеш начала файла"),
+        max_length=64,
+        blank=True,
+        default="",
+        help_text="MD5 первого мегабайта файла, для возобновления",
+    )
+    updated_on = models.DateTimeField(_("Последний чанк"), auto_now=True)
+    direct = models.BooleanField(
+        _("Прямая загрузка"),
+        default=False,
+        help_text="Чанки принимает nginx по тикету, минуя Django",
+    )
+    checksum_algorithm = models.CharField(
+        _("Алгоритм контрольной суммы"),
+        max_length=16,
+        default="md5",
+    )
+    chunk_checksums = models.JSONField(
+        _("Контрольные суммы чанков"),
+        default=list,
+        blank=True,
+        help_text="[start, end, hexdigest] каждого полученного чанка",
+    )
+    chunk_count = models.PositiveIntegerField(_("Чанков получено"), default=0)
+    receive_seconds = models.FloatField(
+        _("Приём чанков, с"),
+        default=0,
+        help_text="Сумма времени от nginx до представления (сеть, очередь)",
+    )
+    write_seconds = models.FloatField(_("Запись чанков, с"), default=0)
+    db_seconds = models.FloatField(
+        _("Обновление строки, с"),
+        default=0,
+        help_text="Ожидание блокировки и чтение строки загрузки",
+    )
+    slowest_chunk_seconds = models.FloatField(
+        _("Самый медленный чанк, с"),
+        default=0,
+    )
+    throughput = models.FloatField(
+        _("Скорость, байт/с"),
+        default=0,
+        help_text="Полученные байты к времени от начала загрузки",
+    )
+    completion_timings = models.JSONField(
+        _("Этапы завершения, с"),
+        default=dict,
+        blank=True,
+    )
+
+    FINGERPRINT_BYTES = 1024 * 1024
+    TIMING_FIELDS = (
+        "chunk_count",
+        "receive_seconds",
+        "write_seconds",
+        "db_seconds",
+        "slowest_chunk_seconds",
+        "throughput",
+    )
+
+    class Meta:
+        verbose_name = _("Загрузка по частям")
+        verbose_name_plural = _("Загрузки по частям")
+        indexes = [
+            models.Index(
+                fields=["user", "filename", "total_size", "fingerprint"],
+            ),
+        ]
+
+    @property
+    def expires_on(self):
+        """Срок жизни отсчитывается от последнего полученного чанка."""
+        return (self.updated_on or self.created_on) + EXPIRATION_DELTA
+
+    @classmethod
+    def find_resumable(cls, user, filename, total_size, fingerprint):
+        """Незавершённая и не просроченная загрузка того же файла."""
+        return (
+            cls.objects.filter(
+                user=user,
+                filename=filename,
+                total_size=total_size,
+                fingerprint=fingerprint,
+                status=UPLOADING,
+                updated_on__gt=timezone.now() - EXPIRATION_DELTA,
+            )
+            .order_by("-updated_on")
+            .first()
+        )
+
+    def preallocate(self):
+        """Выделяет место под весь файл, чтобы писать чанки по смещениям."""
+        with Path(self.file.path).open("r+b") as f:
+            try:
+                os.posix_fallocate(f.fileno(), 0, self.total_size)
+            except (AttributeError, OSError):
+                # ФС без fallocate: разреженный файл нужного размера
+                f.truncate(self.total_size)
+
+    def write_range(self, chunk, start):
+        """
+        Пишет чанк в файл начиная с байта start и возвращает его
+        контрольную сумму, посчитанную в том же проходе.
+        """
+        hasher = CHECKSUM_ALGORITHMS[self.checksum_algorithm]()
+        self.file.close()
+        with Path(self.file.path).open("r+b") as f:
+            f.seek(start)
+            for piece in chunk.chunks():
+                f.write(piece)
+                hasher.update(piece)
+
+        return hasher.hexdigest()
+
+    def mark_received(self, start, end, checksum="", timings=None):
+        """
+        Добавляет диапазон [start, end) к полученным, а его контрольную
+        сумму — к chunk_checksums. Строка блокируется, чтобы параллельные
+        запросы не потеряли данные друг друга.
+
+        timings — длительности приёма и записи чанка (receive, write);
+        вместе с временем блокировки (db) они копятся в той же записи.
+        """
+        timings = {} if timings is None else timings
+        with transaction.atomic():
+            locked_at = time.monotonic()
+            locked = UserChunkedUpload.objects.select_for_update().get(
+                pk=self.pk,
+            )
+            timings["db"] = time.monotonic() - locked_at
+            merged = merge_ranges([*locked.received_ranges, [start, end]])
+            locked.received_ranges = merged
+            locked.offset = sum(e - s for s, e in merged)
+            if checksum:
+                # повторно присланный чанк заменяет прежнюю сумму
+                locked.chunk_checksums = sorted(
+                    [
+                        *(c for c in locked.chunk_checksums if c[0] != start),
+                        [start, end, checksum],
+                    ],
+                )
+
+            locked.record_chunk_timings(timings)
+            locked.save(
+                update_fields=[
+                    "received_ranges",
+                    "offset",
+                    "chunk_checksums",
+                    "updated_on",
+                    *self.TIMING_FIELDS,
+                ],
+            )
+
+        self.received_ranges = locked.received_ranges
+        self.offset = locked.offset
+        self.chunk_checksums = locked.chunk_checksums
+        self.updated_on = locked.updated_on
+        for name in self.TIMING_FIELDS:
+            setattr(self, name, getattr(locked, name))
+
+        self._md5 = None
+
+    def record_chunk_timings(self, timings):
+        receive = timings.get("receive") or 0.0
+        write = timings.get("write", 0.0)
+        db = timings.get("db", 0.0)
+        self.chunk_count += 1
+        self.receive_seconds += receive
+        self.write_seconds += write
+        self.db_seconds += db
+        self.slowest_chunk_seconds = max(
+            self.slowest_chunk_seconds,
+            receive + write + db,
+        )
+        elapsed = (timezone.now() - self.created_on).total_seconds()
+        self.throughput = self.offset / max(elapsed, 0.001)
+
+    @property
+    def missing_ranges(self):
+        missing = []
+        position = 0
+        for start, end in self.received_ranges:
+            if start > position:
+                missing.append([position, start])
+
+            position = end
+
+        if position < self.total_size:
+            missing.append([position, self.total_size])
+
+        return missing
+
+    @property
+    def is_fully_received(self):
+        return self.received_ranges == [[0, self.total_size]] or (
+            self.total_size == 0 and not self.received_ranges
+        )
+
+    def get_checksum(self):
+        """
+        Контрольная сумма файла без повторного чтения: хеш от склеенных
+        hex-сумм чанков по порядку. None, если суммы чанков не покрывают
+        файл встык (чанки присылались с разными границами).
+        """
+        digests = []
+        position = 0
+        for start, end, digest in self.chunk_checksums:
+            if start != position:
+                return None
+
+            digests.append(digest)
+            position = end
+
+        if position != self.total_size:
+            return None
+
+        hasher = CHECKSUM_ALGORITHMS[self.checksum_algorithm]()
+        hasher.update("".join(digests).encode())
+        return hasher.hexdigest()
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.core.exceptions import PermissionDenied
 
 __all__ = [
@@ -34,10 +35,13 @@ def check_user_owns_playlist(user, playlist):
     return True
 
 
-def validate_file_size(file_size, max_size_mb=5000):
+def validate_file_size(file_size, max_size_mb=None):
     """
-    Валидация размера файла (по умолчанию максимум 5GB).
+    Валидация размера файла (по умолчанию UPLOAD_MAX_FILE_SIZE_MB).
     """
+    if max_size_mb is None:
+        max_size_mb = settings.UPLOAD_MAX_FILE_SIZE_MB
+
     max_size_bytes = max_size_mb * 1024 * 1024
 
     if file_size > max_size_bytes:
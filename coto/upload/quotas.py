@@ -0,0 +1,277 @@
+import math
+
+from chunked_upload.constants import UPLOADING
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.db.models import Count, Q, Sum
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+
+__all__ = [
+    "add_stored_bytes",
+    "add_transcode_minutes",
+    "get_upload_limits",
+    "get_upload_usage",
+    "invalidate_upload_limits",
+    "reconcile_upload_usage",
+    "refund_daily_upload",
+    "release_upload",
+    "reserve_upload",
+]
+
+# дневные счётчики живут чуть дольше суток, чтобы пережить смену даты
+DAILY_COUNTER_TTL = 2 * 24 * 60 * 60
+LIMITS_TTL = 60 * 60
+
+LIMIT_FIELDS = {
+    "max_bytes": "UPLOAD_QUOTA_BYTES",
+    "max_concurrent_uploads": "UPLOAD_QUOTA_CONCURRENT",
+    "max_uploads_per_day": "UPLOAD_QUOTA_PER_DAY",
+    "max_transcode_minutes": "UPLOAD_QUOTA_TRANSCODE_MINUTES",
+}
+
+
+def _today():
+    return timezone.localdate().strftime("%Y%m%d")
+
+
+def _keys(user_id):
+    day = _today()
+    return {
+        "bytes": f"upload_quota_{user_id}_bytes",
+        "active": f"upload_quota_{user_id}_active",
+        "reserved_bytes": f"upload_quota_{user_id}_reserved_bytes",
+        "uploads_today": f"upload_quota_{user_id}_uploads_{day}",
+        "transcode_minutes_today": f"upload_quota_{user_id}_transcode_{day}",
+    }
+
+
+def _limits_key(user_id):
+    return f"upload_quota_{user_id}_limits"
+
+
+def get_upload_limits(user_id):
+    """
+    Лимиты пользователя: индивидуальные из UploadQuota, иначе из
+    настроек. 0 — без ограничения. Кешируются, сбрасываются при
+    изменении UploadQuota.
+    """
+    limits = cache.get(_limits_key(user_id))
+    if limits is not None:
+        return limits
+
+    from upload.models import UploadQuota
+
+    quota = UploadQuota.objects.filter(user_id=user_id).first()
+    limits = {
+        field: (
+            getattr(quota, field)
+            if quota is not None and getattr(quota, field) is not None
+            else getattr(settings, setting)
+        )
+        for field, setting in LIMIT_FIELDS.items()
+    }
+    cache.set(_limits_key(user_id), limits, LIMITS_TTL)
+    return limits
+
+
+def invalidate_upload_limits(user_id):
+    cache.delete(_limits_key(user_id))
+
+
+def reconcile_upload_usage(user_id):
+    """
+    Пересчитывает счётчики пользователя по базе и записывает их в кеш.
+    Вызывается периодически и при потере счётчиков (вытеснение, рестарт
+    Redis); в обычной проверке квоты запросов к базе нет.
+    """
+    from upload.models import UserChunkedUpload, UserStorage, Video
+
+    start_of_day = timezone.localtime().replace(
+        hour=0,
+        minute=0,
+        second=0,
+        microsecond=0,
+    )
+    storage = UserStorage.objects.filter(user_id=user_id).first()
+    active = Q(
+        status=UPLOADING,
+        updated_on__gt=timezone.now()
+        - settings.CHUNKED_UPLOAD_EXPIRATION_DELTA,
+    )
+    uploads = UserChunkedUpload.objects.filter(user_id=user_id).aggregate(
+        active=Count("pk", filter=active),
+        reserved_bytes=Sum("total_size", filter=active),
+        today=Count("pk", filter=Q(created_on__gte=start_of_day)),
+    )
+    duration = Video.objects.filter(
+        uploaded_by_id=user_id,
+        created_at__gte=start_of_day,
+    ).aggregate(total=Sum("duration"))["total"]
+
+    usage = {
+        "bytes": storage.total_bytes if storage is not None else 0,
+        "active": uploads["active"],
+        "reserved_bytes": uploads["reserved_bytes"] or 0,
+        "uploads_today": uploads["today"],
+        "transcode_minutes_today": (
+            math.ceil(duration.total_seconds() / 60) if duration else 0
+        ),
+    }
+    keys = _keys(user_id)
+    cache.set_many(
+        {
+            keys[name]: usage[name]
+            for name in ("bytes", "active", "reserved_bytes")
+        },
+        None,
+    )
+    cache.set_many(
+        {
+            keys["uploads_today"]: usage["uploads_today"],
+            keys["transcode_minutes_today"]: usage["transcode_minutes_today"],
+        },
+        DAILY_COUNTER_TTL,
+    )
+    return usage
+
+
+def get_upload_usage(user_id):
+    """Текущее использование одним обращением к кешу."""
+    keys = _keys(user_id)
+    values = cache.get_many(keys.values())
+    if len(values) < len(keys):
+        return reconcile_upload_usage(user_id)
+
+    return {name: values[key] for name, key in keys.items()}
+
+
+def _incr(user_id, name, delta=1):
+    key = _keys(user_id)[name]
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        # счётчика нет в кеше: пересчитываем, в нём уже учтено всё,
+        # кроме текущего изменения
+        reconcile_upload_usage(user_id)
+        return cache.incr(key, delta)
+
+
+def reserve_upload(user, size):
+    """
+    Проверяет квоты перед началом новой загрузки и резервирует её
+    размер, слот одновременной загрузки и дневной лимит. Счётчики
+    увеличиваются атомарно и откатываются при превышении, поэтому
+    параллельные запросы не проходят лимит вдвоём: место учитывается
+    вместе с размером ещё идущих загрузок. Персонал не ограничивается.
+    """
+    if user.is_staff:
+        return
+
+    limits = get_upload_limits(user.pk)
+    usage = get_upload_usage(user.pk)
+    if (
+        limits["max_transcode_minutes"]
+        and usage["transcode_minutes_today"] >= limits["max_transcode_minutes"]
+    ):
+        raise PermissionDenied(
+            "Исчерпан дневной лимит обработки видео "
+            f"({limits['max_transcode_minutes']} мин.)",
+        )
+
+    reserved = []
+
+    def rollback():
+        for name, delta in reserved:
+            cache.decr(_keys(user.pk)[name], delta)
+
+    reserved_bytes = _incr(user.pk, "reserved_bytes", size)
+    reserved.append(("reserved_bytes", size))
+    if limits["max_bytes"] and usage["bytes"] + reserved_bytes > (
+        limits["max_bytes"]
+    ):
+        rollback()
+        raise PermissionDenied(
+            "Недостаточно места: занято "
+            f"{filesizeformat(usage['bytes'] + reserved_bytes - size)} "
+            f"из {filesizeformat(limits['max_bytes'])}",
+        )
+
+    checks = [
+        (
+            "active",
+            limits["max_concurrent_uploads"],
+            "Слишком много одновременных загрузок "
+            f"(не больше {limits['max_concurrent_uploads']})",
+        ),
+        (
+            "uploads_today",
+            limits["max_uploads_per_day"],
+            "Исчерпан дневной лимит загрузок "
+            f"({limits['max_uploads_per_day']})",
+        ),
+    ]
+    for name, limit, message in checks:
+        value = _incr(user.pk, name)
+        reserved.append((name, 1))
+        if limit and value > limit:
+            rollback()
+            raise PermissionDenied(message)
+
+
+def release_upload(user_id, size=0, count=1):
+    """
+    Освобождает слоты одновременных загрузок и зарезервированные ими
+    байты (size — суммарный размер загрузок): завершение, удаление.
+    """
+    if not user_id or not count:
+        return
+
+    keys = _keys(user_id)
+    for key, delta in (
+        (keys["active"], count),
+        (keys["reserved_bytes"], size),
+    ):
+        if not delta:
+            continue
+
+        try:
+            cache.decr(key, delta)
+        except ValueError:
+            # счётчика нет — его восстановит пересчёт
+            pass
+
+
+def refund_daily_upload(user_id):
+    """Возвращает дневной слот загрузки, которая не дала видео."""
+    if not user_id:
+        return
+
+    try:
+        cache.decr(_keys(user_id)["uploads_today"])
+    except ValueError:
+        pass
+
+
+def add_stored_bytes(user_id, delta):
+    if not user_id or not delta:
+        return
+
+    try:
+        cache.incr(_keys(user_id)["bytes"], delta)
+    except ValueError:
+        pass
+
+
+def add_transcode_minutes(user_id, seconds):
+    if not user_id or not seconds:
+        return
+
+    try:
+        cache.incr(
+            _keys(user_id)["transcode_minutes_today"],
+            math.ceil(seconds / 60),
+        )
+    except ValueError:
+        pass
@@ -2,22 +2,43 @@ from datetime import timedelta
 import logging
 import os
 from pathlib import Path
+import shutil
+import socket
 import subprocess
 import time
+import uuid
 
 from celery import shared_task
 from django.conf import settings
+from django.utils import timezone
 import ffmpeg
 import psutil
 
+from upload.hls_jobs import (
+    find_stale_hls_jobs,
+    HLSJobCancelledError,
+    is_hls_job_cancelled,
+    requeue_stale_hls_job,
+)
+from upload.quotas import add_transcode_minutes, refund_daily_upload
+
 __all__ = (
+    "assemble_direct_upload",
+    "cleanup_stale_chunked_uploads",
     "extract_video_metadata",
     "generate_hls",
     "generate_video_thumbnail",
+    "reconcile_upload_quotas",
+    "schedule_reprocess_batches",
+    "watch_stale_hls_jobs",
 )
 
 logger = logging.getLogger(__name__)
 
+# повторы сборки прямой загрузки: ENOSPC и сбои ФС бывают временными
+ASSEMBLE_MAX_RETRIES = 3
+ASSEMBLE_RETRY_DELAY = 60
+
 
 @shared_task
 def delete_video_file_delayed(video_id, delay=5):
@@ -32,6 +53,7 @@ def delete_video_file_delayed(video_id, delay=5):
             video = Video.objects.get(pk=video_id)
             if video.file and default_storage.exists(video.file.name):
                 default_storage.delete(video.file.name)
+                video.update_storage(source_bytes=0)
                 logger.info(
                     f"[Delete Task] Файл удален: {video.file.name}",
                 )
@@ -57,6 +79,113 @@ def delete_video_file_delayed(video_id, delay=5):
     )
 
 
+def _fail_direct_upload(video, chunked_upload, reason):
+    """Видео без файла — ошибка, дневной слот загрузки возвращается."""
+    video.hls_status = "error"
+    video.hls_log = (video.hls_log + f"\nСборка загрузки: {reason}")[-8000:]
+    video.save(update_fields=["hls_status", "hls_log"])
+    refund_daily_upload(chunked_upload.user_id)
+
+
+@shared_task(
+    bind=True,
+    max_retries=ASSEMBLE_MAX_RETRIES,
+    default_retry_delay=ASSEMBLE_RETRY_DELAY,
+)
+def assemble_direct_upload(self, upload_id, video_id, checksum):
+    """
+    Собирает чанки прямой загрузки в video.file. Сохранение файла
+    запускает обычную обработку (метаданные, HLS).
+
+    Части должны покрывать файл встык, а их контрольная сумма — совпасть
+    с checksum клиента (см. direct_upload_checksum); при расхождении
+    данные испорчены, видео помечается ошибкой и части удаляются.
+
+    Сбой сборки (нет части чанков, ENOSPC, ошибка ввода-вывода)
+    повторяется ограниченное число раз; после последней попытки видео
+    помечается ошибкой, дневной слот загрузки возвращается, а чанки
+    остаются на диске, чтобы сборку можно было запустить снова.
+    """
+    from upload.direct import (
+        assemble_direct_upload_parts,
+        collect_direct_upload_parts,
+        direct_upload_checksum,
+        direct_upload_dir,
+    )
+    from upload.models import merge_ranges, UserChunkedUpload, Video
+
+    try:
+        chunked_upload = UserChunkedUpload.objects.get(upload_id=upload_id)
+        video = Video.objects.get(pk=video_id)
+    except (UserChunkedUpload.DoesNotExist, Video.DoesNotExist):
+        logger.warning(
+            "[Direct Upload] Загрузка %s или видео %s не найдены",
+            upload_id,
+            video_id,
+        )
+        return
+
+    field = video.file.field
+    name = video.file.storage.get_available_name(
+        field.generate_filename(video, Path(chunked_upload.filename).name),
+        max_length=field.max_length,
+    )
+    target = Path(video.file.storage.path(name))
+    started = time.monotonic()
+    try:
+        parts = collect_direct_upload_parts(chunked_upload)
+        received = merge_ranges([[start, end] for start, end, _path in parts])
+        if received != [[0, chunked_upload.total_size]]:
+            raise OSError(f"получены не все диапазоны: {received}")
+
+        actual = direct_upload_checksum(
+            parts,
+            chunked_upload.checksum_algorithm,
+        )
+        if actual != checksum.lower():
+            logger.error(
+                "[Direct Upload] Контрольная сумма %s не совпала: %s != %s",
+                upload_id,
+                actual,
+                checksum,
+            )
+            _fail_direct_upload(video, chunked_upload, "checksum не совпал")
+            shutil.rmtree(direct_upload_dir(upload_id), ignore_errors=True)
+            return
+
+        assemble_direct_upload_parts(parts, target, chunked_upload.total_size)
+    except OSError as e:
+        target.unlink(missing_ok=True)
+        if self.request.retries < self.max_retries:
+            logger.warning(
+                "[Direct Upload] Сборка %s не удалась (попытка %s/%s): %s",
+                upload_id,
+                self.request.retries + 1,
+                self.max_retries + 1,
+                e,
+            )
+            raise self.retry(exc=e)
+
+        logger.error(
+            "[Direct Upload] Сборка %s не удалась, чанки оставлены: %s",
+            upload_id,
+            e,
+        )
+        _fail_direct_upload(video, chunked_upload, e)
+        return
+
+    shutil.rmtree(direct_upload_dir(upload_id), ignore_errors=True)
+    logger.info(
+        "[Direct Upload] Загрузка %s собрана в %s за %.1f с",
+        upload_id,
+        name,
+        time.monotonic() - started,
+    )
+
+    video.file.name = name
+    video.save(update_fields=["file"])
+
+
 @shared_task
 def extract_video_metadata(video_id):
     logger.info(f"[Metadata Task] Начало обработки видео {video_id}")
@@ -75,6 +204,8 @@ def extract_video_metadata(video_id):
             duration_seconds = float(probe["format"]["duration"])
             video.duration = timedelta(seconds=duration_seconds)
             logger.info(f"[Metadata Task] Длительность: {video.duration}")
+            # новое видео уйдёт в обработку — учитываем в дневной квоте
+            add_transcode_minutes(video.uploaded_by_id, duration_seconds)
 
         # Определение размера
         if not video.file_size:
@@ -83,6 +214,9 @@ def extract_video_metadata(video_id):
             logger.info("[Metadata Task] Размер: {video.file_size} байт")
 
         video.save(update_fields=["duration", "file_size"])
+        if file_path.exists():
+            video.update_storage(source_bytes=file_path.stat().st_size)
+
         logger.info("[Metadata Task] Сохранено успешно")
 
         # Генерация превью, если его нет
@@ -143,14 +277,25 @@ def try_update_video_progress(
         video.hls_progress = max(0, min(100, int(progress)))
         last["progress"] = video.hls_progress
 
+    status_field = video.job_status_field
     if status is not None:
-        video.hls_status = status
+        setattr(video, status_field, status)
 
     if log_line:
         video.hls_log = (video.hls_log + "\n" + log_line)[-8000:]
 
+    # Каждое сохранение прогресса служит heartbeat'ом для watchdog'а
+    video.hls_heartbeat = timezone.now()
+
     try:
-        video.save(update_fields=["hls_progress", "hls_status", "hls_log"])
+        video.save(
+            update_fields=[
+                "hls_progress",
+                status_field,
+                "hls_log",
+                "hls_heartbeat",
+            ],
+        )
         video._last_progress_update["time"] = time.time()
     except Exception:
         logger.exception("Could not save video progress")
@@ -275,12 +420,108 @@ def _ffprobe_duration(path):
     return 0.0
 
 
+def _build_segment_index(manifest_path):
+    """
+    Строит индекс границ сегментов по плейлисту: список времени начала
+    каждого сегмента (номер сегмента = индекс в списке). Сегменты HLS
+    режутся по ключевым кадрам, поэтому это и индекс ключевых кадров.
+    """
+    starts = []
+    position = 0.0
+    try:
+        with Path(manifest_path).open(encoding="utf-8") as f:
+            for line in f:
+                if not line.startswith("#EXTINF:"):
+                    continue
+
+                starts.append(round(position, 3))
+                position += float(line[len("#EXTINF:") :].split(",")[0])
+    except (OSError, ValueError):
+        logger.exception("Не удалось построить индекс сегментов HLS")
+        return []
+
+    return starts
+
+
+def measure_hls_output(out_dir):
+    """
+    Считает место, занятое выводом HLS: байты по каждому плейлисту
+    вместе с его сегментами, общий объём каталога и число сегментов.
+    """
+    renditions = {}
+    segment_count = 0
+    for playlist in sorted(out_dir.glob("*.m3u8")):
+        size = playlist.stat().st_size
+        with playlist.open(encoding="utf-8") as f:
+            for line in f:
+                name = line.strip()
+                if not name or name.startswith("#"):
+                    continue
+
+                segment = out_dir / name
+                if segment.suffix == ".ts" and segment.is_file():
+                    size += segment.stat().st_size
+                    segment_count += 1
+
+        renditions[playlist.stem] = size
+
+    total = sum(p.stat().st_size for p in out_dir.rglob("*") if p.is_file())
+    return renditions, total, segment_count
+
+
+def _record_hls_storage(video, out_dir):
+    try:
+        renditions, total, segment_count = measure_hls_output(out_dir)
+    except OSError:
+        logger.exception("Не удалось посчитать размер вывода HLS")
+        return
+
+    video.hls_renditions = renditions
+    video.update_storage(hls_bytes=total, hls_segment_count=segment_count)
+
+
+def _remove_stale_hls_outputs(streams_dir, out_dir):
+    """Удаляет вывод предыдущих запусков HLS, кроме каталога out_dir."""
+    for entry in streams_dir.iterdir():
+        if entry == out_dir:
+            continue
+
+        try:
+            if entry.is_dir():
+                shutil.rmtree(entry)
+            else:
+                entry.unlink()
+        except OSError:
+            logger.exception("Не удалось удалить старый вывод HLS %s", entry)
+
+
+def _publish_to_rooms(video):
+    """
+    Комнаты с этим видео переходят на новый манифест: старый каталог
+    вывода уже удалён.
+    """
+    from rooms.media import publish_video
+
+    try:
+        publish_video(video)
+    except Exception:
+        logger.exception(
+            "[HLS Task] Не удалось обновить видео %s в комнатах",
+            video.pk,
+        )
+
+
 @shared_task(bind=True)
-def generate_hls(self, video_id):
+def generate_hls(self, video_id, force_transcode=False):
     """
     Генерация HLS с автоподбором параметров и обновлением прогресса.
+
+    force_transcode отключает copy-режим (пакетная переобработка
+    с новыми настройками кодирования).
     """
     logger.info(f"[HLS Task] Начало обработки видео {video_id}")
+    task_id = self.request.id
+    out_dir = None
 
     try:
         from upload.models import Video
@@ -291,20 +532,54 @@ def generate_hls(self, video_id):
             logger.error(f"[HLS Task] Видео {video_id} не найдено")
             return
 
-        raw_path = Path(video.file.path)
+        # Задача отменена или вытеснена более новой для того же видео
+        if is_hls_job_cancelled(task_id) or (
+            task_id and video.hls_task_id and video.hls_task_id != task_id
+        ):
+            logger.info(
+                "[HLS Task] Задача %s для видео %s устарела, пропускаем",
+                task_id,
+                video_id,
+            )
+            return
+
+        raw_path = Path(video.file.path) if video.file else None
+        from_source = bool(raw_path and raw_path.exists())
+        if not from_source and video.hls_manifest:
+            # Исходник удаляется после первой обработки, поэтому при
+            # переобработке входом служит уже готовый HLS-плейлист
+            raw_path = Path(video.hls_manifest.path)
+
         logger.info(f"[HLS Task] Путь файла: {raw_path}")
         logger.info(f"[HLS Task] Файл существует: {raw_path.exists()}")
 
         # Инициализация состояния
         video.hls_progress = 0
-        video.hls_status = "pending"
+        setattr(video, video.job_status_field, "pending")
         video.hls_log = ""
-        video.save(update_fields=["hls_progress", "hls_status", "hls_log"])
+        video.hls_task_id = task_id or ""
+        video.hls_pid = None
+        video.hls_worker = socket.gethostname()
+        video.hls_heartbeat = timezone.now()
+        video.save(
+            update_fields=[
+                "hls_progress",
+                video.job_status_field,
+                "hls_log",
+                "hls_task_id",
+                "hls_pid",
+                "hls_worker",
+                "hls_heartbeat",
+            ],
+        )
         logger.info("[HLS Task] Состояние инициализировано")
 
-        out_dir = Path(settings.MEDIA_ROOT) / "streams" / str(video.pk)
+        # Каждая задача пишет в свой каталог: отменённая задача может
+        # безопасно удалить свой частичный вывод, не задев новую
+        streams_dir = Path(settings.MEDIA_ROOT) / "streams" / str(video.pk)
+        out_dir = streams_dir / (task_id or uuid.uuid4().hex)
         out_dir.mkdir(parents=True, exist_ok=True)
-        logger.info("[HLS Task] Выходная директория: {out_dir}")
+        logger.info(f"[HLS Task] Выходная директория: {out_dir}")
 
         manifest_path = out_dir / "master.m3u8"
         segment_pattern = out_dir / "seg%d.ts"
@@ -341,6 +616,8 @@ def generate_hls(self, video_id):
 
         video_codec = v_stream.get("codec_name") if v_stream else None
         audio_codec = a_stream.get("codec_name") if a_stream else None
+        if from_source and video_codec:
+            Video.objects.filter(pk=video.pk).update(video_codec=video_codec)
         logger.info(
             f"[HLS Task] Видео кодек:\
                 {video_codec}, Аудио кодек: {audio_codec}",
@@ -373,10 +650,9 @@ def generate_hls(self, video_id):
                 phase_label,
                 duration_seconds,
             )
-            video.hls_status = phase_label
             try_update_video_progress(
                 video,
-                status=video.hls_status,
+                status=phase_label,
                 force=True,
             )
 
@@ -388,14 +664,31 @@ def generate_hls(self, video_id):
                 bufsize=1,
                 universal_newlines=False,
             )
+            Video.objects.filter(pk=video.pk).update(hls_pid=proc.pid)
 
             current_out_time = None
+            last_cancel_check = 0.0
             try:
                 while True:
                     chunk = proc.stdout.readline()
                     if not chunk:
                         break
 
+                    # ffmpeg пишет -progress раз в ~0.5с, так что проверка
+                    # токена раз в секунду останавливает его достаточно быстро
+                    now = time.monotonic()
+                    if now - last_cancel_check >= 1.0:
+                        last_cancel_check = now
+                        if is_hls_job_cancelled(task_id):
+                            proc.terminate()
+                            try:
+                                proc.wait(timeout=5)
+                            except subprocess.TimeoutExpired:
+                                proc.kill()
+                                proc.wait()
+
+                            raise HLSJobCancelledError(task_id)
+
                     # безопасное декодирование
                     try:
                         decoded = chunk.decode("utf-8", errors="replace")
@@ -453,7 +746,6 @@ def generate_hls(self, video_id):
                                 try_update_video_progress(
                                     video,
                                     progress=100,
-                                    status=video.hls_status,
                                     log_line=line,
                                     force=True,
                                 )
@@ -479,7 +771,6 @@ def generate_hls(self, video_id):
                                 try_update_video_progress(
                                     video,
                                     progress=percent,
-                                    status=video.hls_status,
                                     force=force_write,
                                 )
 
@@ -497,9 +788,12 @@ def generate_hls(self, video_id):
                 except Exception:
                     pass
 
+                Video.objects.filter(pk=video.pk).update(hls_pid=None)
+
         # --- copy path (если возможно) ---
         if (
-            video_codec == "h264"
+            not force_transcode
+            and video_codec == "h264"
             and audio_codec in ("aac", "mp4a")
             and input_fps >= 59.5
         ):
@@ -527,24 +821,38 @@ def generate_hls(self, video_id):
                 "-nostats",
             ]
             run_ffmpeg_with_progress(cmd, "copy", duration)
+            if is_hls_job_cancelled(task_id):
+                raise HLSJobCancelledError(task_id)
+
+            _remove_stale_hls_outputs(streams_dir, out_dir)
 
             rel = manifest_path.relative_to(settings.MEDIA_ROOT)
             video.hls_manifest.name = str(rel).replace("\\", "/")
+            video.hls_segment_index = _build_segment_index(manifest_path)
+            _record_hls_storage(video, out_dir)
+            # новый вывод на месте — только теперь меняется статус
             video.hls_status = "done"
+            video.reprocess_status = ""
+            # попытки считаются до успеха, следующий сбой начинает счёт заново
+            video.hls_attempts = 0
             try_update_video_progress(
                 video,
                 progress=100,
-                status="done",
                 force=True,
             )
             video.save(
                 update_fields=[
                     "hls_manifest",
+                    "hls_segment_index",
+                    "hls_renditions",
                     "hls_progress",
                     "hls_status",
+                    "reprocess_status",
+                    "hls_attempts",
                     "hls_log",
                 ],
             )
+            _publish_to_rooms(video)
             delete_video_file_delayed.delay(video.pk, delay=5)
             logger.info("[HLS Task] Запланировано удаление исходного файла")
             logger.info("[HLS Task] Обработка завершена (copy mode)")
@@ -659,25 +967,50 @@ def generate_hls(self, video_id):
         except Exception:
             logger.exception("Не удалось удалить временный файл %s", tmp_mp4)
 
+        if is_hls_job_cancelled(task_id):
+            raise HLSJobCancelledError(task_id)
+
+        _remove_stale_hls_outputs(streams_dir, out_dir)
+
         rel = manifest_path.relative_to(settings.MEDIA_ROOT)
         video.hls_manifest.name = str(rel).replace("\\", "/")
+        video.hls_segment_index = _build_segment_index(manifest_path)
+        _record_hls_storage(video, out_dir)
+        # новый вывод на месте — только теперь меняется статус
         video.hls_status = "done"
+        video.reprocess_status = ""
+        # попытки считаются до успеха, следующий сбой начинает счёт заново
+        video.hls_attempts = 0
         try_update_video_progress(
             video,
             progress=100,
-            status="done",
             force=True,
         )
         video.save(
             update_fields=[
                 "hls_manifest",
+                "hls_segment_index",
+                "hls_renditions",
                 "hls_progress",
                 "hls_status",
+                "reprocess_status",
+                "hls_attempts",
                 "hls_log",
             ],
         )
+        _publish_to_rooms(video)
         logger.info("[HLS Task] Обработка завершена успешно")
 
+    except HLSJobCancelledError:
+        logger.info(
+            "[HLS Task] Задача %s для видео %s отменена",
+            task_id,
+            video_id,
+        )
+        if out_dir is not None:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+        return
     except subprocess.CalledProcessError as cpe:
         logger.error(
             "[HLS Task] ffmpeg exited with error: %s",
@@ -685,7 +1018,6 @@ def generate_hls(self, video_id):
             exc_info=True,
         )
         try:
-            video.hls_status = "error"
             try_update_video_progress(
                 video,
                 status="error",
@@ -699,7 +1031,6 @@ def generate_hls(self, video_id):
     except Exception as e:
         logger.exception("[HLS Task] Ошибка: %s", e)
         try:
-            video.hls_status = "error"
             try_update_video_progress(
                 video,
                 status="error",
@@ -710,3 +1041,74 @@ def generate_hls(self, video_id):
             pass
 
         raise
+
+
+@shared_task
+def watch_stale_hls_jobs():
+    """
+    Периодический watchdog: находит задачи HLS без heartbeat'а
+    (например, воркер убит OOM) и перезапускает их или помечает ошибкой.
+    """
+    requeued = failed = 0
+    for video in find_stale_hls_jobs():
+        result = requeue_stale_hls_job(video)
+        if result == "requeued":
+            requeued += 1
+        elif result == "failed":
+            failed += 1
+
+    if requeued or failed:
+        logger.warning(
+            "[HLS Watchdog] Перезапущено: %s, помечено ошибкой: %s",
+            requeued,
+            failed,
+        )
+
+    return {"requeued": requeued, "failed": failed}
+
+
+@shared_task
+def schedule_reprocess_batches():
+    """
+    Периодически ставит в очередь следующую порцию видео активных пакетов
+    переобработки, не превышая rate_per_minute каждого пакета.
+    """
+    from upload.models import ReprocessBatch
+
+    enqueued = 0
+    for batch in ReprocessBatch.objects.filter(
+        status=ReprocessBatch.Status.RUNNING,
+    ):
+        enqueued += batch.enqueue_next()
+
+    return enqueued
+
+
+@shared_task
+def cleanup_stale_chunked_uploads():
+    """
+    Периодически удаляет брошенные загрузки по частям и их файлы,
+    возвращает число удалённых загрузок и освобождённые байты.
+    """
+    from upload.cleanup import cleanup_stale_chunked_uploads as cleanup
+
+    return cleanup()
+
+
+@shared_task
+def reconcile_upload_quotas():
+    """
+    Периодически сверяет счётчики квот в кеше с базой для пользователей,
+    у которых есть видео или загрузки.
+    """
+    from upload.models import UserChunkedUpload, UserStorage
+    from upload.quotas import reconcile_upload_usage
+
+    user_ids = set(UserStorage.objects.values_list("user_id", flat=True))
+    user_ids |= set(
+        UserChunkedUpload.objects.values_list("user_id", flat=True),
+    )
+    for user_id in user_ids:
+        reconcile_upload_usage(user_id)
+
+    return len(user_ids)
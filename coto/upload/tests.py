@@ -0,0 +1,1023 @@
+import base64
+from datetime import timedelta
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+import tempfile
+from unittest import mock
+
+from chunked_upload.constants import COMPLETE, UPLOADING
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from upload.cleanup import cleanup_stale_chunked_uploads
+from upload.direct import (
+    assemble_direct_upload_parts,
+    collect_direct_upload_parts,
+    direct_upload_dir,
+    issue_direct_upload_ticket,
+    TEMP_DIR,
+)
+from upload.hls_jobs import find_stale_hls_jobs, requeue_stale_hls_job
+from upload.models import (
+    merge_ranges,
+    Playlist,
+    PlaylistItem,
+    ReprocessBatch,
+    UploadQuota,
+    UserChunkedUpload,
+    UserStorage,
+    Video,
+)
+from upload.quotas import (
+    get_upload_usage,
+    reconcile_upload_usage,
+    refund_daily_upload,
+    release_upload,
+    reserve_upload,
+)
+from upload.tasks import assemble_direct_upload, schedule_reprocess_batches
+
+__all__ = []
+
+
+class MergeRangesTestCase(TestCase):
+    """Test merging of received [start, end) ranges"""
+
+    def test_empty(self):
+        self.assertEqual(merge_ranges([]), [])
+
+    def test_unordered_ranges_are_sorted(self):
+        self.assertEqual(
+            merge_ranges([[20, 30], [0, 10]]),
+            [[0, 10], [20, 30]],
+        )
+
+    def test_adjacent_ranges_are_joined(self):
+        self.assertEqual(merge_ranges([[10, 20], [0, 10]]), [[0, 20]])
+
+    def test_overlapping_ranges_are_joined(self):
+        self.assertEqual(
+            merge_ranges([[0, 15], [10, 20], [5, 8]]),
+            [[0, 20]],
+        )
+
+    def test_gaps_are_kept(self):
+        self.assertEqual(
+            merge_ranges([[0, 10], [30, 40], [10, 20]]),
+            [[0, 20], [30, 40]],
+        )
+
+
+class UserChunkedUploadRangesTestCase(TestCase):
+    """Test out-of-order chunk writes and the checksum built from them"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.user = User.objects.create_user("uploader", "u@example.com")
+        self.data = b"0123456789abcdefghij"
+        self.upload = UserChunkedUpload(
+            user=self.user,
+            filename="video.mp4",
+            total_size=len(self.data),
+        )
+        self.upload.file.save(
+            name=f"{self.upload.upload_id}.part",
+            content=ContentFile(b""),
+            save=True,
+        )
+        self.upload.preallocate()
+
+    def send(self, start, end):
+        checksum = self.upload.write_range(
+            ContentFile(self.data[start:end]),
+            start,
+        )
+        self.upload.mark_received(start, end, checksum)
+        return checksum
+
+    def test_chunks_written_out_of_order(self):
+        """Test chunks land at their offsets whatever the order"""
+        self.send(10, 20)
+        self.assertEqual(self.upload.missing_ranges, [[0, 10]])
+        self.assertFalse(self.upload.is_fully_received)
+
+        self.send(0, 10)
+        self.assertEqual(self.upload.received_ranges, [[0, 20]])
+        self.assertEqual(self.upload.offset, len(self.data))
+        self.assertTrue(self.upload.is_fully_received)
+        self.assertEqual(Path(self.upload.file.path).read_bytes(), self.data)
+
+    def test_write_range_returns_chunk_checksum(self):
+        checksum = self.upload.write_range(ContentFile(self.data[:10]), 0)
+        self.assertEqual(checksum, hashlib.md5(self.data[:10]).hexdigest())
+
+    def test_resent_chunk_replaces_checksum(self):
+        self.send(0, 10)
+        self.send(0, 10)
+        self.assertEqual(len(self.upload.chunk_checksums), 1)
+
+    def test_checksum_from_chunk_checksums(self):
+        """Test file checksum is the hash of chunk checksums in order"""
+        second = self.send(10, 20)
+        first = self.send(0, 10)
+        expected = hashlib.md5((first + second).encode()).hexdigest()
+        self.assertEqual(self.upload.get_checksum(), expected)
+
+    def test_checksum_requires_contiguous_chunks(self):
+        self.send(0, 10)
+        self.assertIsNone(self.upload.get_checksum())
+
+        self.send(5, 20)
+        self.assertIsNone(self.upload.get_checksum())
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    },
+)
+class DirectUploadPartsTestCase(TestCase):
+    """Test signed part layout of direct uploads and their assembly"""
+
+    def setUp(self):
+        root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        direct = override_settings(
+            MEDIA_ROOT=root / "media",
+            DIRECT_UPLOAD_ROOT=root / "direct",
+            DIRECT_UPLOAD_PART_SIZE=4,
+            DIRECT_UPLOAD_SECRET="secret",
+        )
+        direct.enable()
+        self.addCleanup(direct.disable)
+
+        self.user = User.objects.create_user("uploader", "u@example.com")
+        self.data = b"0123456789"
+        self.upload = UserChunkedUpload.objects.create(
+            user=self.user,
+            filename="video.mp4",
+            total_size=len(self.data),
+            direct=True,
+        )
+        self.ticket = issue_direct_upload_ticket(self.upload)
+
+    def put(self, start, end, data=None):
+        path = direct_upload_dir(self.upload.upload_id) / f"{start}-{end}"
+        path.write_bytes(self.data[start:end] if data is None else data)
+        return path
+
+    def test_ticket_signs_every_part(self):
+        self.assertEqual(self.ticket["part_size"], 4)
+        self.assertEqual(len(self.ticket["signatures"]), 3)
+
+        raw = f"{self.ticket['expires']}{self.upload.upload_id}/8-10 secret"
+        digest = hashlib.md5(raw.encode()).digest()
+        self.assertEqual(
+            self.ticket["signatures"][2],
+            base64.urlsafe_b64encode(digest).rstrip(b"=").decode(),
+        )
+
+    def test_parts_outside_layout_are_removed(self):
+        for start, end in ((4, 8), (0, 4), (8, 10)):
+            self.put(start, end)
+
+        outside = [
+            self.put(8, 12, b"89ab"),
+            self.put(20, 24, b"xxxx"),
+            self.put(0, 2, b"01"),
+        ]
+
+        parts = collect_direct_upload_parts(self.upload)
+        self.assertEqual(
+            [(start, end) for start, end, _path in parts],
+            [(0, 4), (4, 8), (8, 10)],
+        )
+        for path in outside:
+            self.assertFalse(path.exists())
+
+    def test_short_part_is_skipped(self):
+        self.put(0, 4, b"01")
+        self.assertEqual(collect_direct_upload_parts(self.upload), [])
+
+    def test_assemble(self):
+        for start, end in ((8, 10), (0, 4), (4, 8)):
+            self.put(start, end)
+
+        target = direct_upload_dir(self.upload.upload_id).parent / "out.mp4"
+        assemble_direct_upload_parts(
+            collect_direct_upload_parts(self.upload),
+            target,
+            len(self.data),
+        )
+        self.assertEqual(target.read_bytes(), self.data)
+
+    def checksum(self):
+        digests = "".join(
+            hashlib.md5(self.data[start:end]).hexdigest()
+            for start, end in ((0, 4), (4, 8), (8, 10))
+        )
+        return hashlib.md5(digests.encode()).hexdigest()
+
+    def assemble(self, checksum):
+        video = Video(title="Video", uploaded_by=self.user)
+        video.save(_skip_tasks=True)
+        with mock.patch("upload.tasks.extract_video_metadata.delay"):
+            with mock.patch("upload.hls_jobs.start_hls_job"):
+                assemble_direct_upload.apply(
+                    args=(self.upload.upload_id, video.pk, checksum),
+                )
+
+        video.refresh_from_db()
+        return video
+
+    def test_assembled_upload_becomes_video_file(self):
+        for start, end in ((0, 4), (4, 8), (8, 10)):
+            self.put(start, end)
+
+        video = self.assemble(self.checksum())
+        self.assertEqual(Path(video.file.path).read_bytes(), self.data)
+        self.assertFalse(direct_upload_dir(self.upload.upload_id).exists())
+
+    def test_checksum_mismatch_fails_video(self):
+        self.put(0, 4)
+        self.put(4, 8, b"xxxx")
+        self.put(8, 10)
+
+        video = self.assemble(self.checksum())
+        self.assertEqual(video.hls_status, "error")
+        self.assertFalse(video.file)
+        self.assertFalse(direct_upload_dir(self.upload.upload_id).exists())
+
+
+@override_settings(ROOT_URLCONF="upload.user_chunked_urls")
+class ChunkedViewsIgnoreDirectUploadsTestCase(TestCase):
+    """Test direct uploads never reach the chunked upload views"""
+
+    def setUp(self):
+        self.user = User.objects.create_user("uploader", "u@example.com")
+        self.client.force_login(self.user)
+        self.upload = UserChunkedUpload.objects.create(
+            user=self.user,
+            filename="video.mp4",
+            total_size=10,
+            direct=True,
+        )
+
+    def test_chunk(self):
+        response = self.client.post(
+            reverse("user_chunked_upload_start"),
+            {
+                "upload_id": self.upload.upload_id,
+                "file": SimpleUploadedFile("video.mp4", b"0123456789"),
+            },
+            HTTP_CONTENT_RANGE="bytes 0-9/10",
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_complete(self):
+        response = self.client.post(
+            reverse("user_chunked_upload_complete"),
+            {"upload_id": self.upload.upload_id, "title": "Video"},
+        )
+        self.assertEqual(response.status_code, 404)
+        self.upload.refresh_from_db()
+        self.assertEqual(self.upload.status, UPLOADING)
+
+
+class PlaylistMixin:
+    """Playlist of the test user with helpers to fill and read it"""
+
+    def setUp(self):
+        self.user = User.objects.create_user("owner", "o@example.com")
+        self.playlist = Playlist.objects.create(
+            title="Series",
+            created_by=self.user,
+        )
+
+    def add_item(self, episode, order):
+        video = Video(title=f"Episode {episode}", uploaded_by=self.user)
+        video.save(_skip_tasks=True)
+        return PlaylistItem.objects.create(
+            playlist=self.playlist,
+            video=video,
+            episode_number=episode,
+            order=order,
+        )
+
+    def ordered_episodes(self):
+        return list(
+            self.playlist.items.order_by("order").values_list(
+                "episode_number",
+                flat=True,
+            ),
+        )
+
+
+class PlaylistItemOrderTestCase(PlaylistMixin, TestCase):
+    """Test sparse ranks of playlist items"""
+
+    def test_rank_between(self):
+        step = PlaylistItem.ORDER_STEP
+        self.assertEqual(PlaylistItem.rank_between(None, None), step)
+        self.assertEqual(PlaylistItem.rank_between(step, None), 2 * step)
+        self.assertEqual(PlaylistItem.rank_between(step, 2 * step), 1536)
+        self.assertEqual(PlaylistItem.rank_between(None, 2), 1)
+        self.assertIsNone(PlaylistItem.rank_between(5, 6))
+
+    def test_move_changes_only_the_moved_row(self):
+        first, second, third = (
+            self.add_item(episode, episode * PlaylistItem.ORDER_STEP)
+            for episode in (1, 2, 3)
+        )
+        rebalanced = third.move(before=first)
+        self.assertFalse(rebalanced)
+        self.assertEqual(self.ordered_episodes(), [3, 1, 2])
+        second.refresh_from_db()
+        self.assertEqual(second.order, 2 * PlaylistItem.ORDER_STEP)
+
+        first.move(after=second)
+        self.assertEqual(self.ordered_episodes(), [3, 2, 1])
+
+    def test_move_rebalances_without_room(self):
+        first = self.add_item(1, 1)
+        self.add_item(2, 2)
+        third = self.add_item(3, 3)
+        self.assertTrue(third.move(after=first))
+        self.assertEqual(self.ordered_episodes(), [1, 3, 2])
+        self.assertEqual(
+            sorted(self.playlist.items.values_list("order", flat=True)),
+            [1024, 1536, 2048],
+        )
+
+    def test_plan_ranks(self):
+        self.add_item(1, PlaylistItem.ORDER_STEP)
+        self.add_item(2, 2 * PlaylistItem.ORDER_STEP)
+        self.assertEqual(
+            PlaylistItem.plan_ranks(self.playlist.pk, [1, None]),
+            [512, 3072],
+        )
+
+    def test_plan_ranks_rebalances_without_room(self):
+        self.add_item(1, 1)
+        self.add_item(2, 2)
+        ranks = PlaylistItem.plan_ranks(self.playlist.pk, [2])
+        self.assertEqual(ranks, [1536])
+        self.assertEqual(
+            list(
+                self.playlist.items.order_by("order").values_list(
+                    "order",
+                    flat=True,
+                ),
+            ),
+            [1024, 2048],
+        )
+
+
+@override_settings(ROOT_URLCONF="upload.user_chunked_urls")
+class UpdatePlaylistOrderMoveTestCase(PlaylistMixin, TestCase):
+    """Test single-item moves through the playlist order view"""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        self.first, self.second = (
+            self.add_item(episode, episode * PlaylistItem.ORDER_STEP)
+            for episode in (1, 2)
+        )
+
+    def post_move(self, **move):
+        return self.client.post(
+            reverse("update_playlist_order"),
+            {"playlist_id": self.playlist.pk, "move": move},
+            content_type="application/json",
+        )
+
+    def test_move(self):
+        response = self.post_move(item=self.second.pk, before=self.first.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.ordered_episodes(), [2, 1])
+
+    def test_move_next_to_itself(self):
+        response = self.post_move(item=self.first.pk, after=self.first.pk)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.ordered_episodes(), [1, 2])
+
+    def test_unknown_item(self):
+        other = Playlist.objects.create(title="Other", created_by=self.user)
+        foreign = PlaylistItem.objects.create(
+            playlist=other,
+            video=self.first.video,
+            order=PlaylistItem.ORDER_STEP,
+        )
+        for move in (
+            {"item": 0, "before": self.first.pk},
+            {"item": self.first.pk, "after": foreign.pk},
+        ):
+            with self.subTest(move=move):
+                self.assertEqual(self.post_move(**move).status_code, 404)
+
+    def test_malformed_ids(self):
+        for move in (
+            {"before": self.first.pk},
+            {"item": "first", "before": self.second.pk},
+            {"item": self.first.pk},
+        ):
+            with self.subTest(move=move):
+                self.assertEqual(self.post_move(**move).status_code, 400)
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    },
+    UPLOAD_QUOTA_BYTES=1000,
+    UPLOAD_QUOTA_CONCURRENT=2,
+    UPLOAD_QUOTA_PER_DAY=3,
+    UPLOAD_QUOTA_TRANSCODE_MINUTES=60,
+)
+class UploadQuotaTestCase(TestCase):
+    """Test upload quota counters kept in the cache"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("uploader", "u@example.com")
+
+    def usage(self, name):
+        return get_upload_usage(self.user.pk)[name]
+
+    def test_reserve_and_release(self):
+        reserve_upload(self.user, 100)
+        self.assertEqual(self.usage("active"), 1)
+        self.assertEqual(self.usage("uploads_today"), 1)
+
+        release_upload(self.user.pk)
+        self.assertEqual(self.usage("active"), 0)
+        self.assertEqual(self.usage("uploads_today"), 1)
+
+    def test_concurrent_limit_rolls_back(self):
+        reserve_upload(self.user, 100)
+        reserve_upload(self.user, 100)
+        with self.assertRaises(PermissionDenied):
+            reserve_upload(self.user, 100)
+
+        self.assertEqual(self.usage("active"), 2)
+        self.assertEqual(self.usage("uploads_today"), 2)
+
+    def test_daily_limit_rolls_back(self):
+        for _upload in range(3):
+            reserve_upload(self.user, 100)
+            release_upload(self.user.pk)
+
+        with self.assertRaises(PermissionDenied):
+            reserve_upload(self.user, 100)
+
+        self.assertEqual(self.usage("active"), 0)
+        self.assertEqual(self.usage("uploads_today"), 3)
+
+        refund_daily_upload(self.user.pk)
+        reserve_upload(self.user, 100)
+
+    def test_storage_limit(self):
+        UserStorage.add(self.user.pk, source_bytes=950)
+        with self.assertRaises(PermissionDenied):
+            reserve_upload(self.user, 100)
+
+        reserve_upload(self.user, 50)
+
+    def test_uploads_in_flight_take_storage(self):
+        reserve_upload(self.user, 600)
+        with self.assertRaises(PermissionDenied):
+            reserve_upload(self.user, 600)
+
+        self.assertEqual(self.usage("reserved_bytes"), 600)
+        self.assertEqual(self.usage("active"), 1)
+
+        release_upload(self.user.pk, 600)
+        self.assertEqual(self.usage("reserved_bytes"), 0)
+        reserve_upload(self.user, 600)
+
+    def test_individual_quota(self):
+        UploadQuota.objects.create(user=self.user, max_concurrent_uploads=0)
+        for _upload in range(3):
+            reserve_upload(self.user, 100)
+
+        self.assertEqual(self.usage("active"), 3)
+
+    def test_staff_is_not_limited(self):
+        self.user.is_staff = True
+        reserve_upload(self.user, 10**6)
+        self.assertEqual(self.usage("active"), 0)
+
+    def test_release_without_counter(self):
+        release_upload(self.user.pk)
+        cache.clear()
+        release_upload(self.user.pk)
+        self.assertEqual(self.usage("active"), 0)
+
+    def test_reconcile_from_database(self):
+        UserChunkedUpload.objects.create(
+            user=self.user,
+            filename="a.mp4",
+            total_size=10,
+        )
+        UserChunkedUpload.objects.create(
+            user=self.user,
+            filename="b.mp4",
+            total_size=10,
+            status=COMPLETE,
+        )
+        UserStorage.add(self.user.pk, hls_bytes=300)
+        cache.clear()
+
+        usage = get_upload_usage(self.user.pk)
+        self.assertEqual(usage["active"], 1)
+        self.assertEqual(usage["reserved_bytes"], 10)
+        self.assertEqual(usage["uploads_today"], 2)
+        self.assertEqual(usage["bytes"], 300)
+
+        # a lost counter is restored before it is changed
+        cache.delete(f"upload_quota_{self.user.pk}_active")
+        reserve_upload(self.user, 100)
+        self.assertEqual(self.usage("active"), 2)
+        self.assertEqual(reconcile_upload_usage(self.user.pk)["active"], 1)
+
+
+@override_settings(
+    HLS_STALE_AFTER=timedelta(minutes=10),
+    HLS_QUEUED_STALE_AFTER=timedelta(hours=6),
+    HLS_MAX_ATTEMPTS=3,
+    HLS_REPROCESS_PRIORITY=9,
+)
+class HLSWatchdogTestCase(TestCase):
+    """Test stale and lost HLS jobs are found and requeued"""
+
+    def setUp(self):
+        self.user = User.objects.create_user("uploader", "u@example.com")
+        for target in ("cancel_hls_job", "start_hls_job"):
+            patcher = mock.patch(f"upload.hls_jobs.{target}")
+            setattr(self, target, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def add_video(self, heartbeat_age=None, **fields):
+        video = Video(title="Video", uploaded_by=self.user, **fields)
+        if heartbeat_age is not None:
+            video.hls_heartbeat = timezone.now() - heartbeat_age
+
+        video.save(_skip_tasks=True)
+        return video
+
+    def stale_pks(self):
+        return sorted(video.pk for video in find_stale_hls_jobs())
+
+    def test_stale_running_job(self):
+        stale = self.add_video(timedelta(minutes=11), hls_status="transcode")
+        self.add_video(timedelta(minutes=1), hls_status="transcode")
+        self.assertEqual(self.stale_pks(), [stale.pk])
+
+    def test_lost_queued_job(self):
+        lost = self.add_video(timedelta(hours=7))
+        self.add_video(timedelta(hours=1))
+        # saved without a job yet, e.g. waiting for direct upload assembly
+        self.add_video()
+        self.assertEqual(self.stale_pks(), [lost.pk])
+
+        self.assertEqual(
+            requeue_stale_hls_job(find_stale_hls_jobs().get()),
+            "requeued",
+        )
+        self.start_hls_job.assert_called_once_with(mock.ANY)
+
+    def test_reprocess_is_requeued_as_reprocess(self):
+        video = self.add_video(
+            timedelta(minutes=11),
+            hls_status="done",
+            reprocess_status="transcode",
+        )
+        self.assertEqual(
+            requeue_stale_hls_job(find_stale_hls_jobs().get()),
+            "requeued",
+        )
+        self.start_hls_job.assert_called_once_with(
+            mock.ANY,
+            priority=9,
+            force_transcode=True,
+        )
+        video.refresh_from_db()
+        self.assertEqual(video.hls_status, "done")
+        self.assertEqual(video.reprocess_status, "awaiting processing")
+        self.assertEqual(video.hls_attempts, 1)
+
+    def test_exhausted_job_fails(self):
+        video = self.add_video(
+            timedelta(minutes=11),
+            hls_status="transcode",
+            hls_attempts=3,
+        )
+        self.assertEqual(
+            requeue_stale_hls_job(find_stale_hls_jobs().get()),
+            "failed",
+        )
+        self.start_hls_job.assert_not_called()
+        video.refresh_from_db()
+        self.assertEqual(video.hls_status, "error")
+
+
+class SlowUploadsFilterTestCase(TestCase):
+    """Test the admin list of the slowest recent chunked uploads"""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser("admin", "a@example.com")
+        self.client.force_login(self.admin)
+        self.uploads = {
+            name: UserChunkedUpload.objects.create(
+                user=self.admin,
+                filename=f"{name}.mp4",
+                total_size=10,
+                **fields,
+            )
+            for name, fields in {
+                "slow": {"chunk_count": 2, "throughput": 100},
+                "fast": {"chunk_count": 2, "throughput": 1000},
+                "direct": {"direct": True},
+                "no_chunks": {},
+                "old": {"chunk_count": 2, "throughput": 10},
+            }.items()
+        }
+        UserChunkedUpload.objects.filter(pk=self.uploads["old"].pk).update(
+            updated_on=timezone.now() - timedelta(days=2),
+        )
+
+    def changelist(self, **params):
+        response = self.client.get(
+            reverse("admin:upload_userchunkedupload_changelist"),
+            params,
+        )
+        self.assertEqual(response.status_code, 200)
+        return [
+            upload.filename for upload in response.context["cl"].result_list
+        ]
+
+    def test_newest_first_by_default(self):
+        self.assertEqual(
+            self.changelist(),
+            ["old.mp4", "no_chunks.mp4", "direct.mp4", "fast.mp4", "slow.mp4"],
+        )
+
+    def test_slowest_recent(self):
+        self.assertEqual(
+            self.changelist(slowest="day"),
+            ["slow.mp4", "fast.mp4"],
+        )
+        self.assertEqual(
+            self.changelist(slowest="week"),
+            ["old.mp4", "slow.mp4", "fast.mp4"],
+        )
+
+
+@override_settings(HLS_REPROCESS_PRIORITY=9)
+class ReprocessBatchTestCase(TestCase):
+    """Test reprocess batches enqueue their videos at the batch rate"""
+
+    def setUp(self):
+        self.user = User.objects.create_user("admin", "a@example.com")
+        patcher = mock.patch("upload.hls_jobs.start_hls_job")
+        self.start_hls_job = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.videos = []
+        for hls_status in ("done", "transcode", "done", "error"):
+            video = Video(
+                title="Video",
+                uploaded_by=self.user,
+                hls_status=hls_status,
+            )
+            video.save(_skip_tasks=True)
+            self.videos.append(video)
+
+    def add_batch(self, **fields):
+        return ReprocessBatch.objects.create(
+            filters={"ids": [video.pk for video in self.videos]},
+            rate_per_minute=2,
+            total=len(self.videos),
+            **fields,
+        )
+
+    def enqueue_next(self, batch):
+        with self.captureOnCommitCallbacks(execute=True):
+            return batch.enqueue_next()
+
+    def started(self):
+        return [call.args[0].pk for call in self.start_hls_job.call_args_list]
+
+    def test_enqueues_a_portion(self):
+        batch = self.add_batch()
+        # the running video is skipped but counts against the rate
+        self.assertEqual(self.enqueue_next(batch), 1)
+        self.assertEqual(self.started(), [self.videos[0].pk])
+        self.start_hls_job.assert_called_once_with(
+            mock.ANY,
+            priority=9,
+            force_transcode=True,
+        )
+        self.assertEqual(batch.enqueued, 1)
+        self.assertEqual(batch.last_video_id, self.videos[1].pk)
+
+        done, running = Video.objects.filter(
+            pk__in=[self.videos[0].pk, self.videos[1].pk],
+        ).order_by("pk")
+        self.assertEqual(done.hls_status, "done")
+        self.assertEqual(done.reprocess_status, "awaiting processing")
+        self.assertEqual(done.reprocess_batch, batch)
+        self.assertIsNone(running.reprocess_batch)
+
+    def test_finishes_when_nothing_is_left(self):
+        batch = self.add_batch()
+        self.enqueue_next(batch)
+        self.assertEqual(self.enqueue_next(batch), 2)
+        self.assertEqual(
+            Video.objects.get(pk=self.videos[3].pk).hls_status,
+            "awaiting processing",
+        )
+        self.assertEqual(self.enqueue_next(batch), 0)
+        self.assertEqual(batch.status, ReprocessBatch.Status.FINISHED)
+        self.assertEqual(batch.enqueued, 3)
+
+    def test_paused_and_cancelled_batches_wait(self):
+        for status in (
+            ReprocessBatch.Status.PAUSED,
+            ReprocessBatch.Status.CANCELLED,
+        ):
+            with self.subTest(status=status):
+                batch = self.add_batch(status=status)
+                self.assertEqual(self.enqueue_next(batch), 0)
+                self.assertEqual(batch.last_video_id, 0)
+
+        self.start_hls_job.assert_not_called()
+
+    def test_resumed_batch_continues(self):
+        batch = self.add_batch()
+        self.enqueue_next(batch)
+        ReprocessBatch.objects.filter(pk=batch.pk).update(
+            status=ReprocessBatch.Status.PAUSED,
+        )
+        self.assertEqual(self.enqueue_next(batch), 0)
+
+        ReprocessBatch.objects.filter(pk=batch.pk).update(
+            status=ReprocessBatch.Status.RUNNING,
+        )
+        self.enqueue_next(batch)
+        self.assertEqual(
+            self.started(),
+            [self.videos[0].pk, self.videos[2].pk, self.videos[3].pk],
+        )
+
+    def test_schedule_runs_only_running_batches(self):
+        self.add_batch()
+        self.add_batch(status=ReprocessBatch.Status.PAUSED)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(schedule_reprocess_batches(), 1)
+        self.assertEqual(self.started(), [self.videos[0].pk])
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    },
+    ROOT_URLCONF="upload.user_chunked_urls",
+)
+class BatchCompleteTestCase(TestCase):
+    """Test a batch of uploads completed into a playlist in one request"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+        patcher = mock.patch("upload.user_chunked_views.group")
+        self.group = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.user = User.objects.create_user("uploader", "u@example.com")
+        self.client.force_login(self.user)
+        self.uploads = [
+            self.add_upload(f"episode{n}.mp4", f"episode {n}".encode())
+            for n in (1, 2)
+        ]
+
+    def add_upload(self, filename, data):
+        upload = UserChunkedUpload(
+            user=self.user,
+            filename=filename,
+            total_size=len(data),
+        )
+        upload.file.save(
+            name=f"{upload.upload_id}.part",
+            content=ContentFile(b""),
+            save=True,
+        )
+        upload.preallocate()
+        checksum = upload.write_range(ContentFile(data), 0)
+        upload.mark_received(0, len(data), checksum)
+        return upload
+
+    def post_batch(self, **entry_fields):
+        manifest = {
+            "playlist_title": "Series",
+            "uploads": [
+                {
+                    "upload_id": upload.upload_id,
+                    "checksum": upload.get_checksum(),
+                    "title": f"Episode {n}",
+                    "episode_number": n,
+                    **entry_fields,
+                }
+                for n, upload in enumerate(self.uploads, 1)
+            ],
+        }
+        return self.client.post(
+            reverse("user_chunked_upload_complete_batch"),
+            {"manifest": json.dumps(manifest)},
+        )
+
+    def test_files_move_after_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.post_batch()
+
+        self.assertEqual(response.status_code, 200)
+        items = Playlist.objects.get(title="Series").items.order_by("order")
+        self.assertEqual(
+            list(items.values_list("video__title", "episode_number")),
+            [("Episode 1", 1), ("Episode 2", 2)],
+        )
+        self.assertEqual(
+            set(UserChunkedUpload.objects.values_list("status", flat=True)),
+            {COMPLETE},
+        )
+        # nothing is moved or queued until the transaction commits
+        self.assertFalse(Video.objects.exclude(file="").exists())
+        self.group.assert_not_called()
+        for upload in self.uploads:
+            self.assertTrue(Path(upload.file.path).exists())
+
+        for callback in callbacks:
+            callback()
+
+        for upload, video in zip(
+            self.uploads,
+            Video.objects.order_by("pk"),
+        ):
+            self.assertFalse(Path(upload.file.path).exists())
+            self.assertEqual(
+                Path(video.file.path).read_bytes(),
+                f"episode {video.title[-1]}".encode(),
+            )
+        self.group.return_value.apply_async.assert_called_once_with()
+
+    def test_failed_entry_rolls_back_batch(self):
+        """Test a bad entry found after the playlist was made undoes it"""
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.post_batch(season_number="first")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(callbacks, [])
+        self.assertFalse(Playlist.objects.exists())
+        self.assertFalse(Video.objects.exists())
+        self.assertEqual(
+            set(UserChunkedUpload.objects.values_list("status", flat=True)),
+            {UPLOADING},
+        )
+
+    def test_unknown_upload(self):
+        self.uploads[1].delete()
+        response = self.post_batch()
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(
+            response.json()["upload_ids"],
+            [self.uploads[1].upload_id],
+        )
+        self.assertFalse(Video.objects.exists())
+
+
+@override_settings(
+    CACHES={
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    },
+)
+class OrphanSweepTestCase(TestCase):
+    """Test files left without an upload row are removed once old"""
+
+    def setUp(self):
+        self.media_root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(
+            MEDIA_ROOT=self.media_root,
+            DIRECT_UPLOAD_ROOT=self.media_root / "direct_uploads",
+        )
+        media.enable()
+        self.addCleanup(media.disable)
+
+        self.user = User.objects.create_user("uploader", "u@example.com")
+        self.chunked_root = self.media_root / "chunked_uploads" / "2024"
+        self.old = (timezone.now() - timedelta(days=1)).timestamp()
+
+    def add_file(self, path, old=True):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"0123456789")
+        if old:
+            os.utime(path, (self.old, self.old))
+            os.utime(path.parent, (self.old, self.old))
+
+        return path
+
+    def sweep(self, dry_run=False):
+        return cleanup_stale_chunked_uploads(
+            older_than=timedelta(hours=1),
+            dry_run=dry_run,
+        )
+
+    def test_old_orphans_are_removed(self):
+        orphan = self.add_file(self.chunked_root / "01" / "lost.part")
+        direct = self.add_file(
+            self.media_root / "direct_uploads" / "lost" / "0-9",
+        )
+        self.assertEqual(
+            self.sweep(),
+            {"uploads": 0, "orphans": 2, "bytes": 20},
+        )
+        self.assertFalse(orphan.exists())
+        self.assertFalse(direct.parent.exists())
+
+    def test_old_empty_directories_are_removed(self):
+        empty, fresh = self.chunked_root / "01", self.chunked_root / "02"
+        for path in (empty, fresh):
+            path.mkdir(parents=True)
+        os.utime(empty, (self.old, self.old))
+
+        self.sweep()
+        self.assertFalse(empty.exists())
+        self.assertTrue(fresh.exists())
+
+    def test_recent_files_are_kept(self):
+        """Test the mtime guard, for a directory by its newest file"""
+        fresh = self.add_file(self.chunked_root / "01" / "fresh.part", False)
+        parts = self.media_root / "direct_uploads" / "writing"
+        self.add_file(parts / "0-9")
+        self.add_file(parts / "10-19", False)
+
+        self.assertEqual(self.sweep()["orphans"], 0)
+        self.assertTrue(fresh.exists())
+        self.assertTrue((parts / "0-9").exists())
+
+    def test_known_files_are_kept(self):
+        upload = UserChunkedUpload(
+            user=self.user,
+            filename="video.mp4",
+            total_size=10,
+        )
+        upload.file.save(
+            name=f"{upload.upload_id}.part",
+            content=ContentFile(b"0123456789"),
+            save=True,
+        )
+        self.add_file(Path(upload.file.path))
+        direct = UserChunkedUpload.objects.create(
+            user=self.user,
+            filename="video.mp4",
+            total_size=10,
+            direct=True,
+        )
+        part = self.add_file(direct_upload_dir(direct.upload_id) / "0-9")
+        temp = self.add_file(direct_upload_dir(TEMP_DIR) / "0-9")
+
+        self.assertEqual(self.sweep()["orphans"], 0)
+        for path in (Path(upload.file.path), part, temp):
+            self.assertTrue(path.exists())
+
+    def test_dry_run_only_counts(self):
+        orphan = self.add_file(self.chunked_root / "01" / "lost.part")
+        self.assertEqual(self.sweep(dry_run=True)["orphans"], 1)
+        self.assertTrue(orphan.exists())
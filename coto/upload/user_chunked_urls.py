@@ -1,10 +1,14 @@
 from django.urls import path
 
 from upload.user_chunked_views import (
+    DirectUploadCompleteView,
+    DirectUploadStartView,
     PlaylistVideosView,
     UpdatePlaylistOrderView,
     UpdateVideoMetadataView,
+    UserChunkedUploadBatchCompleteView,
     UserChunkedUploadCompleteView,
+    UserChunkedUploadResumeView,
     UserChunkedUploadView,
     UserUploadPageView,
 )
@@ -25,6 +29,26 @@ urlpatterns = [
         UserChunkedUploadCompleteView.as_view(),
         name="user_chunked_upload_complete",
     ),
+    path(
+        "chunked/complete-batch/",
+        UserChunkedUploadBatchCompleteView.as_view(),
+        name="user_chunked_upload_complete_batch",
+    ),
+    path(
+        "chunked/resume/",
+        UserChunkedUploadResumeView.as_view(),
+        name="user_chunked_upload_resume",
+    ),
+    path(
+        "direct/start/",
+        DirectUploadStartView.as_view(),
+        name="direct_upload_start",
+    ),
+    path(
+        "direct/complete/",
+        DirectUploadCompleteView.as_view(),
+        name="direct_upload_complete",
+    ),
     path(
         "playlist/<int:playlist_id>/videos/",
         PlaylistVideosView.as_view(),
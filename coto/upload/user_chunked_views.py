@@ -1,30 +1,67 @@
 import json
+import logging
 from pathlib import Path
+import time
 
+from celery import group
+from chunked_upload.constants import COMPLETE, http_status, UPLOADING
+from chunked_upload.exceptions import ChunkedUploadError
+from chunked_upload.response import Response
 from chunked_upload.views import ChunkedUploadCompleteView, ChunkedUploadView
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.files.base import ContentFile
 from django.db import transaction
 from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
 from django.views.generic import TemplateView
 
-from upload.models import Playlist, PlaylistItem, Video
+from upload.direct import (
+    collect_direct_upload_parts,
+    issue_direct_upload_ticket,
+)
+from upload.files import finalize_chunked_upload
+from upload.hls_jobs import hls_job_signature
+from upload.metrics import (
+    log_chunk_metrics,
+    log_completion_metrics,
+    measure,
+    received_seconds,
+)
+from upload.models import (
+    CHECKSUM_ALGORITHMS,
+    merge_ranges,
+    Playlist,
+    PlaylistItem,
+    UserChunkedUpload,
+    Video,
+)
 from upload.permissions import (
     check_user_can_upload,
     check_user_owns_playlist,
     validate_file_size,
     validate_video_extension,
 )
+from upload.quotas import release_upload, reserve_upload
+from upload.tasks import assemble_direct_upload, extract_video_metadata
 
 __all__ = [
+    "DirectUploadCompleteView",
+    "DirectUploadStartView",
+    "UserChunkedUploadBatchCompleteView",
     "UserChunkedUploadView",
     "UserChunkedUploadCompleteView",
+    "UserChunkedUploadResumeView",
     "UserUploadPageView",
 ]
 
+logger = logging.getLogger(__name__)
+
 
 @method_decorator(ensure_csrf_cookie, name="dispatch")
 class UserChunkedUploadView(
@@ -34,15 +71,199 @@ class UserChunkedUploadView(
     """
     Chunked upload для обычных пользователей.
     Принимает чанки видеофайлов.
+
+    В отличие от базового представления, чанки не обязаны идти по
+    порядку: каждый несёт свой диапазон в Content-Range и пишется в
+    заранее выделенный файл по своему смещению, поэтому клиент может
+    отправлять несколько чанков параллельно. Первый чанк (без upload_id)
+    создаёт загрузку, остальные можно слать одновременно.
     """
 
+    model = UserChunkedUpload
     field_name = "file"
+    fail_if_no_header = False
+
+    def get_queryset(self, request):
+        # у прямой загрузки нет файла: её чанки принимает nginx
+        return super().get_queryset(request).filter(direct=False)
 
     def check_permissions(self, request):
         """Проверка прав доступа."""
         super().check_permissions(request)
         check_user_can_upload(request.user)
 
+    def create_chunked_upload(self, save=False, **attrs):
+        chunked_upload = self.model(**attrs)
+        # файл называем по upload_id: имя на диске не зависит от имени
+        # исходного файла и не бывает пустым
+        chunked_upload.file.save(
+            name=f"{chunked_upload.upload_id}.part",
+            content=ContentFile(b""),
+            save=save,
+        )
+        return chunked_upload
+
+    def get_chunk_range(self, request, chunk):
+        """Диапазон чанка [start, end) и полный размер файла."""
+        content_range = request.META.get(self.content_range_header, "")
+        match = self.content_range_pattern.match(content_range)
+        if not match and self.fail_if_no_header:
+            raise ChunkedUploadError(
+                status=http_status.HTTP_400_BAD_REQUEST,
+                detail="Error in request headers",
+            )
+
+        if match:
+            start = int(match.group("start"))
+            end = int(match.group("end")) + 1
+            total = int(match.group("total"))
+        else:
+            start, end, total = 0, chunk.size, chunk.size
+
+        if end > total or (start >= end and total):
+            raise ChunkedUploadError(
+                status=http_status.HTTP_400_BAD_REQUEST,
+                detail="Invalid Content-Range",
+            )
+
+        if chunk.size != end - start:
+            raise ChunkedUploadError(
+                status=http_status.HTTP_400_BAD_REQUEST,
+                detail="File size doesn't match headers",
+            )
+
+        return start, end, total
+
+    def get_response_data(self, chunked_upload, request):
+        data = super().get_response_data(chunked_upload, request)
+        data["total"] = chunked_upload.total_size
+        data["ranges"] = chunked_upload.received_ranges
+        data["algorithm"] = chunked_upload.checksum_algorithm
+        return data
+
+    def _post(self, request, *args, **kwargs):
+        timings = {"receive": received_seconds(request)}
+        chunk = request.FILES.get(self.field_name)
+        if chunk is None:
+            raise ChunkedUploadError(
+                status=http_status.HTTP_400_BAD_REQUEST,
+                detail="No chunk file was submitted",
+            )
+
+        self.validate(request)
+        start, end, total = self.get_chunk_range(request, chunk)
+        try:
+            validate_file_size(total)
+        except ValueError as e:
+            raise ChunkedUploadError(
+                status=http_status.HTTP_400_BAD_REQUEST,
+                detail=str(e),
+            )
+
+        upload_id = request.POST.get("upload_id")
+        algorithm = request.POST.get(
+            "algorithm",
+            settings.CHUNKED_UPLOAD_CHECKSUM_ALGORITHM,
+        )
+        if algorithm not in CHECKSUM_ALGORITHMS:
+            raise ChunkedUploadError(
+                status=http_status.HTTP_400_BAD_REQUEST,
+                detail="Unsupported checksum algorithm",
+                supported=sorted(CHECKSUM_ALGORITHMS),
+            )
+
+        if upload_id:
+            chunked_upload = get_object_or_404(
+                self.get_queryset(request),
+                upload_id=upload_id,
+            )
+            self.is_valid_chunked_upload(chunked_upload)
+            if chunked_upload.total_size != total:
+                raise ChunkedUploadError(
+                    status=http_status.HTTP_400_BAD_REQUEST,
+                    detail="Total size doesn't match the upload",
+                )
+        else:
+            try:
+                reserve_upload(request.user, total)
+            except PermissionDenied as e:
+                raise ChunkedUploadError(
+                    status=http_status.HTTP_403_FORBIDDEN,
+                    detail=str(e),
+                )
+
+            chunked_upload = self.create_chunked_upload(
+                save=False,
+                filename=chunk.name,
+                user=request.user,
+                total_size=total,
+                fingerprint=request.POST.get("fingerprint", "")[:64],
+                checksum_algorithm=algorithm,
+                **self.get_extra_attrs(request),
+            )
+            chunked_upload.preallocate()
+            self._save(chunked_upload)
+
+        with measure(timings, "write"):
+            checksum = chunked_upload.write_range(chunk, start)
+
+        expected = request.POST.get("chunk_checksum")
+        if expected and expected.lower() != checksum:
+            raise ChunkedUploadError(
+                status=http_status.HTTP_400_BAD_REQUEST,
+                detail="Chunk checksum does not match",
+                start=start,
+            )
+
+        chunked_upload.mark_received(start, end, checksum, timings)
+        log_chunk_metrics(chunked_upload, end - start, timings)
+
+        return Response(
+            self.get_response_data(chunked_upload, request),
+            status=http_status.HTTP_200_OK,
+        )
+
+
+class UserChunkedUploadResumeView(LoginRequiredMixin, View):
+    """
+    Поиск незавершённой загрузки того же файла для возобновления после
+    закрытия вкладки: по имени, размеру и хешу начала файла.
+    Возвращает upload_id и карту уже полученных диапазонов.
+    """
+
+    def get(self, request):
+        try:
+            total_size = int(request.GET.get("size", ""))
+        except ValueError:
+            return JsonResponse(
+                {"success": False, "error": "Не указан размер файла"},
+                status=400,
+            )
+
+        chunked_upload = UserChunkedUpload.find_resumable(
+            user=request.user,
+            filename=request.GET.get("filename", ""),
+            total_size=total_size,
+            fingerprint=request.GET.get("fingerprint", ""),
+        )
+        if chunked_upload is None:
+            return JsonResponse(
+                {"success": False, "error": "Загрузка не найдена"},
+                status=404,
+            )
+
+        return JsonResponse(
+            {
+                "success": True,
+                "upload_id": chunked_upload.upload_id,
+                "offset": chunked_upload.offset,
+                "total": chunked_upload.total_size,
+                "ranges": chunked_upload.received_ranges,
+                "missing": chunked_upload.missing_ranges,
+                "expires": chunked_upload.expires_on.isoformat(),
+            },
+        )
+
 
 @method_decorator(ensure_csrf_cookie, name="dispatch")
 class UserChunkedUploadCompleteView(
@@ -54,27 +275,140 @@ class UserChunkedUploadCompleteView(
     Может также создавать плейлист и добавлять видео в него.
     """
 
+    model = UserChunkedUpload
+    # md5 по всему файлу проверяется только для клиентов, которые
+    # не прислали checksum, см. verify_checksum()
+    do_md5_check = False
+    # прямые загрузки завершает DirectUploadCompleteView
+    direct = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).filter(direct=self.direct)
+
+    def is_valid_chunked_upload(self, chunked_upload, data=None):
+        """
+        Загрузка не завершена ранее, все диапазоны файла получены
+        и контрольная сумма совпадает. data — поля с контрольной суммой,
+        по умолчанию POST запроса.
+        """
+        if chunked_upload.status == COMPLETE:
+            raise ChunkedUploadError(
+                status=http_status.HTTP_400_BAD_REQUEST,
+                detail="Upload has already been marked as complete",
+            )
+
+        if not chunked_upload.is_fully_received:
+            raise ChunkedUploadError(
+                status=http_status.HTTP_400_BAD_REQUEST,
+                detail="Upload is incomplete",
+                missing=chunked_upload.missing_ranges,
+            )
+
+        with measure(self.timings, "verify"):
+            self.verify_checksum(
+                chunked_upload,
+                self.request.POST if data is None else data,
+            )
+
+    def post(self, request, *args, **kwargs):
+        # длительности этапов завершения, см. save_timings()
+        self.timings = {}
+        self.started = time.monotonic()
+        return super().post(request, *args, **kwargs)
+
+    def post_save(self, chunked_upload, request, new=False):
+        if chunked_upload.status == COMPLETE:
+            # счётчик в кеше не откатится вместе с транзакцией
+            transaction.on_commit(
+                lambda: release_upload(
+                    chunked_upload.user_id,
+                    chunked_upload.total_size,
+                ),
+            )
+
+    def save_timings(self, *chunked_uploads):
+        """
+        Сохраняет этапы завершения (total — без отправки ответа) одним
+        UPDATE; у загрузок одной пачки этапы общие.
+        """
+        self.timings["total"] = time.monotonic() - self.started
+        UserChunkedUpload.objects.filter(
+            pk__in=[chunked_upload.pk for chunked_upload in chunked_uploads],
+        ).update(completion_timings=self.timings)
+        for chunked_upload in chunked_uploads:
+            log_completion_metrics(chunked_upload, self.timings)
+
+    def verify_checksum(self, chunked_upload, data):
+        """
+        checksum — не хеш файла, а хеш (алгоритмом загрузки, см.
+        CHECKSUM_ALGORITHMS) от склеенных по порядку hex-сумм чанков:
+        H(h(chunk_0) + h(chunk_1) + ... + h(chunk_n)). Сервер собирает его
+        из сумм, посчитанных при записи чанков, и файл не перечитывается.
+        Сумма зависит от границ чанков: клиент считает её по тем же кускам,
+        что отправлял. Если чанки присылались с разными границами (докачка
+        другим размером), суммы не покрывают файл встык — тогда нужен md5
+        всего файла, как у старых клиентов, и он считается чтением файла.
+        """
+        checksum = data.get("checksum")
+        if checksum:
+            expected = chunked_upload.get_checksum()
+            if expected is None:
+                raise ChunkedUploadError(
+                    status=http_status.HTTP_400_BAD_REQUEST,
+                    detail="Chunk checksums do not cover the file, send md5",
+                )
+
+            if checksum.lower() != expected:
+                raise ChunkedUploadError(
+                    status=http_status.HTTP_400_BAD_REQUEST,
+                    detail="checksum does not match",
+                )
+
+            return
+
+        md5 = data.get("md5")
+        if not md5:
+            raise ChunkedUploadError(
+                status=http_status.HTTP_400_BAD_REQUEST,
+                detail="Either 'checksum' or 'md5' is required",
+            )
+
+        self.md5_check(chunked_upload, md5)
+
     def get_response_data(self, chunked_upload, request=None):
         req = request or getattr(self, "request", None)
+        video = self.create_video(chunked_upload, req)
+        with measure(self.timings, "playlist"):
+            playlist_data = self.add_to_playlist(video, req)
+
+        response_data = {
+            "video_id": video.pk,
+            "video_url": video.file.url if video.file else None,
+            "title": video.title,
+            "file_size": video.file_size,
+        }
+
+        if playlist_data:
+            response_data["playlist"] = playlist_data
+
+        self.save_timings(chunked_upload)
+        return response_data
+
+    def create_video(self, chunked_upload, req):
         file_field = chunked_upload.file
 
         # Проверка прав доступа
         check_user_can_upload(req.user)
 
-        # Валидация файла
-        if file_field:
-            # Получаем имя файла (может быть путём, берём только имя)
-            raw_filename = (
-                getattr(chunked_upload, "filename", None) or file_field.name
-            )
-            filename = Path(raw_filename).name if raw_filename else "unknown"
+        # Валидация файла (может быть путём, берём только имя)
+        raw_filename = chunked_upload.filename or file_field.name
+        filename = Path(raw_filename).name if raw_filename else "unknown"
 
-            try:
-                validate_video_extension(filename)
-                if hasattr(file_field, "size"):
-                    validate_file_size(file_field.size)
-            except ValueError as e:
-                raise ValidationError(str(e))
+        try:
+            validate_video_extension(filename)
+            validate_file_size(chunked_upload.offset)
+        except ValueError as e:
+            raise ValidationError(str(e))
 
         # Получаем данные из запроса
         title = (
@@ -95,20 +429,27 @@ class UserChunkedUploadCompleteView(
         video = Video(
             title=title,
             description=description,
-            file=file_field,
             uploaded_by=(req.user if req is not None else None),
+            file_size=chunked_upload.offset,
         )
 
-        # Получаем размер файла
-        if file_field and hasattr(file_field, "size"):
-            video.file_size = file_field.size
-
         # Добавляем превью если есть
         if req and req.FILES.get("thumbnail"):
             video.thumbnail = req.FILES["thumbnail"]
 
-        video.save()
+        self.save_video(video, chunked_upload)
+        return video
 
+    def save_video(self, video, chunked_upload):
+        """Переносит собранный файл в video.file без копирования."""
+        if chunked_upload.file:
+            with measure(self.timings, "finalize"):
+                finalize_chunked_upload(chunked_upload, video)
+
+        with measure(self.timings, "video"):
+            video.save()
+
+    def add_to_playlist(self, video, req):
         # Обработка плейлиста
         playlist_id = req.POST.get("playlist_id") if req is not None else None
         playlist_title = (
@@ -128,14 +469,11 @@ class UserChunkedUploadCompleteView(
                 # Проверка владельца плейлиста
                 check_user_owns_playlist(req.user, playlist)
 
-                # Если order не передан, определяем его автоматически
-                if not order or order == "0":
-                    last_item = (
-                        PlaylistItem.objects.filter(playlist=playlist)
-                        .order_by("-order")
-                        .first()
-                    )
-                    order = (last_item.order + 1) if last_item else 1
+                # order — позиция в плейлисте, не передан — в конец
+                order = PlaylistItem.plan_ranks(
+                    playlist.pk,
+                    [int(order or 0)],
+                )[0]
 
                 # Проверяем, нет ли уже такой комбинации сезон/серия
                 existing_item = PlaylistItem.objects.filter(
@@ -162,7 +500,7 @@ class UserChunkedUploadCompleteView(
                     video=video,
                     season_number=int(season_number),
                     episode_number=int(episode_number),
-                    order=int(order),
+                    order=order,
                 )
 
                 playlist_data = {
@@ -186,16 +524,12 @@ class UserChunkedUploadCompleteView(
 
             playlist.save()
 
-            # Если order не передан, используем 1 для первого элемента
-            if not order or order == "0":
-                order = "1"
-
             PlaylistItem.objects.create(
                 playlist=playlist,
                 video=video,
                 season_number=int(season_number),
                 episode_number=int(episode_number),
-                order=int(order),
+                order=PlaylistItem.ORDER_STEP,
             )
 
             playlist_data = {
@@ -203,17 +537,404 @@ class UserChunkedUploadCompleteView(
                 "title": playlist.title,
             }
 
+        return playlist_data
+
+
+@method_decorator(ensure_csrf_cookie, name="dispatch")
+class UserChunkedUploadBatchCompleteView(UserChunkedUploadCompleteView):
+    """
+    Завершение нескольких загрузок одним запросом (например, сезона).
+
+    manifest — JSON вида {"playlist_id" | "playlist_title",
+    "playlist_description", "uploads": [{"upload_id", "checksum" | "md5",
+    "title", "description", "season_number", "episode_number", "order"},
+    ...]}. Номера серий и порядок назначаются за один проход по уже
+    занятым в плейлисте, элементы создаются одним bulk_create в общей
+    транзакции, а задачи обработки всех видео уходят одной группой Celery.
+    Превью видео передаются файлами thumbnail_<upload_id>.
+    """
+
+    def _post(self, request, *args, **kwargs):
+        try:
+            manifest = json.loads(request.POST.get("manifest", ""))
+            entries = manifest["uploads"]
+            upload_ids = [entry["upload_id"] for entry in entries]
+        except (ValueError, TypeError, KeyError) as e:
+            raise ChunkedUploadError(
+                status=http_status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid manifest: {e}",
+            )
+
+        if not entries or len(set(upload_ids)) != len(upload_ids):
+            raise ChunkedUploadError(
+                status=http_status.HTTP_400_BAD_REQUEST,
+                detail="Manifest must list distinct uploads",
+            )
+
+        try:
+            check_user_can_upload(request.user)
+        except PermissionDenied as e:
+            raise ChunkedUploadError(
+                status=http_status.HTTP_403_FORBIDDEN,
+                detail=str(e),
+            )
+
+        with transaction.atomic():
+            uploads = self.get_queryset(request).select_for_update()
+            uploads = uploads.filter(upload_id__in=upload_ids)
+            uploads = {upload.upload_id: upload for upload in uploads}
+            missing = [pk for pk in upload_ids if pk not in uploads]
+            if missing:
+                raise ChunkedUploadError(
+                    status=404,
+                    detail="Uploads not found",
+                    upload_ids=missing,
+                )
+
+            for entry in entries:
+                chunked_upload = uploads[entry["upload_id"]]
+                self.is_valid_chunked_upload(chunked_upload, entry)
+                self.validate_batch_upload(chunked_upload)
+
+            playlist = self.get_batch_playlist(manifest, request)
+            numbers = (
+                self.plan_playlist_numbers(playlist, entries)
+                if playlist is not None
+                else []
+            )
+            videos = [
+                self.create_batch_video(
+                    uploads[entry["upload_id"]],
+                    entry,
+                    request,
+                )
+                for entry in entries
+            ]
+
+            UserChunkedUpload.objects.filter(
+                pk__in=[upload.pk for upload in uploads.values()],
+            ).update(status=COMPLETE, completed_on=timezone.now())
+            transaction.on_commit(
+                lambda: release_upload(
+                    request.user.pk,
+                    sum(upload.total_size for upload in uploads.values()),
+                    len(uploads),
+                ),
+            )
+            PlaylistItem.objects.bulk_create(
+                PlaylistItem(
+                    playlist=playlist,
+                    video=video,
+                    season_number=season,
+                    episode_number=episode,
+                    order=order,
+                )
+                for video, (season, episode, order) in zip(videos, numbers)
+            )
+
+            # файлы переносятся только после коммита: откат транзакции
+            # не вернёт уже перенесённые файлы
+            pairs = [
+                (uploads[entry["upload_id"]], video)
+                for entry, video in zip(entries, videos)
+            ]
+            transaction.on_commit(lambda: self.finalize_batch(pairs))
+
+        self.save_timings(*uploads.values())
+
         response_data = {
-            "video_id": video.pk,
-            "video_url": video.file.url if video.file else None,
-            "title": video.title,
-            "file_size": video.file_size,
+            "videos": [
+                {
+                    "upload_id": entry["upload_id"],
+                    "video_id": video.pk,
+                    "video_url": video.file.url if video.file else None,
+                    "title": video.title,
+                    "file_size": video.file_size,
+                }
+                for entry, video in zip(entries, videos)
+            ],
         }
+        if playlist is not None:
+            response_data["playlist"] = {
+                "id": playlist.pk,
+                "title": playlist.title,
+            }
 
-        if playlist_data:
-            response_data["playlist"] = playlist_data
+        return Response(response_data, status=http_status.HTTP_200_OK)
+
+    def get_batch_playlist(self, manifest, request):
+        playlist_id = manifest.get("playlist_id")
+        if playlist_id:
+            try:
+                playlist = Playlist.objects.filter(pk=playlist_id).first()
+            except (TypeError, ValueError):
+                playlist = None
+
+            if playlist is None:
+                raise ChunkedUploadError(
+                    status=404,
+                    detail="Playlist not found",
+                    playlist_id=playlist_id,
+                )
+
+            try:
+                check_user_owns_playlist(request.user, playlist)
+            except PermissionDenied as e:
+                raise ChunkedUploadError(
+                    status=http_status.HTTP_403_FORBIDDEN,
+                    detail=str(e),
+                )
+
+            return playlist
+
+        if not manifest.get("playlist_title"):
+            return None
+
+        playlist = Playlist(
+            title=manifest["playlist_title"],
+            description=manifest.get("playlist_description", ""),
+            created_by=request.user,
+        )
+        if request.FILES.get("playlist_cover"):
+            playlist.cover_image = request.FILES["playlist_cover"]
+
+        playlist.save()
+        return playlist
+
+    def validate_batch_upload(self, chunked_upload):
+        try:
+            validate_video_extension(Path(chunked_upload.filename).name)
+            validate_file_size(chunked_upload.offset)
+        except ValueError as e:
+            raise ChunkedUploadError(
+                status=http_status.HTTP_400_BAD_REQUEST,
+                detail=str(e),
+                upload_id=chunked_upload.upload_id,
+            )
+
+    def create_batch_video(self, chunked_upload, entry, request):
+        video = Video(
+            title=entry.get("title") or Path(chunked_upload.filename).name,
+            description=entry.get("description", ""),
+            uploaded_by=request.user,
+            file_size=chunked_upload.offset,
+        )
+        thumbnail = request.FILES.get(f"thumbnail_{chunked_upload.upload_id}")
+        if thumbnail:
+            video.thumbnail = thumbnail
+
+        # файл и задачи — после коммита всей пачки, см. finalize_batch
+        with measure(self.timings, "video"):
+            video.save(_skip_tasks=True)
+        return video
+
+    def plan_playlist_numbers(self, playlist, entries):
+        """
+        (сезон, серия, ранг) для каждой записи манифеста. Занятые пары
+        сезон/серия читаются одним запросом; при конфликте серия
+        становится следующей после последней в сезоне, как и при
+        одиночной загрузке.
+        """
+        taken = set(
+            PlaylistItem.objects.filter(playlist=playlist).values_list(
+                "season_number",
+                "episode_number",
+            ),
+        )
+
+        numbers, positions = [], []
+        for entry in entries:
+            try:
+                season = int(entry.get("season_number") or 1)
+                episode = int(entry.get("episode_number") or 1)
+                positions.append(int(entry.get("order") or 0))
+            except (TypeError, ValueError) as e:
+                raise ChunkedUploadError(
+                    status=http_status.HTTP_400_BAD_REQUEST,
+                    detail=str(e),
+                    upload_id=entry["upload_id"],
+                )
+
+            if (season, episode) in taken:
+                episode = max(e for s, e in taken if s == season) + 1
+
+            taken.add((season, episode))
+            numbers.append((season, episode))
+
+        # order в манифесте — позиция в плейлисте
+        ranks = PlaylistItem.plan_ranks(playlist.pk, positions)
+        return [
+            (season, episode, rank)
+            for (season, episode), rank in zip(numbers, ranks)
+        ]
+
+    def finalize_batch(self, pairs):
+        """
+        Переносит файлы загрузок в видео закоммиченной пачки и ставит
+        их обработку. Видео, файл которого перенести не удалось,
+        помечается ошибкой; файл остаётся у загрузки.
+        """
+        videos = []
+        with measure(self.timings, "finalize"):
+            for chunked_upload, video in pairs:
+                if not chunked_upload.file:
+                    continue
+
+                try:
+                    finalize_chunked_upload(chunked_upload, video)
+                except OSError as e:
+                    logger.exception(
+                        "Не удалось перенести файл загрузки %s",
+                        chunked_upload.upload_id,
+                    )
+                    Video.objects.filter(pk=video.pk).update(
+                        hls_status="error",
+                        hls_log=f"Перенос файла загрузки: {e}",
+                    )
+                    continue
+
+                # без save(): оно приняло бы файл за замену и сбросило
+                # размер и состояние обработки
+                Video.objects.filter(pk=video.pk).update(file=video.file.name)
+                video._original_file_name = video.file.name
+                videos.append(video)
+
+        if videos:
+            self.enqueue_processing(videos)
+
+    def enqueue_processing(self, videos):
+        """Метаданные и HLS всех видео пачки — одной группой задач."""
+        group(
+            [extract_video_metadata.s(video.pk) for video in videos]
+            + [hls_job_signature(video) for video in videos],
+        ).apply_async()
+
+
+class DirectUploadStartView(LoginRequiredMixin, View):
+    """
+    Выдаёт тикет прямой загрузки: чанки идут PUT-запросами в nginx и
+    пишутся на диск, минуя воркеры Django. С upload_id — продлевает тикет
+    существующей загрузки и возвращает уже полученные диапазоны.
+    """
+
+    def post(self, request):
+        if not settings.DIRECT_UPLOAD_ENABLED:
+            return JsonResponse(
+                {"success": False, "error": "Прямая загрузка отключена"},
+                status=404,
+            )
+
+        try:
+            check_user_can_upload(request.user)
+            upload_id = request.POST.get("upload_id")
+            if upload_id:
+                chunked_upload = get_object_or_404(
+                    UserChunkedUpload,
+                    upload_id=upload_id,
+                    user=request.user,
+                    direct=True,
+                    status=UPLOADING,
+                )
+                # чанки идут мимо Django: продление тикета — единственный
+                # признак активности загрузки для сборщика мусора
+                chunked_upload.save(update_fields=["updated_on"])
+            else:
+                filename = Path(request.POST.get("filename", "")).name
+                total_size = int(request.POST.get("size", ""))
+                validate_video_extension(filename)
+                validate_file_size(total_size)
+                reserve_upload(request.user, total_size)
+                chunked_upload = UserChunkedUpload.objects.create(
+                    user=request.user,
+                    filename=filename,
+                    total_size=total_size,
+                    fingerprint=request.POST.get("fingerprint", "")[:64],
+                    direct=True,
+                )
+        except PermissionDenied as e:
+            return JsonResponse(
+                {"success": False, "error": str(e)},
+                status=403,
+            )
+        except ValueError as e:
+            return JsonResponse(
+                {"success": False, "error": str(e)},
+                status=400,
+            )
+
+        ranges = merge_ranges(
+            [
+                [start, end]
+                for start, end, _path in collect_direct_upload_parts(
+                    chunked_upload,
+                )
+            ],
+        )
+        return JsonResponse(
+            {
+                "success": True,
+                "upload_id": chunked_upload.upload_id,
+                "ranges": ranges,
+                **issue_direct_upload_ticket(chunked_upload),
+            },
+        )
 
-        return response_data
+
+@method_decorator(ensure_csrf_cookie, name="dispatch")
+class DirectUploadCompleteView(UserChunkedUploadCompleteView):
+    """
+    Колбэк завершения прямой загрузки: проверяет, что nginx получил все
+    диапазоны, создаёт видео и отдаёт сборку файла в Celery.
+    """
+
+    direct = True
+
+    def verify_checksum(self, chunked_upload, data):
+        # чанки пишет nginx, и файла ещё нет: checksum (как у обычной
+        # загрузки — от склеенных сумм частей) сверяет assemble_direct_upload
+        if not data.get("checksum"):
+            raise ChunkedUploadError(
+                status=http_status.HTTP_400_BAD_REQUEST,
+                detail="'checksum' is required",
+            )
+
+    def save_video(self, video, chunked_upload):
+        with measure(self.timings, "video"):
+            video.save(_skip_tasks=True)
+
+        transaction.on_commit(
+            lambda: assemble_direct_upload.delay(
+                chunked_upload.upload_id,
+                video.pk,
+                self.request.POST["checksum"],
+            ),
+        )
+
+    def _post(self, request, *args, **kwargs):
+        chunked_upload = get_object_or_404(
+            self.get_queryset(request),
+            upload_id=request.POST.get("upload_id"),
+        )
+        chunked_upload.received_ranges = merge_ranges(
+            [
+                [start, end]
+                for start, end, _path in collect_direct_upload_parts(
+                    chunked_upload,
+                )
+            ],
+        )
+        chunked_upload.offset = sum(
+            end - start for start, end in chunked_upload.received_ranges
+        )
+        self.is_valid_chunked_upload(chunked_upload)
+
+        chunked_upload.status = COMPLETE
+        chunked_upload.completed_on = timezone.now()
+        self._save(chunked_upload)
+        return Response(
+            self.get_response_data(chunked_upload, request),
+            status=http_status.HTTP_200_OK,
+        )
 
 
 class UserUploadPageView(LoginRequiredMixin, TemplateView):
@@ -229,6 +950,7 @@ class UserUploadPageView(LoginRequiredMixin, TemplateView):
         context["user_playlists"] = Playlist.objects.filter(
             created_by=self.request.user,
         ).order_by("-created_at")
+        context["direct_upload_enabled"] = settings.DIRECT_UPLOAD_ENABLED
         return context
 
 
@@ -252,7 +974,7 @@ class PlaylistVideosView(LoginRequiredMixin, View):
             )
 
             videos = []
-            for item in items:
+            for position, item in enumerate(items, 1):
                 videos.append(
                     {
                         "id": item.id,
@@ -266,7 +988,9 @@ class PlaylistVideosView(LoginRequiredMixin, View):
                         ),
                         "season_number": item.season_number,
                         "episode_number": item.episode_number,
-                        "order": item.order,
+                        # позиция для интерфейса, ранг — для сортировки
+                        "order": position,
+                        "rank": item.order,
                         "duration": item.video.duration,
                         "file_size": item.video.file_size,
                         "created_at": (
@@ -386,7 +1110,12 @@ class UpdateVideoMetadataView(LoginRequiredMixin, View):
 
 class UpdatePlaylistOrderView(LoginRequiredMixin, View):
     """
-    API для обновления порядка видео в плейлисте
+    API для обновления порядка видео в плейлисте.
+
+    {"move": {"item": id, "before": id} | {"item": id, "after": id}} —
+    перемещение одного элемента, меняет только его строку.
+    {"items": [{id, order, season_number, episode_number}, ...]} — полный
+    порядок (order — позиция), сохраняется одним bulk_update.
     """
 
     @method_decorator(csrf_exempt)
@@ -397,12 +1126,13 @@ class UpdatePlaylistOrderView(LoginRequiredMixin, View):
         try:
             data = json.loads(request.body)
             playlist_id = data.get("playlist_id")
+            move = data.get("move")
             items = data.get(
                 "items",
                 [],
             )  # [{id: item_id, order: new_order, season: N, episode: N}, ...]
 
-            if not playlist_id or not items:
+            if not playlist_id or not (items or move):
                 return JsonResponse(
                     {
                         "success": False,
@@ -416,24 +1146,19 @@ class UpdatePlaylistOrderView(LoginRequiredMixin, View):
             # Проверка прав доступа
             check_user_owns_playlist(request.user, playlist)
 
+            if move:
+                return self.move_item(playlist, move)
+
             # Обновляем порядок в транзакции
             with transaction.atomic():
-                for item_data in items:
-                    item = PlaylistItem.objects.get(
-                        pk=item_data["id"],
-                        playlist=playlist,
-                    )
-                    item.order = item_data["order"]
-                    if "season_number" in item_data:
-                        item.season_number = item_data["season_number"]
-
-                    if "episode_number" in item_data:
-                        item.episode_number = item_data["episode_number"]
-
-                    item.save()
+                updated = self.reorder(playlist, items)
 
             return JsonResponse(
-                {"success": True, "message": "Порядок успешно обновлен"},
+                {
+                    "success": True,
+                    "message": "Порядок успешно обновлен",
+                    "updated": updated,
+                },
             )
 
         except Playlist.DoesNotExist:
@@ -459,3 +1184,84 @@ class UpdatePlaylistOrderView(LoginRequiredMixin, View):
                 },
                 status=500,
             )
+
+    def move_item(self, playlist, move):
+        """
+        Перемещение элемента к соседу before (или after, если before не
+        указан). Неизвестные элементы — 404, некорректные id и
+        перемещение относительно самого себя — 400.
+        """
+        side = "before" if move.get("before") else "after"
+        try:
+            item_id = int(move["item"])
+            anchor_id = int(move[side]) if move.get(side) else None
+        except (KeyError, TypeError, ValueError):
+            return JsonResponse(
+                {"success": False, "error": "Некорректный id элемента"},
+                status=400,
+            )
+
+        if anchor_id is None:
+            return JsonResponse(
+                {"success": False, "error": "Не указан соседний элемент"},
+                status=400,
+            )
+
+        if anchor_id == item_id:
+            return JsonResponse(
+                {
+                    "success": False,
+                    "error": "Элемент нельзя переместить к самому себе",
+                },
+                status=400,
+            )
+
+        items = PlaylistItem.objects.filter(playlist=playlist)
+        item = items.get(pk=item_id)
+        anchor = items.get(pk=anchor_id)
+        rebalanced = item.move(**{side: anchor})
+        return JsonResponse(
+            {
+                "success": True,
+                "message": "Порядок успешно обновлен",
+                "rank": item.order,
+                "rebalanced": rebalanced,
+            },
+        )
+
+    def reorder(self, playlist, items):
+        """
+        Ранги по позициям из items; элементы плейлиста, которых нет
+        в списке, сохраняют свой порядок после перечисленных.
+        Записываются только изменившиеся строки.
+        """
+        current = list(PlaylistItem.objects.filter(playlist=playlist))
+        by_id = {item.pk: item for item in current}
+        listed = sorted(items, key=lambda item_data: item_data["order"])
+        listed_ids = [int(item_data["id"]) for item_data in listed]
+        if any(pk not in by_id for pk in listed_ids):
+            raise PlaylistItem.DoesNotExist
+
+        listed_set = set(listed_ids)
+        unlisted = [item for item in current if item.pk not in listed_set]
+        sequence = [by_id[pk] for pk in listed_ids] + unlisted
+        changed = {}
+        for position, item in enumerate(sequence, 1):
+            if item.order != position * PlaylistItem.ORDER_STEP:
+                item.order = position * PlaylistItem.ORDER_STEP
+                changed[item.pk] = item
+
+        for item_data in items:
+            item = by_id[int(item_data["id"])]
+            for field in ("season_number", "episode_number"):
+                if field in item_data and getattr(item, field) != int(
+                    item_data[field],
+                ):
+                    setattr(item, field, int(item_data[field]))
+                    changed[item.pk] = item
+
+        PlaylistItem.objects.bulk_update(
+            changed.values(),
+            ["order", "season_number", "episode_number"],
+        )
+        return len(changed)
@@ -5,7 +5,7 @@ from django.urls import reverse_lazy
 from django.views import View
 from django.views.generic import DeleteView, DetailView, ListView, UpdateView
 
-from upload.models import Video
+from upload.models import UserStorage, Video
 
 __all__ = []
 
@@ -62,6 +62,9 @@ class MyVideosListView(LoginRequiredMixin, ListView):
             uploaded_by=self.request.user,
         ).count()
         context["total_videos"] = total_videos
+        context["storage"] = UserStorage.objects.filter(
+            user=self.request.user,
+        ).first() or UserStorage(user=self.request.user)
 
         # Статусы для фильтра
         context["available_statuses"] = [